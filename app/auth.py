@@ -1,6 +1,6 @@
 import os
 import jwt
-from fastapi import HTTPException, Security
+from fastapi import Depends, HTTPException, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from dotenv import load_dotenv
 
@@ -42,3 +42,30 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Security(security))
     except Exception as e:
         print(f"Token verification failed: {str(e)}")
         raise HTTPException(status_code=401, detail=f"Authentication failed: {str(e)}")
+
+
+# Plan names (from app_metadata, which only the service role can write) → scheduler tier
+PAID_PLANS = {"paid", "pro", "premium", "team"}
+
+
+def get_user_tier(payload: dict) -> str:
+    """
+    Returns the scheduling tier ("paid" or "free") for a decoded token.
+    user_metadata is ignored on purpose - users can edit it themselves.
+    """
+    app_metadata = payload.get("app_metadata") or {}
+    plan = str(app_metadata.get("tier") or app_metadata.get("plan") or "free").lower()
+    return "paid" if plan in PAID_PLANS else "free"
+
+
+def is_admin(payload: dict) -> bool:
+    """True for tokens whose app_metadata.role is "admin" (only the service role can set it)."""
+    app_metadata = payload.get("app_metadata") or {}
+    return str(app_metadata.get("role") or "").lower() == "admin"
+
+
+def require_admin(payload: dict = Depends(verify_token)) -> dict:
+    """verify_token for operational endpoints: 403 unless the token belongs to an admin."""
+    if not is_admin(payload):
+        raise HTTPException(status_code=403, detail="Admins only")
+    return payload
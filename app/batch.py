@@ -0,0 +1,490 @@
+"""
+Batch generation - turns a list of prompts into videos in one run.
+
+Flow:
+1. Dedupe prompts → each distinct prompt is generated once
+2. Skip prompts an earlier run of the batch already finished → resumable
+3. Classify and extract in batched LLM calls → one call per chunk, not per prompt
+4. Raw LLM fallback for prompts no template matched (run concurrently)
+5. Render across a process pool as soon as each prompt is generated →
+   LLM calls and renders overlap, throughput scales with cores
+   (template prompts render their Scene class directly in the warm worker)
+6. Keep a manifest mapping every prompt to its video, plus stage timings
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.duration_budget import apply_duration_budget
+from app.postprocess import defer_optimizations, optimize_in_background, wait_for_optimizations
+from app.profiling import propagate
+from app.render_cost import render_cost_model, script_features, template_features
+from app.renderer import OUTPUT_DIR, QUALITY_DIRS, render_manim_script, render_template_scene, video_url_for
+from app.script_gen import detect_intents, generate_script_with_raw_llm, save_script
+from app.storage import video_store
+from app.template_engine import classify_prompts, extract_parameters_batch, validate_template_params
+
+BATCH_DIR = os.path.join(OUTPUT_DIR, "batch")
+
+# Prompts per batched LLM call - keeps responses well inside the output token limit
+LLM_CHUNK_SIZE = int(os.getenv("BATCH_LLM_CHUNK_SIZE", "10"))
+
+# Most prompts one POST /batch may submit
+BATCH_MAX_PROMPTS = int(os.getenv("BATCH_MAX_PROMPTS", "200"))
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalizes a prompt for duplicate detection (case and whitespace)."""
+    return " ".join(prompt.split()).lower()
+
+
+def prompt_key(prompt: str) -> str:
+    """Stable identifier for a prompt, used for script and video names."""
+    return hashlib.sha1(normalize_prompt(prompt).encode("utf-8")).hexdigest()[:12]
+
+
+def dedupe_prompts(prompts: List[str]) -> List[str]:
+    """Drops empty and duplicate prompts, keeping the first spelling of each."""
+    seen = set()
+    unique = []
+    for prompt in prompts:
+        key = normalize_prompt(prompt)
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(prompt.strip())
+    return unique
+
+
+def load_prompts_file(path: str) -> List[str]:
+    """
+    Reads prompts from a file.
+
+    - .json: a list of strings
+    - .jsonl: one JSON string (or {"prompt": ...} object) per line
+    - anything else: one prompt per line, blank lines and # comments ignored
+    """
+    text = Path(path).read_text(encoding="utf-8")
+    suffix = Path(path).suffix.lower()
+
+    if suffix == ".json":
+        return [str(p) for p in json.loads(text)]
+
+    if suffix == ".jsonl":
+        prompts = []
+        for line in text.splitlines():
+            if line.strip():
+                item = json.loads(line)
+                prompts.append(item["prompt"] if isinstance(item, dict) else str(item))
+        return prompts
+
+    return [
+        line.strip() for line in text.splitlines()
+        if line.strip() and not line.strip().startswith("#")
+    ]
+
+
+def _chunks(items: List[Any], size: int) -> List[List[Any]]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def scene_name(prompt: str) -> str:
+    """Script module / video folder name of a prompt (the same in every batch)."""
+    return f"scene_{prompt_key(prompt)}"
+
+
+def existing_video(prompt: str, quality: str) -> Optional[str]:
+    """URL of the prompt's video if an earlier run already rendered it."""
+    path = Path(OUTPUT_DIR) / "videos" / scene_name(prompt) / QUALITY_DIRS[quality] / "scene.mp4"
+    if path.exists() and path.stat().st_size > 0:
+        return video_url_for(scene_name(prompt), quality)
+    return None
+
+
+def load_generated(prompt: str, batch_dir: str) -> Optional[Dict[str, Any]]:
+    """Script or template params an earlier run of this batch generated, so resuming skips the LLM."""
+    params_path = os.path.join(batch_dir, f"{scene_name(prompt)}.params.json")
+    script_path = os.path.join(batch_dir, f"{scene_name(prompt)}.py")
+    if os.path.exists(params_path):
+        saved = json.loads(Path(params_path).read_text(encoding="utf-8"))
+        return {"script_path": None, **saved, "status": "generated", "error": None}
+    if os.path.exists(script_path):
+        return {"script_path": script_path, "status": "generated", "error": None}
+    return None
+
+
+class StageTimer:
+    """
+    Per-stage counters: busy time (summed over concurrent calls) and wall
+    time (first start to last finish), to see which stage bounds a batch.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, float]] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        end = time.monotonic()
+        with self._lock:
+            stats = self._stages.setdefault(stage, {"count": 0, "busy": 0.0, "start": end - seconds, "end": end})
+            stats["count"] += 1
+            stats["busy"] += seconds
+            stats["start"] = min(stats["start"], end - seconds)
+            stats["end"] = max(stats["end"], end)
+
+    @contextmanager
+    def measure(self, stage: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(stage, time.monotonic() - started)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                stage: {
+                    "count": int(stats["count"]),
+                    "busy_seconds": round(stats["busy"], 2),
+                    "wall_seconds": round(stats["end"] - stats["start"], 2),
+                    "avg_seconds": round(stats["busy"] / stats["count"], 2),
+                }
+                for stage, stats in self._stages.items()
+            }
+
+
+def print_timings(timings: Dict[str, Dict[str, float]], total_seconds: float) -> None:
+    print("\n⏱️  Stage timings:")
+    for stage, t in timings.items():
+        print(f"   {stage:<9} {t['count']:>4} × {t['avg_seconds']:>6.2f}s avg"
+              f" | busy {t['busy_seconds']:>8.1f}s | wall {t['wall_seconds']:>8.1f}s")
+    print(f"   {'total':<9} {total_seconds:.1f}s")
+
+
+class BatchProgress:
+    """Live generate/render progress bars (rich); does nothing when disabled."""
+
+    def __init__(self, total: int, enabled: bool = False):
+        self.total = total
+        self.enabled = enabled and total > 0
+        self.progress = None
+        self.tasks: Dict[str, Any] = {}
+        self.failed = {"generate": 0, "render": 0}
+
+    def __enter__(self):
+        if self.enabled:
+            from rich.progress import (BarColumn, MofNCompleteColumn, Progress, TextColumn,
+                                       TimeElapsedColumn, TimeRemainingColumn)
+            self.progress = Progress(
+                TextColumn("{task.description:<9}"),
+                BarColumn(),
+                MofNCompleteColumn(),
+                TextColumn("[red]{task.fields[failed]} failed"),
+                TimeElapsedColumn(),
+                TimeRemainingColumn(),
+            )
+            self.progress.__enter__()
+            for stage in ("generate", "render"):
+                self.tasks[stage] = self.progress.add_task(stage.capitalize(), total=self.total, failed=0)
+        return self
+
+    def advance(self, stage: str, failed: bool = False) -> None:
+        if failed:
+            self.failed[stage] += 1
+        if self.progress is not None:
+            self.progress.update(self.tasks[stage], advance=1, failed=self.failed[stage])
+
+    def __exit__(self, *exc) -> bool:
+        if self.progress is not None:
+            self.progress.__exit__(*exc)
+        return False
+
+
+def generate_scripts_batch(prompts: List[str], batch_dir: str, model: str = "gemini-2.0-flash", llm_workers: int = 4,
+                           on_result: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                           timer: Optional[StageTimer] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Generates a script for every (already deduped) prompt.
+
+    Classification chunks run concurrently, then extraction chunks and raw
+    generation run side by side on the same thread pool. on_result is
+    called (from a worker thread) as soon as each prompt is done, so
+    rendering can start before the rest of the batch is generated. Pool
+    threads run in the caller's context (e.g. gemini_client.background()).
+
+    Returns:
+        Dictionary prompt → {"script_path", "status", "error"}, plus
+        {"template", "params"} for prompts that render from a template
+    """
+    results = {}
+    timer = timer or StageTimer()
+    Path(batch_dir).mkdir(parents=True, exist_ok=True)
+
+    def finish(prompt: str, result: Dict[str, Any]) -> None:
+        results[prompt] = result
+        if on_result is not None:
+            on_result(prompt, result)
+
+    def classify(chunk: List[str]) -> List[Tuple[Optional[str], Any]]:
+        with timer.measure("classify"):
+            return classify_prompts(chunk)
+
+    # Raw LLM fallback, one call per prompt but run concurrently
+    def run_raw(prompt: str, intent: str) -> None:
+        script_path = os.path.join(batch_dir, f"{scene_name(prompt)}.py")
+        try:
+            with timer.measure("raw_llm"):
+                code = generate_script_with_raw_llm(prompt, model, script_path, intent=intent)
+        except Exception as e:
+            finish(prompt, {"script_path": None, "status": "failed", "error": str(e)})
+            return
+        if code:
+            save_script(code, script_path)
+            finish(prompt, {"script_path": script_path, "status": "generated", "error": None})
+        else:
+            finish(prompt, {"script_path": None, "status": "failed", "error": "Script generation failed"})
+
+    def submit_raw(pool: ThreadPoolExecutor, raw_prompts: List[str]) -> List[Future]:
+        if not raw_prompts:
+            return []
+        print(f"🔄 Falling back to raw LLM generation for {len(raw_prompts)} prompts...")
+        # Intents are detected for all of them in one batched encode
+        intents = detect_intents(raw_prompts)
+        return [pool.submit(propagate(run_raw), prompt, intent) for prompt, intent in zip(raw_prompts, intents)]
+
+    def extract(pool: ThreadPoolExecutor, template_name: str, chunk: List[str]) -> List[Future]:
+        with timer.measure("extract"):
+            extracted = extract_parameters_batch(template_name, chunk)
+        failed = []
+        for prompt, params in zip(chunk, extracted):
+            # Template prompts skip codegen: the render worker builds the Scene from params
+            is_valid, error_msg = validate_template_params(template_name, params)
+            if is_valid:
+                # Saved so a resumed run renders it without asking the LLM again
+                params_path = os.path.join(batch_dir, f"{scene_name(prompt)}.params.json")
+                Path(params_path).write_text(
+                    json.dumps({"template": template_name, "params": params}), encoding="utf-8"
+                )
+                finish(prompt, {
+                    "script_path": None,
+                    "template": template_name,
+                    "params": params,
+                    "status": "generated",
+                    "error": None,
+                })
+            else:
+                print(f"❌ Template generation failed for '{prompt}': {error_msg}")
+                failed.append(prompt)
+        return submit_raw(pool, failed)
+
+    with ThreadPoolExecutor(max_workers=llm_workers) as pool:
+        # Step 1: Classify in chunks
+        print(f"\n📋 Classifying {len(prompts)} prompts in batches of {LLM_CHUNK_SIZE}...")
+        classifications = []
+        for chunk_result in pool.map(propagate(classify), _chunks(prompts, LLM_CHUNK_SIZE)):
+            classifications.extend(chunk_result)
+
+        by_template: Dict[str, List[str]] = {}
+        raw_prompts = []
+        for prompt, (template_name, _) in zip(prompts, classifications):
+            if template_name:
+                by_template.setdefault(template_name, []).append(prompt)
+            else:
+                raw_prompts.append(prompt)
+
+        # Step 2: Extract parameters per template (in chunks) alongside raw generation
+        futures = []
+        for template_name, template_prompts in by_template.items():
+            print(f"🔍 Extracting parameters for {len(template_prompts)} {template_name} prompts...")
+            for chunk in _chunks(template_prompts, LLM_CHUNK_SIZE):
+                futures.append(pool.submit(propagate(extract), pool, template_name, chunk))
+        futures += submit_raw(pool, raw_prompts)
+
+        # Extraction queues its raw fallbacks on the same pool - wait for those too
+        for future in futures:
+            for fallback in future.result() or []:
+                fallback.result()
+
+    return results
+
+
+def _timed_call(fn: Callable[..., Any], *args) -> Tuple[Any, float]:
+    """Runs fn in a pool worker and returns (result, seconds)."""
+    started = time.monotonic()
+    result = fn(*args)
+    return result, time.monotonic() - started
+
+
+def _predicted_seconds(result: Dict[str, Any], quality: str) -> float:
+    if result.get("template"):
+        features = template_features(result["template"], result["params"])
+    else:
+        features = script_features(Path(result["script_path"]).read_text(encoding="utf-8"))
+    return render_cost_model.predict(features, quality) or float("inf")
+
+
+def write_manifest(manifest: Dict[str, Any], path: str) -> None:
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Path(path).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+
+
+def run_batch(prompts: List[str], batch_id: Optional[str] = None, quality: str = "l", model: str = "gemini-2.0-flash",
+              llm_workers: int = 4, render_workers: Optional[int] = None, resume: bool = True,
+              progress: bool = False, owner: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Generates and renders videos for a list of prompts.
+
+    Args:
+        resume: Skip prompts whose video already exists and reuse the
+            scripts/params an earlier run of the same batch_id generated
+        progress: Show live progress bars (Manim's own output is silenced)
+        owner: User id of whoever submitted the batch (API batches), kept
+            in the manifest so only they can read it
+
+    Returns:
+        The manifest, also written to <batch_dir>/manifest.json
+    """
+    started = time.monotonic()
+    batch_id = batch_id or datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    batch_dir = os.path.join(BATCH_DIR, batch_id)
+    manifest_path = os.path.join(batch_dir, "manifest.json")
+    render_workers = render_workers or os.cpu_count() or 1
+
+    unique_prompts = dedupe_prompts(prompts)
+    results: Dict[str, Dict[str, Any]] = {}
+    generated: Dict[str, Dict[str, Any]] = {}
+    to_generate = []
+    for prompt in unique_prompts:
+        video_url = existing_video(prompt, quality) if resume else None
+        saved = load_generated(prompt, batch_dir) if resume else None
+        if video_url:
+            results[prompt] = {**(saved or {"script_path": None}), "video_url": video_url, "status": "rendered"}
+        elif saved:
+            generated[prompt] = saved
+        else:
+            to_generate.append(prompt)
+
+    print(f"📦 Batch {batch_id}: {len(prompts)} prompts, {len(unique_prompts)} unique")
+    if results or generated:
+        print(f"⏩ Resuming: {len(results)} already rendered, {len(generated)} already generated")
+
+    manifest = {
+        "batch_id": batch_id,
+        "owner": owner,
+        "status": "running",
+        "quality": quality,
+        "items": [],
+    }
+
+    def save_manifest() -> None:
+        # Every original prompt gets an entry, duplicates point at the same video
+        by_key = {normalize_prompt(p): results.get(p, {}) for p in unique_prompts}
+        unfinished = "pending" if manifest["status"] != "completed" else "failed"
+        manifest["items"] = []
+        for prompt in prompts:
+            key = normalize_prompt(prompt)
+            if not key:
+                continue
+            result = by_key.get(key, {})
+            manifest["items"].append({
+                "prompt": prompt,
+                "video_url": result.get("video_url"),
+                "script_path": result.get("script_path"),
+                "status": result.get("status", unfinished),
+                "error": result.get("error"),
+            })
+        write_manifest(manifest, manifest_path)
+
+    save_manifest()
+
+    timer = StageTimer()
+    lock = threading.Lock()
+    render_futures: List[Future] = []
+    render_features: Dict[str, Optional[Dict[str, float]]] = {}
+
+    with BatchProgress(len(generated) + len(to_generate), enabled=progress) as bar, \
+            ProcessPoolExecutor(max_workers=render_workers, initializer=defer_optimizations) as pool:
+
+        def rendered(prompt: str, future: Future) -> None:
+            with lock:
+                try:
+                    video_url, seconds = future.result()
+                    timer.add("render", seconds)
+                    render_cost_model.record(render_features.pop(prompt, None), quality, seconds)
+                    video_store.offload(video_url)
+                    # Re-encoded here, not in the pool process, so the upload of the result isn't lost with it
+                    optimize_in_background(video_url)
+                    results[prompt].update({"video_url": video_url, "status": "rendered"})
+                    bar.advance("render")
+                except Exception as e:
+                    print(f"❌ Render failed for '{prompt}': {e}")
+                    results[prompt].update({"status": "failed", "error": str(e)})
+                    bar.advance("render", failed=True)
+                # Written after every video, so an interrupted run still records what finished
+                save_manifest()
+
+        def submit_render(prompt: str, result: Dict[str, Any]) -> None:
+            with lock:
+                results[prompt] = result
+                if result["status"] != "generated":
+                    bar.advance("generate", failed=True)
+                    bar.advance("render", failed=True)
+                    save_manifest()
+                    return
+                bar.advance("generate")
+
+            if result.get("template"):
+                render_features[prompt] = template_features(result["template"], result["params"])
+                future = pool.submit(
+                    _timed_call, render_template_scene,
+                    result["template"], result["params"], scene_name(prompt), quality, progress
+                )
+            else:
+                apply_duration_budget(result["script_path"], quality)
+                render_features[prompt] = script_features(Path(result["script_path"]).read_text(encoding="utf-8"))
+                future = pool.submit(
+                    _timed_call, render_manim_script,
+                    result["script_path"], "GeneratedScene", quality, False, "scene.mp4", progress
+                )
+            render_futures.append(future)
+            future.add_done_callback(lambda f, p=prompt: rendered(p, f))
+
+        print(f"\n🎬 Rendering on {render_workers} workers as scripts become ready...")
+        try:
+            # Already generated (resumed) prompts: shortest predicted render first
+            for prompt, result in sorted(generated.items(), key=lambda item: _predicted_seconds(item[1], quality)):
+                submit_render(prompt, result)
+            if to_generate:
+                generate_scripts_batch(
+                    to_generate, batch_dir, model=model, llm_workers=llm_workers,
+                    on_result=submit_render, timer=timer
+                )
+            wait(render_futures)
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            with lock:
+                manifest["status"] = "interrupted"
+                save_manifest()
+            print(f"\n⏸️  Interrupted - run again with --batch-id {batch_id} to resume")
+            raise
+
+    # Re-encodes and uploads run in the background - don't let a CLI run exit before they finish
+    wait_for_optimizations()
+    video_store.wait()
+
+    manifest["status"] = "completed"
+    manifest["timings"] = timer.summary()
+    save_manifest()
+
+    rendered_count = sum(1 for r in results.values() if r.get("status") == "rendered")
+    print(f"✅ Batch {batch_id} done: {rendered_count}/{len(unique_prompts)} videos rendered")
+    print_timings(manifest["timings"], time.monotonic() - started)
+    print(f" Manifest saved to: {manifest_path}")
+    return manifest
@@ -1,6 +1,77 @@
 from app.supabase_client import supabase, supabase_admin
 from app.models import Message
+import os
+import time
 import uuid
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+# Chat lists and histories are polled; reads are served from memory for this long.
+# Writes through this module invalidate right away, the TTL only bounds staleness
+# from writes made elsewhere (other API nodes, the dashboard).
+CHAT_CACHE_TTL_SECONDS = float(os.getenv("CHAT_CACHE_TTL_SECONDS", "10"))
+CHAT_CACHE_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "10000"))
+
+
+class ReadCache:
+    """
+    TTL cache for database reads, invalidated by key on writes.
+
+    A read that started before an invalidation of its key isn't stored,
+    so a slow read can't put pre-write data back into the cache.
+    """
+
+    def __init__(self, ttl_seconds: float = CHAT_CACHE_TTL_SECONDS, max_entries: int = CHAT_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._generations: Dict[Hashable, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generations.get(key, 0)
+
+        value = load()
+        if self.ttl_seconds <= 0:
+            return value
+        with self._lock:
+            if self._generations.get(key, 0) == generation:
+                self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def invalidate_where(self, predicate: Callable[[Hashable, Any], bool]) -> None:
+        """Invalidates every cached entry the predicate matches."""
+        with self._lock:
+            keys = [key for key, (_, value) in self._entries.items() if predicate(key, value)]
+        for key in keys:
+            self.invalidate(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+chat_cache = ReadCache()
+
 
 def create_chat(user_id: str, title: str, chat_id: str = None) -> str:
     """Creates a new chat for the user and returns the chat_id"""
@@ -14,6 +85,7 @@ def create_chat(user_id: str, title: str, chat_id: str = None) -> str:
         data["id"] = chat_id
         
     response = client.table("chats").insert(data).execute()
+    chat_cache.invalidate(("chats", user_id))
     return response.data[0]["id"]
 
 def check_chat_exists(chat_id: str) -> bool:
@@ -25,7 +97,7 @@ def check_chat_exists(chat_id: str) -> bool:
     except:
         return False
 
-def add_message(chat_id: str, role: str, content: str, video_url: str = None):
+def add_message(chat_id: str, role: str, content: str, video_url: str = None, poster_url: str = None, storyboard_urls: list = None):
     """Adds a message to the chat"""
     client = supabase_admin if supabase_admin else supabase
     
@@ -36,35 +108,88 @@ def add_message(chat_id: str, role: str, content: str, video_url: str = None):
     }
     if video_url:
         message_data["video_url"] = video_url
+    if poster_url:
+        message_data["poster_url"] = poster_url
+    if storyboard_urls:
+        message_data["storyboard_urls"] = storyboard_urls
         
     client.table("messages").insert(message_data).execute()
+    chat_cache.invalidate(("messages", chat_id))
 
-def get_chat_history(chat_id: str):
-    """Retrieves all messages for a specific chat"""
+def update_message_video(chat_id: str, old_video_url: str, new_video_url: str):
+    """Points messages at a new video (e.g. after a quality upgrade)"""
     client = supabase_admin if supabase_admin else supabase
     
-    response = client.table("messages")\
-        .select("*")\
+    client.table("messages")\
+        .update({"video_url": new_video_url})\
         .eq("chat_id", chat_id)\
-        .order("created_at")\
+        .eq("video_url", old_video_url)\
         .execute()
+    chat_cache.invalidate(("messages", chat_id))
+
+def get_chat_history(chat_id: str):
+    """Retrieves all messages for a specific chat (cached, see ReadCache)"""
+    client = supabase_admin if supabase_admin else supabase
+    
+    def load():
+        return client.table("messages")\
+            .select("*")\
+            .eq("chat_id", chat_id)\
+            .order("created_at")\
+            .execute().data
         
-    return response.data
+    # Copies - callers rewrite fields (e.g. video_url) in place
+    return [dict(message) for message in chat_cache.get_or_load(("messages", chat_id), load)]
 
 def get_user_chats(user_id: str):
-    """Retrieves all chats for a user"""
+    """Retrieves all chats for a user (cached, see ReadCache)"""
     client = supabase_admin if supabase_admin else supabase
     
-    response = client.table("chats")\
-        .select("*")\
-        .eq("user_id", user_id)\
-        .order("created_at", desc=True)\
-        .execute()
+    def load():
+        return client.table("chats")\
+            .select("*")\
+            .eq("user_id", user_id)\
+            .order("created_at", desc=True)\
+            .execute().data
         
-    return response.data
+    return [dict(chat) for chat in chat_cache.get_or_load(("chats", user_id), load)]
 
 def delete_chat(chat_id: str):
     """Deletes a chat and its messages (cascade)"""
     client = supabase_admin if supabase_admin else supabase
     
     client.table("chats").delete().eq("id", chat_id).execute()
+    chat_cache.invalidate(("messages", chat_id))
+    # The owner isn't known here - drop every cached chat list that contains the chat
+    chat_cache.invalidate_where(
+        lambda key, chats: key[0] == "chats" and any(chat.get("id") == chat_id for chat in chats)
+    )
+
+def get_first_prompts_since(since: str, limit: int = 5000) -> list:
+    """
+    Opening prompts of the chats created since the given ISO timestamp
+    (follow-ups only make sense within their chat). Not cached.
+    """
+    client = supabase_admin if supabase_admin else supabase
+
+    chats = client.table("chats")\
+        .select("id")\
+        .gte("created_at", since)\
+        .order("created_at", desc=True)\
+        .limit(limit)\
+        .execute().data
+    chat_ids = {chat["id"] for chat in chats}
+
+    messages = client.table("messages")\
+        .select("chat_id, content, created_at")\
+        .eq("role", "user")\
+        .gte("created_at", since)\
+        .order("created_at", desc=True)\
+        .limit(limit)\
+        .execute().data
+
+    first_prompts = {}
+    for message in reversed(messages):
+        if message["chat_id"] in chat_ids and message["chat_id"] not in first_prompts:
+            first_prompts[message["chat_id"]] = message["content"]
+    return list(first_prompts.values())
@@ -0,0 +1,163 @@
+"""
+Animation duration budgets.
+
+Every second of animation has to be rendered and encoded, so a scene's
+total length (play run_times + waits) is capped per quality tier. A script
+over budget is rewritten (AST) with every self.wait duration and play
+run_time scaled by the same factor, so its pacing is kept, just faster:
+
+- self.wait(3)                  → self.wait(1.5)
+- self.wait()                   → self.wait(0.5)
+- self.play(..., run_time=4)    → self.play(..., run_time=2.0)
+- self.play(Create(x, run_time=4)) → the inner run_time is scaled
+- self.play(Write(t))           → self.play(Write(t), run_time=0.5)
+  (animations without a run_time default to one second)
+
+Non-literal durations are multiplied (`run_time=t` → `run_time=t * 0.5`).
+Nothing gets shorter than MIN_RUN_TIME / MIN_WAIT, so heavily cut scenes
+may end slightly above budget.
+
+Template scenes rendered in-process get the same factor at runtime via
+TemplateScene(time_scale=...).
+"""
+
+import os
+import ast
+import hashlib
+from pathlib import Path
+from typing import Dict, Optional
+
+from app.render_cost import script_features
+
+# Seconds of animation allowed per scene, per quality tier
+DURATION_BUDGET_SECONDS = float(os.getenv("DURATION_BUDGET_SECONDS", "60"))
+DURATION_BUDGETS: Dict[str, float] = {
+    quality: DURATION_BUDGET_SECONDS for quality in ("l", "m", "h")
+}
+for _item in os.getenv("DURATION_BUDGETS", "").split(","):
+    if ":" in _item:
+        _quality, _seconds = _item.split(":", 1)
+        DURATION_BUDGETS[_quality.strip()] = float(_seconds)
+
+MIN_RUN_TIME = 0.3
+MIN_WAIT = 0.1
+
+# First line of a rewritten script: hash of the original it was made from
+BUDGET_HEADER = "# duration budget applied to "
+
+
+def duration_budget(quality: str) -> float:
+    return DURATION_BUDGETS.get(quality, DURATION_BUDGET_SECONDS)
+
+
+def duration_scale(script_code: str, quality: str) -> float:
+    """Factor (≤ 1) that brings the script's total animation time within budget."""
+    features = script_features(script_code)
+    budget = duration_budget(quality)
+    if not features or budget <= 0 or features["animation_seconds"] <= budget:
+        return 1.0
+    return budget / features["animation_seconds"]
+
+
+def _scaled(node: ast.AST, factor: float, minimum: float) -> ast.AST:
+    try:
+        value = ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError):
+        value = None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return ast.Constant(round(max(minimum, value * factor), 2))
+    return ast.BinOp(left=node, op=ast.Mult(), right=ast.Constant(round(factor, 4)))
+
+
+def _is_self_call(node: ast.AST, method: str) -> bool:
+    return (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == method
+            and isinstance(node.func.value, ast.Name) and node.func.value.id == "self")
+
+
+class _DurationScaler(ast.NodeTransformer):
+    def __init__(self, factor: float):
+        self.factor = factor
+
+    def visit_Call(self, node: ast.Call) -> ast.Call:
+        if _is_self_call(node, "wait"):
+            if node.args:
+                node.args[0] = _scaled(node.args[0], self.factor, MIN_WAIT)
+            else:
+                for keyword in node.keywords:
+                    if keyword.arg == "duration":
+                        keyword.value = _scaled(keyword.value, self.factor, MIN_WAIT)
+                        break
+                else:
+                    node.keywords.append(ast.keyword("duration", ast.Constant(round(max(MIN_WAIT, self.factor), 2))))
+            return node
+
+        if _is_self_call(node, "play"):
+            scaled_any = False
+            for child in ast.walk(node):
+                if isinstance(child, ast.Call):
+                    for keyword in child.keywords:
+                        if keyword.arg == "run_time":
+                            keyword.value = _scaled(keyword.value, self.factor, MIN_RUN_TIME)
+                            scaled_any = True
+            if not scaled_any:
+                node.keywords.append(ast.keyword("run_time", ast.Constant(round(max(MIN_RUN_TIME, self.factor), 2))))
+            return node
+
+        self.generic_visit(node)
+        return node
+
+
+def apply_duration_budget_to_code(script_code: str, quality: str) -> str:
+    """The script with its animation time scaled to the tier's budget (unchanged if within it)."""
+    factor = duration_scale(script_code, quality)
+    if factor >= 1.0:
+        return script_code
+    tree = _DurationScaler(factor).visit(ast.parse(script_code))
+    ast.fix_missing_locations(tree)
+    return ast.unparse(tree) + "\n"
+
+
+def _original_path(script_path: str) -> str:
+    return f"{script_path}.original"
+
+
+def apply_duration_budget(script_path: str, quality: str) -> Optional[float]:
+    """
+    Rewrites a script file to fit the tier's duration budget before it is rendered.
+
+    The unscaled script is kept next to it (<script>.original), so a later
+    render at another tier (e.g. a quality upgrade with a bigger budget)
+    scales from the original rather than from an already shortened copy.
+
+    Returns:
+        The scale factor applied (1.0 = within budget), or None if the
+        script couldn't be parsed and was left alone
+    """
+    path = Path(script_path)
+    current = path.read_text(encoding="utf-8")
+    original_path = Path(_original_path(script_path))
+
+    original = current
+    if current.startswith(BUDGET_HEADER) and original_path.exists():
+        stored = original_path.read_text(encoding="utf-8")
+        if current.splitlines()[0] == BUDGET_HEADER + hashlib.sha1(stored.encode("utf-8")).hexdigest():
+            original = stored
+
+    try:
+        factor = duration_scale(original, quality)
+        budgeted = apply_duration_budget_to_code(original, quality)
+    except (SyntaxError, ValueError):
+        return None
+
+    if budgeted == original:
+        if current != original:
+            path.write_text(original, encoding="utf-8")
+        return 1.0
+
+    original_path.write_text(original, encoding="utf-8")
+    header = BUDGET_HEADER + hashlib.sha1(original.encode("utf-8")).hexdigest()
+    new_code = f"{header}\n{budgeted}"
+    if new_code != current:
+        path.write_text(new_code, encoding="utf-8")
+        print(f"✂️  Scaled animation timing by {factor:.2f} to fit the {duration_budget(quality):.0f}s -q{quality} budget")
+    return factor
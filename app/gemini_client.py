@@ -0,0 +1,323 @@
+"""
+Rate-limited, circuit-broken access to the Gemini API.
+
+Every Gemini request (JSON calls, streamed raw generation, context cache
+uploads) goes through gemini_client.post():
+
+- a token bucket keeps us under the project's quota (GEMINI_RPM, with
+  bursts up to GEMINI_BURST); a request that can't get a token within
+  GEMINI_RATE_WAIT_SECONDS is refused instead of queueing indefinitely.
+  Background calls (pre-warming, inside gemini_client.background()) only
+  take a token while more than GEMINI_BACKGROUND_RESERVE are left, so they
+  never use up the burst interactive requests rely on
+- a circuit breaker watches the last GEMINI_BREAKER_WINDOW calls and opens
+  when too many failed (429, 5xx, network errors) or were slower than
+  GEMINI_SLOW_CALL_SECONDS. A 429 with Retry-After opens it right away.
+  While open, requests fail immediately with GeminiUnavailableError; after
+  GEMINI_BREAKER_COOLDOWN_SECONDS one probe request is let through, and
+  its outcome closes or re-opens the circuit
+
+Refused requests never reach the network, so a Gemini outage doesn't turn
+into a retry storm. Callers degrade instead: JSON results are served from
+the result cache (successful answers to the same request), templates are
+routed locally, and the raw LLM fallback is skipped.
+
+GEMINI_API_BASE points the client at another server, e.g. a local stub
+for load tests.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+
+# Token bucket (0 = no client-side limit)
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "10"))
+GEMINI_RATE_WAIT_SECONDS = float(os.getenv("GEMINI_RATE_WAIT_SECONDS", "10"))
+GEMINI_BACKGROUND_RESERVE = float(os.getenv("GEMINI_BACKGROUND_RESERVE", str(GEMINI_BURST // 2)))
+
+# Circuit breaker
+GEMINI_BREAKER_WINDOW = int(os.getenv("GEMINI_BREAKER_WINDOW", "20"))
+GEMINI_BREAKER_MIN_CALLS = int(os.getenv("GEMINI_BREAKER_MIN_CALLS", "5"))
+GEMINI_BREAKER_FAILURE_RATE = float(os.getenv("GEMINI_BREAKER_FAILURE_RATE", "0.5"))
+GEMINI_SLOW_CALL_SECONDS = float(os.getenv("GEMINI_SLOW_CALL_SECONDS", "20"))
+GEMINI_BREAKER_COOLDOWN_SECONDS = float(os.getenv("GEMINI_BREAKER_COOLDOWN_SECONDS", "30"))
+
+# Successful results kept for degraded mode
+GEMINI_RESULT_CACHE_SIZE = int(os.getenv("GEMINI_RESULT_CACHE_SIZE", "1000"))
+
+
+class GeminiUnavailableError(Exception):
+    """Raised instead of sending a request while the circuit is open or the rate limit is exhausted."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Gemini unavailable ({reason}), retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows `rate_per_minute` requests on average, `burst` at once."""
+
+    def __init__(self, rate_per_minute: float = GEMINI_RPM, burst: int = GEMINI_BURST):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout: float = GEMINI_RATE_WAIT_SECONDS, reserve: float = 0) -> bool:
+        """
+        Takes a token, waiting up to timeout for one. False if none came in
+        time. With reserve, only takes one while more than reserve are left.
+        """
+        if self.rate <= 0:
+            return True
+        needed = 1 + min(reserve, self.capacity - 1)
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= needed:
+                    self.tokens -= 1
+                    return True
+                wait = (needed - self.tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def wait_seconds(self) -> float:
+        """Seconds until the next token is available."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """
+    closed → open when the failure (or slow call) rate over the last
+    `window` calls reaches `failure_rate`; open → half-open after
+    `cooldown` seconds, letting a single probe through; the probe's
+    outcome closes or re-opens it.
+    """
+
+    def __init__(self, window: int = GEMINI_BREAKER_WINDOW, min_calls: int = GEMINI_BREAKER_MIN_CALLS,
+                 failure_rate: float = GEMINI_BREAKER_FAILURE_RATE, slow_seconds: float = GEMINI_SLOW_CALL_SECONDS,
+                 cooldown: float = GEMINI_BREAKER_COOLDOWN_SECONDS):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._outcomes: deque = deque(maxlen=window)
+        self._state = "closed"
+        self._open_until = 0.0
+        self._probing = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == "open" and time.time() >= self._open_until:
+                return "half_open"
+            return self._state
+
+    def retry_after(self) -> int:
+        with self._lock:
+            return max(1, int(self._open_until - time.time() + 0.999))
+
+    def allow(self) -> bool:
+        """Whether a request may go out now (claims the probe when half-open)."""
+        with self._lock:
+            if self._state == "closed":
+                return True
+            if self._state == "open" and time.time() < self._open_until:
+                return False
+            self._state = "half_open"
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def cancel(self) -> None:
+        """Gives back a probe that was allowed but never sent."""
+        with self._lock:
+            self._probing = False
+
+    def record(self, success: bool, latency: float) -> None:
+        bad = not success or latency > self.slow_seconds
+        with self._lock:
+            if self._state == "half_open":
+                self._probing = False
+                if bad:
+                    self._open(self.cooldown)
+                else:
+                    self._state = "closed"
+                    self._outcomes.clear()
+                    print("🟢 Gemini circuit closed")
+                return
+
+            self._outcomes.append(bad)
+            failures = sum(self._outcomes)
+            if (self._state == "closed" and len(self._outcomes) >= self.min_calls
+                    and failures / len(self._outcomes) >= self.failure_rate):
+                self._open(self.cooldown)
+
+    def trip(self, seconds: float) -> None:
+        """Opens the circuit for at least `seconds` (e.g. a 429's Retry-After)."""
+        with self._lock:
+            self._probing = False
+            self._open(max(seconds, self.cooldown))
+
+    def _open(self, seconds: float) -> None:
+        # Caller holds the lock
+        self._state = "open"
+        self._open_until = time.time() + seconds
+        self._outcomes.clear()
+        self.times_opened += 1
+        print(f"🔴 Gemini circuit open for {seconds:.0f}s - serving cached and template results only")
+
+
+class ResultCache:
+    """Bounded LRU of successful Gemini results, for serving while degraded."""
+
+    def __init__(self, size: int = GEMINI_RESULT_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self.hits = 0
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def put(self, key: str, value: Any) -> None:
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return value
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Set inside gemini_client.background()
+_background: contextvars.ContextVar = contextvars.ContextVar("gemini_background", default=False)
+
+
+class GeminiClient:
+    """Sends Gemini requests through the rate limiter and circuit breaker."""
+
+    def __init__(self, base_url: str = GEMINI_API_BASE):
+        self.base_url = base_url
+        self.limiter = TokenBucket()
+        self.breaker = CircuitBreaker()
+        self.results = ResultCache()
+        self.rejected = {"circuit_open": 0, "rate_limited": 0}
+
+    @contextmanager
+    def background(self):
+        """Marks the Gemini calls made in the block (and in work it propagates) as background priority."""
+        token = _background.set(True)
+        try:
+            yield
+        finally:
+            _background.reset(token)
+
+    @property
+    def degraded(self) -> bool:
+        """True while the circuit isn't closed: callers should skip optional Gemini calls."""
+        return self.breaker.state != "closed"
+
+    def retry_after(self) -> int:
+        if self.degraded:
+            return self.breaker.retry_after()
+        return max(1, int(self.limiter.wait_seconds() + 0.999))
+
+    def post(self, path: str, payload: Dict[str, Any], timeout: float = 30, stream: bool = False) -> requests.Response:
+        """
+        POSTs to <GEMINI_API_BASE>/<path> with the API key.
+
+        Raises:
+            GeminiUnavailableError without sending anything while the
+                circuit is open or no rate-limit token came in time
+            requests.RequestException on network errors (after counting them)
+        """
+        if not self.breaker.allow():
+            self.rejected["circuit_open"] += 1
+            raise GeminiUnavailableError("circuit open", self.breaker.retry_after())
+        reserve = GEMINI_BACKGROUND_RESERVE if _background.get() else 0
+        if not self.limiter.acquire(reserve=reserve):
+            self.breaker.cancel()
+            self.rejected["rate_limited"] += 1
+            raise GeminiUnavailableError("rate limit", self.retry_after())
+
+        started = time.monotonic()
+        try:
+            response = requests.post(
+                f"{self.base_url}/{path}",
+                params={"key": os.getenv("GEMINI_API_KEY", "")},
+                headers={"Content-Type": "application/json"},
+                json=payload,
+                timeout=timeout,
+                stream=stream,
+            )
+        except requests.RequestException:
+            self.breaker.record(False, time.monotonic() - started)
+            raise
+
+        # Streams: latency up to the response headers
+        latency = time.monotonic() - started
+        if response.status_code == 429:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                self.breaker.trip(float(retry_after))
+            else:
+                self.breaker.record(False, latency)
+        else:
+            self.breaker.record(response.status_code < 500, latency)
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "circuit": self.breaker.state,
+            "times_opened": self.breaker.times_opened,
+            "retry_after_seconds": self.retry_after() if self.degraded else 0,
+            "rejected": dict(self.rejected),
+            "rate_limit_rpm": GEMINI_RPM,
+            "cached_results": len(self.results),
+            "cache_hits": self.results.hits,
+        }
+
+
+gemini_client = GeminiClient()
@@ -0,0 +1,187 @@
+"""
+Local Gemini API stub for load tests.
+
+Answers the requests the app makes, with configurable latency and error
+rate, so the app can be driven hard without quota or cost:
+
+- generateContent: classification → function_graph, parameter extraction
+  → function params read from the prompt, refinement → the previous params
+  with the next color
+- streamGenerateContent: a small sectioned Manim scene, streamed as SSE
+- cachedContents: 404 (the app sends its system prompts inline)
+
+    python -m app.gemini_stub --port 8090 --latency 0.8
+    GEMINI_API_BASE=http://127.0.0.1:8090 uvicorn app.main:app
+"""
+
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from app.template_engine import LOCAL_COLORS, extract_parameters_locally
+
+DEFAULT_PARAMS = {
+    "title": "Function Graph",
+    "functions": [{"expr": "x**2", "label": "y = x^2", "color": "BLUE"}],
+    "x_range": [-5, 5, 1],
+}
+
+RAW_SCRIPT = '''```python
+from manim import *
+
+class GeneratedScene(Scene):
+    def construct(self):
+        self.next_section("title")
+        title = Text("Stubbed scene")
+        self.play(Write(title))
+        self.next_section("shape")
+        circle = Circle(color=BLUE)
+        self.play(Create(circle))
+        self.wait(1)
+```'''
+
+# Every stub reply reports this usage
+USAGE = {"promptTokenCount": 400, "candidatesTokenCount": 120, "totalTokenCount": 520}
+
+
+def _prompt_text(body: Dict[str, Any]) -> str:
+    parts = [part.get("text", "") for content in body.get("contents", []) for part in content.get("parts", [])]
+    return "\n".join(parts)
+
+
+def _system_text(body: Dict[str, Any]) -> str:
+    return "\n".join(part.get("text", "") for part in body.get("systemInstruction", {}).get("parts", []))
+
+
+def _user_prompt(text: str) -> str:
+    match = re.search(r'USER PROMPT: "(.*)"', text)
+    return match.group(1) if match else text
+
+
+def _numbered_prompts(text: str) -> List[str]:
+    return re.findall(r'^\d+\. "(.*)"$', text, re.MULTILINE)
+
+
+def json_reply(body: Dict[str, Any]) -> Any:
+    """The JSON the real model would be asked to produce for this request."""
+    prompt, system = _prompt_text(body), _system_text(body)
+    instructions = system + "\n" + prompt
+
+    if "previously generated" in instructions:
+        match = re.search(r"with these parameters:\s*(\{.*?\})\s*Now they sent", prompt, re.DOTALL)
+        params = json.loads(match.group(1)) if match else dict(DEFAULT_PARAMS)
+        for function in params.get("functions", []):
+            current = function.get("color", LOCAL_COLORS[0])
+            index = LOCAL_COLORS.index(current) if current in LOCAL_COLORS else -1
+            function["color"] = LOCAL_COLORS[(index + 1) % len(LOCAL_COLORS)]
+            break
+        return {"is_refinement": True, "params": params}
+
+    if "Classify each of the following" in instructions:
+        return [{"template": "function_graph", "confidence": 0.95} for _ in _numbered_prompts(prompt)]
+    if "classify it into ONE" in instructions:
+        return {"template": "function_graph", "confidence": 0.95}
+
+    if "separate user prompts" in instructions:
+        return [extract_parameters_locally(p) or DEFAULT_PARAMS for p in _numbered_prompts(prompt)]
+    return extract_parameters_locally(_user_prompt(prompt)) or DEFAULT_PARAMS
+
+
+class GeminiStub:
+    """Threaded HTTP server answering like the Gemini REST API."""
+
+    def __init__(self, port: int = 0, latency: float = 0.5, jitter: float = 0.3, error_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                stub.requests += 1
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length) or b"{}")
+                stub.handle(self, body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+
+    def _delay(self) -> None:
+        time.sleep(max(0.0, self.latency * random.uniform(1 - self.jitter, 1 + self.jitter)))
+
+    def _send_json(self, handler: BaseHTTPRequestHandler, status: int, payload: Optional[Dict[str, Any]]) -> None:
+        data = json.dumps(payload or {}).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def handle(self, handler: BaseHTTPRequestHandler, body: Dict[str, Any]) -> None:
+        path = handler.path.split("?", 1)[0]
+        if path.endswith("/cachedContents"):
+            self._send_json(handler, 404, {"error": {"message": "context caching not stubbed"}})
+            return
+
+        self._delay()
+        if random.random() < self.error_rate:
+            self._send_json(handler, 503, {"error": {"message": "stubbed overload"}})
+            return
+
+        if ":streamGenerateContent" in path:
+            handler.send_response(200)
+            handler.send_header("Content-Type", "text/event-stream")
+            handler.end_headers()
+            lines = RAW_SCRIPT.splitlines(keepends=True)
+            for i in range(0, len(lines), 4):
+                event = {"candidates": [{"content": {"parts": [{"text": "".join(lines[i:i + 4])}]}}]}
+                if i + 4 >= len(lines):
+                    event["usageMetadata"] = USAGE
+                handler.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                handler.wfile.flush()
+            return
+
+        text = json.dumps(json_reply(body))
+        self._send_json(handler, 200, {
+            "candidates": [{"content": {"parts": [{"text": text}]}}],
+            "usageMetadata": USAGE,
+        })
+
+    def start(self) -> "GeminiStub":
+        threading.Thread(target=self.server.serve_forever, name="gemini-stub", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Local Gemini API stub")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per reply")
+    parser.add_argument("--jitter", type=float, default=0.3, help="Latency spread (fraction)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    args = parser.parse_args(argv)
+
+    stub = GeminiStub(args.port, args.latency, args.jitter, args.error_rate)
+    print(f"🤖 Gemini stub on {stub.url} (latency {args.latency}s, error rate {args.error_rate:.0%})")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
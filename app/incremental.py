@@ -0,0 +1,369 @@
+"""
+Incremental rendering for follow-up prompts within a chat.
+
+Each chat keeps the template params of its last render and renders
+into its own module folder, so Manim's per-animation cache
+(videos/chat_<id>/<quality>/partial_movie_files) survives between turns.
+
+Flow for a follow-up prompt:
+1. Ask the LLM to apply the change to the previous params (one call,
+   instead of classify + extract)
+2. Diff new params against the previous ones
+3. Nothing changed → reuse the previous video
+4. Otherwise regenerate the script deterministically - Manim hashes each
+   animation and only re-renders the ones whose content changed, then
+   stitches cached and new partial movies back together
+
+Scripts that were rendered ahead of time (app/warmer.py) aren't rendered
+again, and a first prompt that was warmed skips the LLM as well.
+"""
+
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait as futures_wait
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from app.batch import normalize_prompt
+from app.duration_budget import apply_duration_budget
+from app.job_queue import RENDER_BACKEND, JobFailedError, get_render_queue
+from app.manim_timing import read_animation_timings
+from app.profiling import current_session, propagate
+from app.render_cost import render_cost_model, script_features
+from app.renderer import OUTPUT_DIR, render_frames, render_manim_script_sections, renders_in_sections, storyboard_frames
+from app.scheduler import ANONYMOUS_USER, render_scheduler
+from app.script_gen import generate_script_with_params, save_script
+from app.singleflight import generation_flight
+from app.storage import video_store
+from app.template_engine import generate_from_params, refine_parameters
+from app.warm_cache import warm_cache
+
+CHATS_DIR = os.path.join(OUTPUT_DIR, "chats")
+
+# Scheduler identity for background quality upgrades (lowest priority class)
+UPGRADE_USER = "__quality_upgrades__"
+
+# chat_id → {"template", "params", "quality", "video_url", "poster_url", "storyboard_urls", "turn"}
+CHAT_RENDER_STATE: Dict[str, Dict[str, Any]] = {}
+
+# chat_id → previews of the turn currently rendering, readable before its video is done
+CHAT_PREVIEWS: Dict[str, Dict[str, Any]] = {}
+
+_preview_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="preview")
+
+if RENDER_BACKEND == "queue":
+    # Renders run on the workers: a slot stands for worker capacity, not this node's CPUs
+    render_scheduler.capacity_source = lambda: get_render_queue().stats()["capacity"]
+
+_state_lock = threading.Lock()
+_chat_locks: Dict[str, threading.Lock] = {}
+
+
+def _chat_lock(chat_id: str) -> threading.Lock:
+    """One render at a time per chat, so turns don't race on the same cache."""
+    with _state_lock:
+        return _chat_locks.setdefault(chat_id, threading.Lock())
+
+
+def _module_name(chat_id: str) -> str:
+    return "chat_" + "".join(c if c.isalnum() else "_" for c in chat_id)
+
+
+def _state_path(chat_id: str) -> str:
+    return os.path.join(CHATS_DIR, f"{_module_name(chat_id)}.json")
+
+
+def load_chat_state(chat_id: str) -> Optional[Dict[str, Any]]:
+    """Returns the last render state of a chat (memory first, then disk)."""
+    state = CHAT_RENDER_STATE.get(chat_id)
+    if state is None and os.path.exists(_state_path(chat_id)):
+        try:
+            state = json.loads(Path(_state_path(chat_id)).read_text(encoding="utf-8"))
+            CHAT_RENDER_STATE[chat_id] = state
+        except (OSError, ValueError):
+            return None
+    return state
+
+
+def save_chat_state(chat_id: str, state: Dict[str, Any]) -> None:
+    CHAT_RENDER_STATE[chat_id] = state
+    Path(CHATS_DIR).mkdir(parents=True, exist_ok=True)
+    Path(_state_path(chat_id)).write_text(json.dumps(state, indent=2), encoding="utf-8")
+
+
+def diff_params(old: Any, new: Any, path: str = "") -> List[str]:
+    """
+    Lists the paths that differ between two param trees,
+    e.g. ["functions[1].color", "steps[3]"].
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = []
+        for key in sorted(set(old) | set(new), key=str):
+            child = f"{path}.{key}" if path else str(key)
+            if key not in old or key not in new:
+                changes.append(child)
+            else:
+                changes.extend(diff_params(old[key], new[key], child))
+        return changes
+
+    if isinstance(old, list) and isinstance(new, list):
+        changes = []
+        for i in range(max(len(old), len(new))):
+            child = f"{path}[{i}]"
+            if i >= len(old) or i >= len(new):
+                changes.append(child)
+            else:
+                changes.extend(diff_params(old[i], new[i], child))
+        return changes
+
+    return [] if old == new else [path or "<root>"]
+
+
+def _render_frames(script_path: str, quality: str, name: str, frames: List[Optional[int]],
+                   user_id: str, tier: str, boost: int = 0) -> List[Optional[str]]:
+    """
+    Renders poster (None) / storyboard (n) frames - in this process, or with
+    RENDER_BACKEND=queue as a job on a render worker. Failed frames are None.
+    """
+    if RENDER_BACKEND != "queue":
+        return render_frames(script_path, quality=quality, name=name, frames=frames)
+
+    render_queue = get_render_queue()
+    job_id = render_queue.enqueue("render_frames", {
+        "script_path": script_path,
+        "script_code": Path(script_path).read_text(encoding="utf-8"),
+        "class_name": "GeneratedScene",
+        "quality": quality,
+        "name": name,
+        "frames": frames,
+    }, user_id=user_id, tier=tier, boost=boost)
+    try:
+        return render_queue.wait(job_id)["image_urls"]
+    except JobFailedError as e:
+        print(f"❌ Preview frames failed: {e}")
+        return [None] * len(frames)
+
+
+def _render_video(script_path: str, quality: str, output_file: str, user_id: str, tier: str,
+                  previews: Optional[Callable[[], Any]] = None,
+                  latex_ready: Optional[threading.Event] = None) -> str:
+    """
+    Renders a chat video in a fair-share slot of the user - in this process,
+    or with RENDER_BACKEND=queue on a render worker (slots then follow the
+    workers' capacity).
+
+    previews (poster/storyboard rendering) runs alongside the video inside
+    the same slot, so its Manim processes are part of the capacity, fairness
+    and load accounting; the slot is released once both are done. A local
+    video split over several section processes takes an idle slot for each
+    extra process, and first waits for latex_ready (set once the poster
+    compiled the scene's LaTeX), so the sections find it cached instead of
+    racing on it; other renders start right away.
+
+    The predicted render time orders the slot queue (shortest first) and
+    the measured one calibrates the cost model. For profiled requests the
+    render reports per-animation timings into the profile.
+    """
+    script_code = Path(script_path).read_text(encoding="utf-8")
+    features = script_features(script_code)
+    predicted_seconds = render_cost_model.predict(features, quality)
+    profile = current_session()
+
+    with render_scheduler.slot(user_id, tier, predicted_seconds):
+        previews_future = _preview_pool.submit(propagate(previews)) if previews else None
+        try:
+            started = time.monotonic()
+            if RENDER_BACKEND == "queue":
+                render_queue = get_render_queue()
+                job_id = render_queue.enqueue("render_script", {
+                    "script_path": script_path,
+                    "script_code": script_code,
+                    "class_name": "GeneratedScene",
+                    "quality": quality,
+                    "output_file": output_file,
+                    "animation_timings": profile is not None,
+                }, user_id=user_id, tier=tier)
+                print(f"📨 Queued render job {job_id}")
+                result = render_queue.wait(job_id)
+                video_url = result["video_url"]
+                seconds = result.get("render_seconds") or time.monotonic() - started
+                if profile is not None:
+                    profile.add_animation_timings(result.get("animation_timings") or [])
+            else:
+                if latex_ready is not None and renders_in_sections(script_code):
+                    latex_ready.wait()
+                    started = time.monotonic()
+                timings_path = profile.artifact_path(".manim.json") if profile is not None else None
+                video_url = render_manim_script_sections(script_path, quality=quality, output_file=output_file,
+                                                         timings_path=timings_path, slots=render_scheduler)
+                video_store.offload(video_url)
+                seconds = time.monotonic() - started
+                if timings_path:
+                    profile.add_animation_timings(read_animation_timings(timings_path))
+                    Path(timings_path).unlink(missing_ok=True)
+        finally:
+            if previews_future is not None:
+                futures_wait([previews_future])
+
+    render_cost_model.record(features, quality, seconds)
+    return video_url
+
+
+def _render_turn(chat_id: str, script_path: str, quality: str, turn: int, user_id: str, tier: str) -> Dict[str, Any]:
+    """
+    Renders one turn: the video, with poster and storyboard alongside it.
+
+    The poster skips every animation, so it's ready in a moment and is
+    published to CHAT_PREVIEWS while the video is still rendering; the
+    storyboard follows it. With RENDER_BACKEND=queue the poster job is
+    claimed ahead of the tier's videos.
+    """
+    name = f"turn_{turn}"
+    preview = CHAT_PREVIEWS[chat_id] = {"turn": turn, "poster_url": None, "storyboard_urls": []}
+    # Before anything reads the script, so poster, storyboard and video agree
+    apply_duration_budget(script_path, quality)
+
+    poster_done = threading.Event()
+
+    def previews() -> None:
+        try:
+            preview["poster_url"] = _render_frames(script_path, quality, name, [None], user_id, tier, boost=1)[0]
+        finally:
+            poster_done.set()
+        frames = storyboard_frames(Path(script_path).read_text(encoding="utf-8"))
+        if frames:
+            urls = _render_frames(script_path, quality, name, frames, user_id, tier)
+            preview["storyboard_urls"] = [url for url in urls if url]
+
+    video_url = _render_video(script_path, quality, f"{name}.mp4", user_id, tier,
+                              previews=previews, latex_ready=poster_done)
+
+    return {
+        "video_url": video_url,
+        "poster_url": preview["poster_url"],
+        "storyboard_urls": preview["storyboard_urls"],
+    }
+
+
+def _warm_render(script_code: str) -> Optional[Dict[str, Any]]:
+    """The pre-warmed render of exactly this script, if there is one."""
+    rendered = warm_cache.get_render(script_code)
+    if rendered:
+        print("🔥 Reusing the pre-warmed render of this script")
+    return rendered
+
+
+def get_chat_preview(chat_id: str) -> Optional[Dict[str, Any]]:
+    """Poster/storyboard of the chat's in-progress turn, or of its last finished one."""
+    preview = CHAT_PREVIEWS.get(chat_id)
+    if preview:
+        return preview
+    state = load_chat_state(chat_id)
+    if not state:
+        return None
+    return {
+        "turn": state["turn"],
+        "poster_url": state.get("poster_url"),
+        "storyboard_urls": state.get("storyboard_urls", []),
+    }
+
+
+def render_chat_turn(chat_id: str, user_prompt: str, quality: str = "h", user_id: str = ANONYMOUS_USER, tier: str = "free") -> Dict[str, Any]:
+    """
+    Generates and renders the video for one chat turn, reusing the
+    previous turn's params and animation cache when the prompt refines it.
+    The render waits for a fair-share slot of the requesting user.
+
+    Returns:
+        {"video_url", "poster_url", "storyboard_urls"}
+    """
+    with _chat_lock(chat_id):
+        module_name = _module_name(chat_id)
+        script_path = os.path.join(CHATS_DIR, f"{module_name}.py")
+        previous = load_chat_state(chat_id)
+        turn = previous["turn"] + 1 if previous else 1
+
+        template_name, params, script_code = None, None, None
+
+        # Step 1: Try to refine the previous turn's params
+        if previous and previous.get("template"):
+            print(f"\n♻️  Refining previous {previous['template']} params for chat {chat_id}...")
+            refined = refine_parameters(previous["template"], previous["params"], user_prompt)
+
+            if refined is not None:
+                changes = diff_params(previous["params"], refined)
+                if not changes and previous.get("quality") == quality:
+                    print("✅ No parameter changes - reusing previous video")
+                    return {
+                        "video_url": previous["video_url"],
+                        "poster_url": previous.get("poster_url"),
+                        "storyboard_urls": previous.get("storyboard_urls", []),
+                    }
+
+                print(f"✅ Changed params: {', '.join(changes) or 'none (new quality)'}")
+                script_code, status = generate_from_params(previous["template"], refined)
+                if script_code:
+                    template_name, params = previous["template"], refined
+                    save_script(script_code, script_path)
+                else:
+                    print(f"❌ Refined params rejected: {status}")
+
+        if not script_code:
+            # Step 2: Full generation for new topics (or failed refinements).
+            # Identical prompts already in flight (any chat) share one LLM run and one render.
+            def generate_and_render():
+                warmed = warm_cache.get_prompt(user_prompt)
+                if warmed:
+                    print("🔥 Using the pre-warmed generation for this prompt")
+                    code, template, template_params = warmed["script_code"], warmed["template"], warmed["params"]
+                    save_script(code, script_path)
+                else:
+                    code, template, template_params = generate_script_with_params(user_prompt, output_path=script_path)
+                if not code:
+                    raise RuntimeError("Script generation failed")
+                rendered = _warm_render(code) or _render_turn(chat_id, script_path, quality, turn, user_id, tier)
+                return code, template, template_params, rendered
+
+            flight_key = ("generate", normalize_prompt(user_prompt), quality)
+            (script_code, template_name, params, rendered), shared = generation_flight.do(flight_key, generate_and_render)
+            if shared:
+                print(f"🔗 Joined an identical in-flight generation for chat {chat_id}")
+                # Keep our own copy so later refinements/upgrades of this chat have a script
+                save_script(script_code, script_path)
+        else:
+            # Step 2: Render the refinement - Manim reuses cached partial movies for unchanged animations
+            rendered = _warm_render(script_code) or _render_turn(chat_id, script_path, quality, turn, user_id, tier)
+
+        # A warm render carries its own (full) quality, which replaces the requested one
+        save_chat_state(chat_id, {
+            "template": template_name,
+            "params": params,
+            "quality": quality,
+            "turn": turn,
+            **rendered,
+        })
+        CHAT_PREVIEWS.pop(chat_id, None)
+        return rendered
+
+
+def upgrade_chat_turn(chat_id: str, turn: int, quality: str = "h") -> Optional[str]:
+    """
+    Re-renders a chat turn that was rendered at reduced quality.
+
+    Returns:
+        URL of the upgraded video, or None if a newer turn replaced the script
+    """
+    with _chat_lock(chat_id):
+        state = load_chat_state(chat_id)
+        if not state or state["turn"] != turn or state.get("quality") == quality:
+            return None
+
+        script_path = os.path.join(CHATS_DIR, f"{_module_name(chat_id)}.py")
+        print(f"\n⬆️  Upgrading chat {chat_id} turn {turn} to -q{quality}...")
+        apply_duration_budget(script_path, quality)
+        video_url = _render_video(script_path, quality, f"turn_{turn}.mp4", UPGRADE_USER, "background")
+
+        save_chat_state(chat_id, {**state, "quality": quality, "video_url": video_url})
+        return video_url
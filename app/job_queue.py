@@ -0,0 +1,271 @@
+"""
+Durable render job queue for standalone render workers.
+
+With RENDER_BACKEND=queue the API doesn't render chat videos itself: it
+enqueues a job (script source + output location) in a SQLite table and
+waits for a worker to finish it:
+
+    python -m app.worker --concurrency 2
+
+Single host only: SQLite in WAL mode relies on shared memory and file
+locks that network filesystems (NFS, SMB, EFS) don't provide reliably, so
+RENDER_QUEUE_DB must sit on a local disk and the API and its workers run
+on the machine that holds it (separate containers sharing that volume are
+fine). It moves rendering out of the API processes, not onto other
+machines.
+
+Delivery is at-least-once:
+- claiming a job leases it for VISIBILITY_TIMEOUT_SECONDS
+- the worker heartbeats while rendering, extending the lease
+- a job whose lease runs out (worker crashed or killed) is handed to the
+  next worker that asks, up to MAX_ATTEMPTS times, then marked failed
+
+Jobs and their results survive API and worker restarts. Workers write
+videos and frames to the shared OUTPUT_DIR, and also upload them when a
+STORAGE_BACKEND is set.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from app.renderer import OUTPUT_DIR
+
+RENDER_BACKEND = os.getenv("RENDER_BACKEND", "local").lower()
+RENDER_QUEUE_DB = os.getenv("RENDER_QUEUE_DB", os.path.join(OUTPUT_DIR, "render_queue.db"))
+VISIBILITY_TIMEOUT_SECONDS = float(os.getenv("VISIBILITY_TIMEOUT_SECONDS", "60"))
+HEARTBEAT_SECONDS = float(os.getenv("HEARTBEAT_SECONDS", "10"))
+MAX_ATTEMPTS = int(os.getenv("RENDER_MAX_ATTEMPTS", "3"))
+# How long the API waits on a queued render before giving up on it
+RENDER_JOB_TIMEOUT_SECONDS = float(os.getenv("RENDER_JOB_TIMEOUT_SECONDS", "900"))
+
+# Claim order: higher first, then oldest first
+TIER_PRIORITY = {"paid": 2, "free": 1, "background": 0}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS render_jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    user_id TEXT,
+    priority INTEGER NOT NULL DEFAULT 1,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker_id TEXT,
+    lease_until REAL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS render_jobs_claim ON render_jobs (status, priority DESC, created_at);
+CREATE TABLE IF NOT EXISTS render_workers (
+    id TEXT PRIMARY KEY,
+    host TEXT,
+    concurrency INTEGER,
+    started_at REAL,
+    heartbeat_at REAL
+);
+"""
+
+
+class JobFailedError(Exception):
+    """A queued render failed on every attempt (or timed out waiting)."""
+
+
+def new_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class RenderJobQueue:
+    """SQLite-backed job table shared by the API and the render workers."""
+
+    def __init__(self, path: str = RENDER_QUEUE_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as db:
+            # WAL lets workers read while another process writes
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # A connection per operation - used from many threads and processes
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._connect() as db:
+            # Take the write lock up front, so two workers can't claim the same job
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _job(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], user_id: Optional[str] = None, tier: str = "free",
+                max_attempts: int = MAX_ATTEMPTS, boost: int = 0) -> str:
+        """
+        Adds a job and returns its id. boost raises its claim priority above
+        the tier's (e.g. quick poster frames ahead of the tier's videos).
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO render_jobs (id, kind, payload, user_id, priority, max_attempts, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), user_id, TIER_PRIORITY.get(tier, 1) + boost, max_attempts, now, now),
+            )
+        return job_id
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Leases the next job to a worker, or returns None when there is none.
+        Jobs whose lease expired are requeued (or failed) first.
+        """
+        now = time.time()
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE render_jobs SET status = 'failed', error = 'worker lost (lease expired) on final attempt',"
+                " worker_id = NULL, updated_at = ?"
+                " WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts",
+                (now, now),
+            )
+            requeued = db.execute(
+                "UPDATE render_jobs SET status = 'queued', worker_id = NULL, updated_at = ?"
+                " WHERE status = 'running' AND lease_until < ?",
+                (now, now),
+            ).rowcount
+            if requeued:
+                print(f"♻️  Requeued {requeued} render jobs from lost workers")
+
+            row = db.execute(
+                "SELECT * FROM render_jobs WHERE status = 'queued' ORDER BY priority DESC, created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE render_jobs SET status = 'running', worker_id = ?, attempts = attempts + 1,"
+                " lease_until = ?, updated_at = ? WHERE id = ?",
+                (worker_id, now + VISIBILITY_TIMEOUT_SECONDS, now, row["id"]),
+            )
+            job = self._job(row)
+            job.update({"status": "running", "worker_id": worker_id, "attempts": row["attempts"] + 1})
+            return job
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        """Extends a job's lease. False when the worker no longer owns it."""
+        now = time.time()
+        with self._connect() as db:
+            return db.execute(
+                "UPDATE render_jobs SET lease_until = ?, updated_at = ?"
+                " WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (now + VISIBILITY_TIMEOUT_SECONDS, now, job_id, worker_id),
+            ).rowcount == 1
+
+    def complete(self, job_id: str, worker_id: str, result: Dict[str, Any]) -> bool:
+        with self._connect() as db:
+            return db.execute(
+                "UPDATE render_jobs SET status = 'done', result = ?, error = NULL, lease_until = NULL, updated_at = ?"
+                " WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (json.dumps(result), time.time(), job_id, worker_id),
+            ).rowcount == 1
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        """Records a failed attempt: the job is retried until it runs out of attempts."""
+        with self._connect() as db:
+            return db.execute(
+                "UPDATE render_jobs SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,"
+                " error = ?, worker_id = NULL, lease_until = NULL, updated_at = ?"
+                " WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (error[-2000:], time.time(), job_id, worker_id),
+            ).rowcount == 1
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM render_jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def wait(self, job_id: str, timeout: float = RENDER_JOB_TIMEOUT_SECONDS, poll: float = 0.5) -> Dict[str, Any]:
+        """
+        Blocks until a job is done and returns its result.
+
+        Raises:
+            JobFailedError if it failed on every attempt or didn't finish in time
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = self.get(job_id)
+            if job is None:
+                raise JobFailedError(f"Render job {job_id} disappeared")
+            if job["status"] == "done":
+                return job["result"]
+            if job["status"] == "failed":
+                raise JobFailedError(f"Render job failed after {job['attempts']} attempts: {job['error']}")
+            time.sleep(poll)
+        raise JobFailedError(f"Render job {job_id} not finished after {timeout:.0f}s")
+
+    def register_worker(self, worker_id: str, concurrency: int) -> None:
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO render_workers (id, host, concurrency, started_at, heartbeat_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (worker_id, socket.gethostname(), concurrency, now, now),
+            )
+
+    def worker_heartbeat(self, worker_id: str) -> None:
+        with self._connect() as db:
+            db.execute("UPDATE render_workers SET heartbeat_at = ? WHERE id = ?", (time.time(), worker_id))
+
+    def unregister_worker(self, worker_id: str) -> None:
+        with self._connect() as db:
+            db.execute("DELETE FROM render_workers WHERE id = ?", (worker_id,))
+
+    def stats(self) -> Dict[str, Any]:
+        """Job counts by status and the workers that heartbeated within a visibility timeout."""
+        cutoff = time.time() - VISIBILITY_TIMEOUT_SECONDS
+        with self._connect() as db:
+            counts = dict(db.execute("SELECT status, COUNT(*) FROM render_jobs GROUP BY status").fetchall())
+            workers: List[Dict[str, Any]] = [
+                dict(row) for row in db.execute(
+                    "SELECT id, host, concurrency, heartbeat_at FROM render_workers WHERE heartbeat_at >= ?", (cutoff,)
+                ).fetchall()
+            ]
+        return {
+            "jobs": counts,
+            "workers": workers,
+            "capacity": sum(w["concurrency"] or 0 for w in workers),
+        }
+
+
+_queue: Optional[RenderJobQueue] = None
+
+
+def get_render_queue() -> RenderJobQueue:
+    """Queue singleton, opened on first use (local-render setups never create the database)."""
+    global _queue
+    if _queue is None:
+        _queue = RenderJobQueue()
+    return _queue
@@ -0,0 +1,207 @@
+"""
+Static LLM context and token accounting.
+
+Most of every Gemini request is the same text each time: the system
+prompt and intent example for raw generation, the schema for parameter
+extraction. That text is sent as a system instruction, separate from the
+user's prompt, and - when it is large enough for Gemini's context caching -
+uploaded once as cached content and referenced by name afterwards.
+
+Every call's usageMetadata is added to per-label counters (e.g.
+"raw:graph_function", "extract:function_graph") together with latency and
+outcome, split by prompt variant so the trimmed prompts can be compared
+against the full ones (GET /llm/usage).
+"""
+
+import os
+import time
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from dotenv import load_dotenv
+
+from app.gemini_client import GeminiUnavailableError, gemini_client
+
+load_dotenv()
+
+CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "on").lower() in ("1", "true", "on")
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "3600"))
+# Gemini rejects cached content below a model-dependent token minimum
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS", "1024"))
+# After a failed upload, don't try again for this long
+CONTEXT_CACHE_RETRY_SECONDS = 600
+
+# Prompt variant for raw generation: full, trimmed, or ab (split by prompt)
+PROMPT_VARIANT = os.getenv("PROMPT_VARIANT", "full").lower()
+TRIMMED_PROMPT_PERCENT = int(os.getenv("TRIMMED_PROMPT_PERCENT", "50"))
+
+# Responses meaning a referenced cached content is gone - worth one resend with the
+# context inline. Anything else (429, 5xx) isn't retried, to not add load.
+STALE_CONTEXT_STATUSES = (400, 403, 404)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English and code)."""
+    return len(text) // 4
+
+
+def choose_prompt_variant(user_prompt: str) -> str:
+    """
+    "full" or "trimmed". In ab mode the split is by a hash of the prompt,
+    so the same prompt always gets the same variant.
+    """
+    if PROMPT_VARIANT in ("full", "trimmed"):
+        return PROMPT_VARIANT
+    normalized = " ".join(user_prompt.split()).lower()
+    bucket = int(hashlib.sha1(normalized.encode("utf-8")).hexdigest(), 16) % 100
+    return "trimmed" if bucket < TRIMMED_PROMPT_PERCENT else "full"
+
+
+class ContextCache:
+    """
+    Gemini cachedContents per (model, system text).
+
+    Entries are re-uploaded shortly before their TTL runs out. Text below
+    CONTEXT_CACHE_MIN_TOKENS, or that the API refused to cache, is sent
+    inline as a system instruction instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str], Tuple[Optional[str], float]] = {}
+        self._key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+
+    @staticmethod
+    def _key(model: str, system_text: str) -> Tuple[str, str]:
+        return model, hashlib.sha1(system_text.encode("utf-8")).hexdigest()
+
+    def get(self, model: str, system_text: str) -> Optional[str]:
+        """Name of the cached content holding system_text, uploading it if needed."""
+        if not CONTEXT_CACHE or estimate_tokens(system_text) < CONTEXT_CACHE_MIN_TOKENS:
+            return None
+
+        key = self._key(model, system_text)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # One upload per key, concurrent callers wait for it
+        with key_lock:
+            name, valid_until = self._entries.get(key, (None, 0.0))
+            if time.time() < valid_until:
+                return name
+
+            name = self._create(model, system_text)
+            if name:
+                # Refresh a minute early rather than reference an expired cache
+                self._entries[key] = (name, time.time() + CONTEXT_CACHE_TTL_SECONDS - 60)
+            else:
+                self._entries[key] = (None, time.time() + CONTEXT_CACHE_RETRY_SECONDS)
+            return name
+
+    def invalidate(self, model: str, system_text: str) -> None:
+        """Forgets a cached content the API no longer accepts (expired or evicted)."""
+        self._entries.pop(self._key(model, system_text), None)
+
+    def _create(self, model: str, system_text: str) -> Optional[str]:
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            return None
+        try:
+            response = gemini_client.post(
+                "cachedContents",
+                {
+                    "model": f"models/{model}",
+                    "systemInstruction": {"parts": [{"text": system_text}]},
+                    "ttl": f"{CONTEXT_CACHE_TTL_SECONDS}s",
+                },
+                timeout=30
+            )
+        except (requests.RequestException, GeminiUnavailableError) as e:
+            print(f"⚠️  Context cache upload failed: {e}")
+            return None
+
+        if response.status_code != 200:
+            print(f"⚠️  Context cache not available for {model} ({response.status_code}), sending system prompt inline")
+            return None
+
+        name = response.json().get("name")
+        print(f"📌 Cached {estimate_tokens(system_text)} token system context as {name}")
+        return name
+
+
+def build_payload(model: str, contents: List[Dict[str, Any]], system_text: Optional[str] = None,
+                  use_cache: bool = True) -> Tuple[Dict[str, Any], Optional[str]]:
+    """
+    Request body for generateContent with the static context separated out.
+
+    Returns:
+        (payload, cached_content_name) - the name is None when the system
+        text was sent inline
+    """
+    payload: Dict[str, Any] = {"contents": contents}
+    if not system_text:
+        return payload, None
+
+    cached_name = context_cache.get(model, system_text) if use_cache else None
+    if cached_name:
+        payload["cachedContent"] = cached_name
+    else:
+        payload["systemInstruction"] = {"parts": [{"text": system_text}]}
+    return payload, cached_name
+
+
+class UsageStats:
+    """Token, latency and outcome counters per call label and prompt variant."""
+
+    FIELDS = ("promptTokenCount", "cachedContentTokenCount", "candidatesTokenCount", "totalTokenCount")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[Tuple[str, str], Dict[str, float]] = {}
+
+    def record(self, label: str, variant: str = "full", usage: Optional[Dict[str, Any]] = None,
+               latency: Optional[float] = None, success: Optional[bool] = None) -> None:
+        with self._lock:
+            stats = self._stats.setdefault((label, variant), {
+                "calls": 0, "successes": 0, "failures": 0, "latency_seconds": 0.0,
+                **{field: 0 for field in self.FIELDS},
+            })
+            if usage is not None:
+                stats["calls"] += 1
+                for field in self.FIELDS:
+                    stats[field] += int(usage.get(field, 0) or 0)
+            if latency is not None:
+                stats["latency_seconds"] += latency
+            if success is True:
+                stats["successes"] += 1
+            elif success is False:
+                stats["failures"] += 1
+
+        if usage is not None:
+            cached = usage.get("cachedContentTokenCount", 0)
+            print(f" Tokens [{label}/{variant}]: prompt {usage.get('promptTokenCount', 0)}"
+                  f" (cached {cached}), output {usage.get('candidatesTokenCount', 0)}")
+
+    def report(self) -> List[Dict[str, Any]]:
+        """Per label/variant totals and averages, for comparing prompt variants."""
+        with self._lock:
+            rows = []
+            for (label, variant), stats in sorted(self._stats.items()):
+                calls = stats["calls"] or 1
+                outcomes = stats["successes"] + stats["failures"]
+                rows.append({
+                    "label": label,
+                    "variant": variant,
+                    **stats,
+                    "latency_seconds": round(stats["latency_seconds"], 2),
+                    "avg_prompt_tokens": round(stats["promptTokenCount"] / calls, 1),
+                    "avg_latency_seconds": round(stats["latency_seconds"] / outcomes, 2) if outcomes else None,
+                    "success_rate": round(stats["successes"] / outcomes, 3) if outcomes else None,
+                })
+            return rows
+
+
+context_cache = ContextCache()
+llm_usage = UsageStats()
@@ -0,0 +1,382 @@
+"""
+End-to-end load test: the real API against stubbed dependencies.
+
+Starts the Gemini stub and the API (uvicorn app.main:app) with chats kept in
+memory (CHAT_STORE=memory) and Manim replaced by a sleep of
+--render-seconds (RENDER_STUB_SECONDS), then drives /chat, /chats and
+/chatdata with an increasing number of virtual users. Each user keeps a
+chat, sends follow-ups to it and polls with If-None-Match, like the
+frontend.
+
+For every concurrency level it reports throughput (all responses and
+successful ones), latency percentiles overall and per endpoint, and the
+error rate, then names the saturation point: the first level where adding
+users no longer adds 10% throughput, or where errors pass 1%.
+
+    python -m app.loadtest --levels 1,2,4,8,16,32 --duration 30 --render-seconds 2
+    python -m app.loadtest --url http://staging:8000 --jwt-secret ... --levels 4,8
+
+With --url, an already running API is tested (its own Gemini and renderer).
+The in-memory chat store belongs to one process, so --app-workers above 1
+needs --app-env CHAT_STORE=supabase.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import jwt
+import requests
+
+from app.gemini_stub import GeminiStub
+
+PROMPTS = [
+    "Graph y = x^2",
+    "Plot sin(x) and cos(x)",
+    "Graph y = x^3 - 2x",
+    "Plot e^x from -2 to 2",
+    "Graph y = 1/x",
+    "Plot y = abs(x)",
+]
+FOLLOW_UPS = ["Make it red", "Change the color to green", "Use purple instead", "Make the curve yellow"]
+
+KNEE_GAIN = 0.10
+KNEE_ERROR_RATE = 0.01
+
+
+def mint_token(secret: str, user_id: str, tier: str = "free") -> str:
+    """HS256 token shaped like Supabase's, accepted by app.auth.verify_token."""
+    now = int(time.time())
+    payload = {
+        "sub": user_id,
+        "role": "authenticated",
+        "aud": "authenticated",
+        "iat": now,
+        "exp": now + 24 * 3600,
+        "app_metadata": {"tier": tier},
+    }
+    return jwt.encode(payload, secret, algorithm="HS256")
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class Recorder:
+    """Collects (endpoint, status, seconds) samples from all virtual users."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: List[Tuple[str, int, float]] = []
+
+    def add(self, endpoint: str, status: int, seconds: float) -> None:
+        with self._lock:
+            self.samples.append((endpoint, status, seconds))
+
+
+class VirtualUser:
+    """One frontend user: starts a chat, sends follow-ups, polls the chat list and history."""
+
+    def __init__(self, base_url: str, token: str, mix: Dict[str, float], recorder: Recorder, timeout: float):
+        self.base_url = base_url.rstrip("/")
+        self.mix = mix
+        self.recorder = recorder
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {token}"
+        self.chat_id: Optional[str] = None
+        self.etags: Dict[str, str] = {}
+
+    def _request(self, endpoint: str, method: str, path: str, **kwargs) -> Optional[requests.Response]:
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+            status = response.status_code
+        except requests.Timeout:
+            response, status = None, 0
+        except requests.RequestException:
+            response, status = None, -1
+        self.recorder.add(endpoint, status, time.perf_counter() - started)
+        return response
+
+    def _poll(self, endpoint: str, path: str) -> None:
+        headers = {"If-None-Match": self.etags[path]} if path in self.etags else {}
+        response = self._request(endpoint, "GET", path, headers=headers)
+        if response is not None and response.status_code == 200 and response.headers.get("ETag"):
+            self.etags[path] = response.headers["ETag"]
+
+    def chat(self) -> None:
+        prompt = random.choice(FOLLOW_UPS if self.chat_id else PROMPTS)
+        body = {"prompt": prompt}
+        if self.chat_id:
+            body["chat_id"] = self.chat_id
+        response = self._request("chat", "POST", "/chat", json=body, headers={"Idempotency-Key": uuid.uuid4().hex})
+        if response is not None and response.status_code == 200:
+            self.chat_id = response.json().get("chat_id") or self.chat_id
+            # Start a new chat now and then, as users do
+            if random.random() < 0.2:
+                self.chat_id = None
+
+    def step(self) -> None:
+        endpoint = random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        if endpoint == "chat":
+            self.chat()
+        elif endpoint == "chats":
+            self._poll("chats", "/chats")
+        elif endpoint == "chatdata":
+            if self.chat_id:
+                self._poll("chatdata", f"/chatdata/{self.chat_id}")
+            else:
+                self.chat()
+
+    def run(self, stop: threading.Event, think_seconds: float) -> None:
+        while not stop.is_set():
+            self.step()
+            if think_seconds:
+                stop.wait(random.uniform(0, 2 * think_seconds))
+
+
+def summarize(concurrency: int, samples: List[Tuple[str, int, float]], seconds: float) -> Dict[str, Any]:
+    """Throughput, latency percentiles and error counts for one level."""
+    ok = [s for s in samples if 200 <= s[1] < 400]
+    errors = [s for s in samples if s[1] >= 500 or s[1] <= 0]
+
+    def latencies(rows) -> Dict[str, Optional[float]]:
+        values = [s[2] for s in rows]
+        return {f"p{p}": round(percentile(values, p), 4) if values else None for p in (50, 95, 99)}
+
+    by_endpoint: Dict[str, list] = defaultdict(list)
+    for sample in samples:
+        by_endpoint[sample[0]].append(sample)
+
+    return {
+        "concurrency": concurrency,
+        "seconds": round(seconds, 2),
+        "requests": len(samples),
+        "rps": round(len(samples) / seconds, 2),
+        "ok_rps": round(len(ok) / seconds, 2),
+        "latency": latencies(samples),
+        "not_modified": sum(1 for s in samples if s[1] == 304),
+        "rejected": sum(1 for s in samples if s[1] == 429),
+        "server_errors": sum(1 for s in samples if s[1] >= 500),
+        "timeouts": sum(1 for s in samples if s[1] == 0),
+        "error_rate": round(len(errors) / len(samples), 4) if samples else 0.0,
+        "endpoints": {
+            name: {"requests": len(rows), **latencies(rows)}
+            for name, rows in sorted(by_endpoint.items())
+        },
+    }
+
+
+def find_saturation(levels: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Peak throughput, and the first level past which more users stop paying off."""
+    if not levels:
+        return {}
+    peak = max(levels, key=lambda level: level["ok_rps"])
+    knee = None
+    for previous, level in zip(levels, levels[1:]):
+        gain = (level["ok_rps"] - previous["ok_rps"]) / previous["ok_rps"] if previous["ok_rps"] else 0.0
+        if level["error_rate"] > KNEE_ERROR_RATE or gain < KNEE_GAIN:
+            knee = previous
+            break
+    return {
+        "peak_ok_rps": peak["ok_rps"],
+        "peak_concurrency": peak["concurrency"],
+        "saturation_concurrency": knee["concurrency"] if knee else None,
+        "saturation_ok_rps": knee["ok_rps"] if knee else None,
+    }
+
+
+def run_level(base_url: str, concurrency: int, args, tokens: List[str], mix: Dict[str, float]) -> Dict[str, Any]:
+    recorder = Recorder()
+    stop = threading.Event()
+    users = [VirtualUser(base_url, tokens[i], mix, recorder, args.timeout) for i in range(concurrency)]
+    threads = [
+        threading.Thread(target=user.run, args=(stop, args.think_seconds), name=f"vu-{i}", daemon=True)
+        for i, user in enumerate(users)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    # Requests in flight at the deadline still count (their latency is real)
+    for thread in threads:
+        thread.join(args.timeout + 1)
+    return summarize(concurrency, list(recorder.samples), time.perf_counter() - started)
+
+
+def _fmt(seconds: Optional[float]) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.0f}"
+
+
+def print_report(levels: List[Dict[str, Any]], saturation: Dict[str, Any]) -> None:
+    print()
+    print(f"{'users':>5} {'req':>6} {'rps':>7} {'ok rps':>7} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'304':>5} {'429':>5} {'5xx':>4} {'t/o':>4} {'err%':>6}")
+    for level in levels:
+        latency = level["latency"]
+        print(
+            f"{level['concurrency']:>5} {level['requests']:>6} {level['rps']:>7} {level['ok_rps']:>7} "
+            f"{_fmt(latency['p50']):>7} {_fmt(latency['p95']):>7} {_fmt(latency['p99']):>7} "
+            f"{level['not_modified']:>5} {level['rejected']:>5} {level['server_errors']:>4} {level['timeouts']:>4} "
+            f"{level['error_rate'] * 100:>5.1f}%"
+        )
+
+    print("\nPer endpoint (p50 / p95 / p99 ms):")
+    for level in levels:
+        parts = [
+            f"{name} {_fmt(stats['p50'])}/{_fmt(stats['p95'])}/{_fmt(stats['p99'])} (n={stats['requests']})"
+            for name, stats in level["endpoints"].items()
+        ]
+        print(f"  {level['concurrency']:>3} users: " + ", ".join(parts))
+
+    print(f"\n📈 Peak: {saturation['peak_ok_rps']} ok rps at {saturation['peak_concurrency']} users")
+    if saturation["saturation_concurrency"] is not None:
+        print(f"🧱 Saturation: {saturation['saturation_concurrency']} users ({saturation['saturation_ok_rps']} ok rps) - more users added latency, not throughput")
+    else:
+        print("🧱 No saturation within the tested levels - try more users")
+
+
+def wait_until_up(base_url: str, process: Optional[subprocess.Popen], timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"API exited with code {process.returncode}")
+        try:
+            if requests.get(f"{base_url}/docs", timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"API not up at {base_url} after {timeout}s")
+
+
+def start_app(args, stub_url: str, secret: str) -> Tuple[subprocess.Popen, str]:
+    """The API in a subprocess, configured for stubs. Its output goes to args.app_log."""
+    env = dict(os.environ)
+    env.update({
+        "GEMINI_API_BASE": stub_url,
+        "GEMINI_API_KEY": "loadtest",
+        "GEMINI_RPM": "0",
+        "GEMINI_CONTEXT_CACHE": "off",
+        "CHAT_STORE": "memory",
+        "SUPABASE_JWT_SECRET": secret,
+        "RENDER_STUB_SECONDS": str(args.render_seconds),
+        # Stubbed render times must not calibrate the real cost model
+        "RENDER_TIMINGS_PATH": os.path.join(tempfile.gettempdir(), "loadtest_render_timings.jsonl"),
+        "POSTPROCESS": "off",
+        "TEX_PREWARM": "off",
+        "WARMER": "off",
+        "STORAGE_BACKEND": "local",
+        "RENDER_BACKEND": "local",
+    })
+    for item in args.app_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+
+    log = open(args.app_log, "w")
+    command = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(args.port), "--workers", str(args.app_workers)]
+    process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return process, f"http://127.0.0.1:{args.port}"
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ("chat", "chats", "chatdata"):
+            raise argparse.ArgumentTypeError(f"unknown endpoint in mix: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Load test the API against stubbed Gemini, store and renderer")
+    parser.add_argument("--levels", default="1,2,4,8,16,32", help="Concurrent users per step")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per level")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("chat=1,chats=2,chatdata=2"), help="Endpoint weights")
+    parser.add_argument("--think-seconds", type=float, default=0.0, help="Mean pause between a user's requests")
+    parser.add_argument("--timeout", type=float, default=120, help="Client timeout per request")
+    parser.add_argument("--render-seconds", type=float, default=2.0, help="Stubbed render time per video")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Stubbed Gemini latency")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Share of Gemini calls failing with 503")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the API under test")
+    parser.add_argument("--app-workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE", help="Extra env for the API")
+    parser.add_argument("--app-log", default=os.path.join("app", "static", "outputs", "loadtest-app.log"), help="API output")
+    parser.add_argument("--url", help="Test an already running API instead of starting one")
+    parser.add_argument("--jwt-secret", default=os.getenv("SUPABASE_JWT_SECRET") or "loadtest-secret", help="Secret to mint user tokens with")
+    parser.add_argument("--tier", default="free", help="app_metadata.tier of the virtual users")
+    parser.add_argument("--output", help="Write the results as JSON")
+    args = parser.parse_args(argv)
+
+    chat_store = dict(item.partition("=")[::2] for item in args.app_env).get("CHAT_STORE", "memory")
+    if not args.url and args.app_workers > 1 and chat_store == "memory":
+        # Each uvicorn worker would keep its own chats: follow-ups and history reads miss them
+        parser.error("--app-workers > 1 needs a shared chat store (--app-env CHAT_STORE=supabase)")
+
+    levels = [int(level) for level in args.levels.split(",") if level.strip()]
+    tokens = [mint_token(args.jwt_secret, str(uuid.uuid4()), args.tier) for _ in range(max(levels))]
+
+    stub = process = None
+    try:
+        if args.url:
+            base_url = args.url.rstrip("/")
+        else:
+            stub = GeminiStub(latency=args.llm_latency, error_rate=args.llm_error_rate).start()
+            process, base_url = start_app(args, stub.url, args.jwt_secret)
+            print(f"🚀 API on {base_url} (Gemini stub {stub.url}, render {args.render_seconds}s, log {args.app_log})")
+        wait_until_up(base_url, process)
+
+        results = []
+        for concurrency in levels:
+            print(f"⏱️  {concurrency} users for {args.duration:.0f}s...")
+            results.append(run_level(base_url, concurrency, args, tokens, args.mix))
+            level = results[-1]
+            print(f"   {level['ok_rps']} ok rps, p95 {_fmt(level['latency']['p95'])} ms, errors {level['error_rate'] * 100:.1f}%")
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if stub is not None:
+            stub.stop()
+
+    saturation = find_saturation(results)
+    print_report(results, saturation)
+
+    if args.output:
+        report = {
+            "config": {
+                "levels": levels,
+                "duration": args.duration,
+                "mix": args.mix,
+                "render_seconds": args.render_seconds,
+                "llm_latency": args.llm_latency,
+                "url": args.url,
+            },
+            "levels": results,
+            "saturation": saturation,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,49 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Header, Request, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 
-from app.models import GenerateRequest, GenerateResponse, SignupRequest, LoginRequest, AuthResponse, ChatRequest, ChatResponse
+from app.models import SignupRequest, LoginRequest, AuthResponse, ChatRequest, ChatResponse, BatchRequest, BatchResponse
 from app.script_gen import generate_script
-from app.renderer import render_manim_script
+from app.renderer import QUALITY_DIRS
+from app.incremental import render_chat_turn, upgrade_chat_turn, load_chat_state, get_chat_preview
+from app.scheduler import render_scheduler, OverloadedError
+from app.singleflight import idempotency_store, IdempotencyConflictError
+from app.job_queue import RENDER_BACKEND, get_render_queue
+from app.batch import BATCH_DIR, BATCH_MAX_PROMPTS, run_batch, dedupe_prompts, load_prompts_file
+from app.gemini_client import gemini_client
+from app.llm_context import llm_usage
+from app.postprocess import delivery_stats, url_to_path
+from app.profiling import PROFILE_HEADER, request_profiler
+from app.storage import video_store
+from app.warmer import popularity_warmer
 from app.supabase_client import supabase
-from app.auth import verify_token
-from app.chat_service import create_chat, add_message, get_chat_history, get_user_chats, delete_chat, check_chat_exists
+from app.auth import verify_token, get_user_tier, is_admin, require_admin
+from app.chat_service import create_chat, add_message, get_chat_history, get_user_chats, delete_chat, check_chat_exists, update_message_video
 from app.auth import verify_token
 
+import os
 import re
+import json
+import uuid
+import hashlib
+import argparse
+import sys
 import subprocess
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Optional
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pre-warms popular prompts in the background while the API is idle (app/warmer.py)
+    popularity_warmer.start()
+    yield
+    popularity_warmer.stop()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow any origin for now (you can restrict later)
 app.add_middleware(
@@ -21,8 +51,54 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets the frontend send If-None-Match on its polls
+    expose_headers=["ETag"],
 )
 
+
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    """Tags every request with an id (the client's X-Request-ID, or a new one), echoed in the response."""
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+    if not re.fullmatch(r"[A-Za-z0-9_-]{1,64}", request_id):
+        request_id = uuid.uuid4().hex
+    request.state.request_id = request_id
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+def conditional_json(request: Request, body) -> Response:
+    """
+    JSON response with an ETag over its content; 304 without a body when
+    the client's If-None-Match already has it. no-cache makes browsers
+    revalidate each poll instead of reusing a stale copy.
+    """
+    content = jsonable_encoder(body)
+    etag = 'W/"' + hashlib.sha1(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content, headers=headers)
+
+
+@app.get("/static/outputs/videos/{video_path:path}")
+def serve_video(video_path: str):
+    """
+    Rendered videos: from this node's local cache when present, otherwise
+    a redirect to object storage (evicted, or rendered on another node).
+    """
+    video_url = f"/static/outputs/videos/{video_path}"
+    local_path = url_to_path(video_url)
+    if ".." not in Path(video_path).parts and os.path.isfile(local_path):
+        video_store.touch(local_path)
+        return FileResponse(local_path, media_type="video/mp4" if local_path.endswith(".mp4") else None)
+    if video_store.remote:
+        return RedirectResponse(video_store.resolve_url(video_url), status_code=307)
+    raise HTTPException(status_code=404, detail="Video not found")
+
+
 # Serve static files (video outputs)
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
@@ -90,15 +166,57 @@ def login(request: LoginRequest):
 
 
 @app.post("/chat", response_model=ChatResponse)
-def chat_endpoint(request: ChatRequest, user: dict = Depends(verify_token)):
+def chat_endpoint(
+    request: ChatRequest,
+    http_request: Request,
+    response: Response,
+    user: dict = Depends(verify_token),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    profile_header: Optional[str] = Header(None, alias=PROFILE_HEADER),
+):
     """
     Handle chat messages. 
     - Creates a new chat if chat_id is missing OR if the provided chat_id doesn't exist.
     - Generates video for the prompt.
     - Saves user message and assistant response to DB.
+    - Picks render quality from current load; rejects with 429 when overloaded.
+    - Renders share capacity fairly between users, weighted by tier.
+    - A retried request with the same Idempotency-Key returns the original response.
+    - Profiled on an admin's X-Profile header or by sampling (GET /profiles/{request_id}).
     """
+    request_id = http_request.state.request_id
+    profiled = request_profiler.should_profile(profile_header, is_admin(user))
+    if profiled:
+        response.headers["X-Profile-Id"] = request_id
+    with request_profiler.profile(request_id, "/chat", enabled=profiled):
+        return _chat(request, user, idempotency_key)
+
+
+def _chat(request: ChatRequest, user: dict, idempotency_key: Optional[str]) -> dict:
+    user_id = user["sub"]
+    tier = get_user_tier(user)
+
+    if not idempotency_key:
+        return process_chat(request, user_id, tier)
+
+    store_key = (user_id, idempotency_key)
+    fingerprint = hashlib.sha256(
+        json.dumps({"prompt": request.prompt, "chat_id": request.chat_id}, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    try:
+        return idempotency_store.run(store_key, fingerprint, lambda: process_chat(request, user_id, tier))
+    except IdempotencyConflictError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+def process_chat(request: ChatRequest, user_id: str, tier: str) -> dict:
+    """Runs one chat turn end to end (see chat_endpoint)"""
+    try:
+        quality = render_scheduler.admit(user_id, tier)
+    except OverloadedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
     try:
-        user_id = user["sub"]
         chat_id = request.chat_id
         prompt = request.prompt
         
@@ -116,50 +234,149 @@ def chat_endpoint(request: ChatRequest, user: dict = Depends(verify_token)):
         # 2. Save User Message
         add_message(chat_id, "user", prompt)
         
-        # 3. Generate Video
-        output_path = "app/static/outputs/generated_scene.py"
-        generate_script(prompt, output_path=output_path)
-        video_url = render_manim_script(output_path)
+        # 3. Generate Video (follow-ups in the same chat re-render incrementally,
+        #    identical prompts in flight share one run)
+        rendered = render_chat_turn(chat_id, prompt, quality=quality, user_id=user_id, tier=tier)
+        video_url = rendered["video_url"]
         
-        # 4. Save Assistant Message
-        add_message(chat_id, "assistant", "Here is your video!", video_url)
+        # 4. Save Assistant Message (poster + storyboard next to the video)
+        add_message(
+            chat_id, "assistant", "Here is your video!", video_url,
+            poster_url=rendered["poster_url"], storyboard_urls=rendered["storyboard_urls"]
+        )
+        
+        # 5. Degraded under load → re-render at full quality once things calm down
+        if quality != "h":
+            schedule_quality_upgrade(chat_id, video_url)
         
         return {
             "chat_id": chat_id,
-            "message": {
+            "message": video_store.resolve_media({
                 "role": "assistant",
                 "content": "Here is your video!",
-                "video_url": video_url
-            }
+                "video_url": video_url,
+                "poster_url": rendered["poster_url"],
+                "storyboard_urls": rendered["storyboard_urls"]
+            })
         }
     except Exception as e:
         print(f"Error in chat endpoint: {e}")
+        if gemini_client.degraded:
+            # Failed for lack of Gemini - tell the client when to come back instead of a bare 500
+            raise HTTPException(
+                status_code=503,
+                detail=f"Generation is temporarily degraded: {e}",
+                headers={"Retry-After": str(gemini_client.retry_after())},
+            )
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        render_scheduler.release(user_id)
+
+
+def schedule_quality_upgrade(chat_id: str, video_url: str):
+    """Queue a background re-render at -qh and repoint the assistant message to it"""
+    state = load_chat_state(chat_id)
+    if not state:
+        return
+    turn = state["turn"]
+
+    def upgrade():
+        upgraded_url = upgrade_chat_turn(chat_id, turn)
+        if upgraded_url:
+            update_message_video(chat_id, video_url, upgraded_url)
+
+    render_scheduler.schedule_upgrade(upgrade)
+
+
+@app.get("/queue")
+def queue_status(user: dict = Depends(verify_token)):
+    """Render queue status for the authenticated user (poll while /chat is pending)"""
+    tier = get_user_tier(user)
+    status = render_scheduler.user_queue(user["sub"])
+    status["tier"] = tier
+    # Where a /chat sent now would start (0 = right away)
+    status["queue_position_if_submitted"] = render_scheduler.estimate_position(user["sub"], tier)
+    if RENDER_BACKEND == "queue":
+        status["render_queue"] = get_render_queue().stats()
+    return status
+
+
+@app.get("/llm/usage")
+def llm_usage_report(user: dict = Depends(require_admin)):
+    """Gemini token usage, latency and success rate per call type and prompt variant, plus circuit state (admins only)"""
+    return {"usage": llm_usage.report(), "gemini": gemini_client.stats()}
+
+
+@app.get("/profiles")
+def list_profiles(user: dict = Depends(require_admin)):
+    """Recent request profiles (admins only)"""
+    return {"profiles": request_profiler.list()}
+
+
+@app.get("/profiles/{request_id}")
+def get_profile(request_id: str, download: Optional[str] = None, user: dict = Depends(require_admin)):
+    """
+    A request's profile summary: top functions, Manim per-animation timings.
+    ?download=prof or ?download=collapsed returns the cProfile stats or the
+    folded stacks for a flamegraph (admins only).
+    """
+    summary = request_profiler.get(request_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="No profile for this request")
+    if download:
+        path = summary["files"].get(download)
+        if not path or not os.path.isfile(path):
+            raise HTTPException(status_code=404, detail=f"No {download} file for this profile")
+        return FileResponse(path, filename=os.path.basename(path))
+    return summary
+
+
+@app.get("/warmer")
+def warmer_report(user: dict = Depends(require_admin)):
+    """Pre-warming state: what was warmed or preempted, warm cache entries and hits (admins only)"""
+    return popularity_warmer.stats()
+
+
+@app.get("/videos/delivery")
+def delivery_report(user: dict = Depends(require_admin)):
+    """Bytes saved by video post-processing (faststart + re-encode), in total and per recent video (admins only)"""
+    return delivery_stats.report()
+
+
+@app.get("/preview/{chat_id}")
+def get_preview(chat_id: str, user: dict = Depends(verify_token)):
+    """Poster/storyboard of the chat's current turn (available before its video is ready)"""
+    preview = get_chat_preview(chat_id)
+    if not preview:
+        raise HTTPException(status_code=404, detail="No preview for this chat yet")
+    return video_store.resolve_media(preview)
 
 
 @app.get("/chats")
-def list_chats(user: dict = Depends(verify_token)):
-    """List all chats for the authenticated user"""
+def list_chats(request: Request, user: dict = Depends(verify_token)):
+    """List all chats for the authenticated user (304 when unchanged since the If-None-Match ETag)"""
     try:
         user_id = user["sub"]
-        return get_user_chats(user_id)
+        chats = get_user_chats(user_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return conditional_json(request, chats)
 
 
 @app.get("/chatdata/{chat_id}")
-def get_chat_data(chat_id: str, user: dict = Depends(verify_token)):
-    """Get full history for a specific chat"""
+def get_chat_data(chat_id: str, request: Request, user: dict = Depends(verify_token)):
+    """Get full history for a specific chat (304 when unchanged since the If-None-Match ETag)"""
     try:
         # Ideally check if user owns the chat first
-        return get_chat_history(chat_id)
+        messages = [video_store.resolve_media(message) for message in get_chat_history(chat_id)]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return conditional_json(request, messages)
 
 @app.get("/chats/{chat_id}")
-def get_chat_by_id(chat_id: str, user: dict = Depends(verify_token)):
+def get_chat_by_id(chat_id: str, request: Request, user: dict = Depends(verify_token)):
     """Alias for /chatdata/{chat_id} to support frontend"""
-    return get_chat_data(chat_id, user)
+    return get_chat_data(chat_id, request, user)
 
 
 
@@ -174,6 +391,52 @@ def delete_chat_endpoint(chat_id: str, user: dict = Depends(verify_token)):
 
 
 
+def run_background_batch(prompts: list, batch_id: str, quality: str, owner: str) -> None:
+    """A /batch run: its Gemini calls leave rate-limit headroom to interactive /chat requests."""
+    with gemini_client.background():
+        run_batch(prompts, batch_id=batch_id, quality=quality, owner=owner)
+
+
+@app.post("/batch", response_model=BatchResponse)
+def batch_endpoint(request: BatchRequest, background_tasks: BackgroundTasks, user: dict = Depends(require_admin)):
+    """
+    Queue bulk generation for many prompts (admins only - it renders on
+    this node's cores outside the render scheduler).
+    Rendering runs in the background; poll the manifest for progress.
+    """
+    if request.quality not in QUALITY_DIRS:
+        raise HTTPException(status_code=400, detail=f"Unknown quality: {request.quality}")
+    if len(request.prompts) > BATCH_MAX_PROMPTS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_PROMPTS} prompts per batch")
+
+    batch_id = uuid.uuid4().hex
+    background_tasks.add_task(run_background_batch, request.prompts, batch_id, request.quality, user["sub"])
+
+    return {
+        "batch_id": batch_id,
+        "manifest_url": f"/batch/{batch_id}",
+        "prompt_count": len(request.prompts),
+        "unique_count": len(dedupe_prompts(request.prompts)),
+    }
+
+
+@app.get("/batch/{batch_id}")
+def get_batch_manifest(batch_id: str, user: dict = Depends(verify_token)):
+    """Get the manifest (prompt → video) of a batch run (its owner's, or any for admins)"""
+    manifest_path = os.path.join(BATCH_DIR, os.path.basename(batch_id), "manifest.json")
+    if not os.path.exists(manifest_path):
+        raise HTTPException(status_code=404, detail="Batch not found or not started yet")
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    # Someone else's batch looks the same as a missing one
+    if manifest.get("owner") != user["sub"] and not is_admin(user):
+        raise HTTPException(status_code=404, detail="Batch not found or not started yet")
+    for item in manifest["items"]:
+        item["video_url"] = video_store.resolve_url(item.get("video_url"))
+    return manifest
+
+
 # CLI entry point for testing without API
 def cli_mode():
     prompt = input("Enter your prompt: ")
@@ -196,6 +459,40 @@ def cli_mode():
     ])
 
 
+def batch_cli_mode(args):
+    prompts = load_prompts_file(args.prompts_file)
+    run_batch(
+        prompts,
+        batch_id=args.batch_id,
+        quality=args.quality,
+        llm_workers=args.llm_workers,
+        render_workers=args.workers,
+        resume=args.resume,
+        progress=sys.stdout.isatty() if args.progress is None else args.progress,
+    )
+
+
+def parse_cli_args(argv=None):
+    parser = argparse.ArgumentParser(description="Text-to-Manim video generator")
+    subparsers = parser.add_subparsers(dest="command")
+
+    batch_parser = subparsers.add_parser("batch", help="Generate videos for every prompt in a file")
+    batch_parser.add_argument("prompts_file", help="Prompts file (.txt one per line, .json list or .jsonl)")
+    batch_parser.add_argument("--quality", choices=sorted(QUALITY_DIRS), default="l", help="Manim render quality")
+    batch_parser.add_argument("--workers", type=int, default=None, help="Render processes (default: CPU count)")
+    batch_parser.add_argument("--llm-workers", type=int, default=4, help="Concurrent LLM calls")
+    batch_parser.add_argument("--batch-id", default=None, help="Output folder name (default: timestamp); reuse it to resume")
+    batch_parser.add_argument("--no-resume", dest="resume", action="store_false", help="Regenerate prompts that already have a video")
+    batch_parser.add_argument("--progress", dest="progress", action="store_true", default=None, help="Show progress bars (default: when run in a terminal)")
+    batch_parser.add_argument("--no-progress", dest="progress", action="store_false", help="Plain log output")
+
+    return parser.parse_args(argv)
+
+
 # This triggers only when you run `python app/main.py`
 if __name__ == "__main__":
-    cli_mode()
+    cli_args = parse_cli_args()
+    if cli_args.command == "batch":
+        batch_cli_mode(cli_args)
+    else:
+        cli_mode()
@@ -0,0 +1,81 @@
+"""
+Manim CLI with per-animation timing.
+
+    python -m app.manim_timing <timings.json> -ql scene.py GeneratedScene ...
+
+Runs `manim <args>` unchanged, with Scene.play and Scene.wait wrapped to
+record the wall-clock time of each call (frame rendering plus writing its
+partial movie file). The timings are written to <timings.json> as a list:
+
+    [{"index": 0, "kind": "play", "animations": ["Write"], "skipped": false, "seconds": 1.92}, ...]
+
+index is Manim's animation number (as in -n and the partial movie files);
+skipped animations (before a -n range, or cached) are recorded too.
+"""
+
+import sys
+import json
+import time
+import functools
+from typing import Any, Dict, List
+
+
+def read_animation_timings(path: str) -> List[Dict[str, Any]]:
+    """Timings written by a timed render, [] if there are none."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            timings = json.load(f)
+    except (OSError, ValueError):
+        return []
+    return timings if isinstance(timings, list) else []
+
+
+def merge_animation_timings(paths: List[str], output_path: str) -> None:
+    """Joins the timings of a sectioned render's parts, keeping each animation from the part that rendered it."""
+    rendered: Dict[int, Dict[str, Any]] = {}
+    for path in paths:
+        for timing in read_animation_timings(path):
+            if not timing.get("skipped") or timing["index"] not in rendered:
+                rendered[timing["index"]] = timing
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump([rendered[i] for i in sorted(rendered)], f)
+
+
+def _timed(method, kind: str, timings: List[Dict[str, Any]]):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        index = self.renderer.num_plays
+        started = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            timings.append({
+                "index": index,
+                "kind": kind,
+                "animations": [type(a).__name__ for a in args] if kind == "play" else [],
+                "skipped": bool(getattr(self.renderer, "skip_animations", False)),
+                "seconds": round(time.perf_counter() - started, 4),
+            })
+    return wrapper
+
+
+def main() -> None:
+    timings_path, manim_args = sys.argv[1], sys.argv[2:]
+
+    from manim import Scene
+    from manim.__main__ import main as manim_main
+
+    timings: List[Dict[str, Any]] = []
+    Scene.play = _timed(Scene.play, "play", timings)
+    Scene.wait = _timed(Scene.wait, "wait", timings)
+
+    sys.argv = ["manim"] + manim_args
+    try:
+        manim_main()
+    finally:
+        with open(timings_path, "w", encoding="utf-8") as f:
+            json.dump(timings, f)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+In-memory stand-in for the Supabase tables (CHAT_STORE=memory).
+
+Implements the part of the supabase-py query builder the app uses -
+table().select/insert/update/delete, eq/neq/gte/lte filters, order, limit,
+execute() - over dicts in this process. Meant for load tests and local
+development without a Supabase project; nothing is persisted.
+
+Deleting a chat deletes its messages, like the cascade in the real schema.
+"""
+
+import uuid
+import threading
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Child rows deleted with their parent: table → [(child table, foreign key)]
+CASCADES = {"chats": [("messages", "chat_id")]}
+
+
+class _Query:
+    def __init__(self, store: "MemoryClient", table: str):
+        self.store = store
+        self.table = table
+        self.action = "select"
+        self.columns: Optional[List[str]] = None
+        self.values: Any = None
+        self.filters: List[Callable[[Dict[str, Any]], bool]] = []
+        self.ordering: Optional[Tuple[str, bool]] = None
+        self.max_rows: Optional[int] = None
+
+    def select(self, columns: str = "*", **_):
+        self.action = "select"
+        self.columns = None if columns.strip() == "*" else [c.strip() for c in columns.split(",")]
+        return self
+
+    def insert(self, values):
+        self.action, self.values = "insert", values
+        return self
+
+    def update(self, values: Dict[str, Any]):
+        self.action, self.values = "update", values
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    def eq(self, column: str, value: Any):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def neq(self, column: str, value: Any):
+        self.filters.append(lambda row: row.get(column) != value)
+        return self
+
+    def gte(self, column: str, value: Any):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) >= value)
+        return self
+
+    def lte(self, column: str, value: Any):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) <= value)
+        return self
+
+    def order(self, column: str, desc: bool = False, **_):
+        self.ordering = (column, desc)
+        return self
+
+    def limit(self, count: int, **_):
+        self.max_rows = count
+        return self
+
+    def _matches(self, row: Dict[str, Any]) -> bool:
+        return all(match(row) for match in self.filters)
+
+    def execute(self) -> SimpleNamespace:
+        with self.store.lock:
+            rows = self.store.tables.setdefault(self.table, [])
+
+            if self.action == "insert":
+                inserted = []
+                for values in (self.values if isinstance(self.values, list) else [self.values]):
+                    row = {"id": str(uuid.uuid4()), "created_at": self.store.now(), **values}
+                    rows.append(row)
+                    inserted.append(dict(row))
+                return SimpleNamespace(data=inserted)
+
+            matched = [row for row in rows if self._matches(row)]
+            if self.action == "update":
+                for row in matched:
+                    row.update(self.values)
+                return SimpleNamespace(data=[dict(row) for row in matched])
+
+            if self.action == "delete":
+                self.store.tables[self.table] = [row for row in rows if not self._matches(row)]
+                for child, foreign_key in CASCADES.get(self.table, []):
+                    ids = {row.get("id") for row in matched}
+                    children = self.store.tables.get(child, [])
+                    self.store.tables[child] = [row for row in children if row.get(foreign_key) not in ids]
+                return SimpleNamespace(data=[dict(row) for row in matched])
+
+            if self.ordering:
+                column, desc = self.ordering
+                matched = sorted(matched, key=lambda row: (row.get(column) is None, row.get(column) or ""), reverse=desc)
+            if self.max_rows is not None:
+                matched = matched[:self.max_rows]
+            if self.columns:
+                return SimpleNamespace(data=[{c: row.get(c) for c in self.columns} for row in matched])
+            return SimpleNamespace(data=[dict(row) for row in matched])
+
+
+class MemoryClient:
+    """Drop-in for the Supabase client's table API."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+
+    def now(self) -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, name)
@@ -1,3 +1,5 @@
+from typing import List
+
 from pydantic import BaseModel, EmailStr
 
 class GenerateRequest(BaseModel):
@@ -25,6 +27,8 @@ class Message(BaseModel):
     role: str
     content: str
     video_url: str = None
+    poster_url: str = None  # Last frame, rendered before the video
+    storyboard_urls: List[str] = []  # Key frames at section boundaries
 
 class ChatRequest(BaseModel):
     prompt: str
@@ -34,4 +38,15 @@ class ChatRequest(BaseModel):
 
 class ChatResponse(BaseModel):
     chat_id: str
-    message: Message
\ No newline at end of file
+    message: Message
+
+class BatchRequest(BaseModel):
+    prompts: List[str]
+    quality: str = "l"  # Manim quality flag: l, m or h
+
+
+class BatchResponse(BaseModel):
+    batch_id: str
+    manifest_url: str
+    prompt_count: int
+    unique_count: int
@@ -0,0 +1,309 @@
+"""
+Delivery post-processing for rendered videos.
+
+Manim writes MP4s with the moov atom (the index a player needs before it
+can start) at the end of the file and encodes for quality, not size. After
+a render, each video is:
+
+1. Remuxed with the moov atom up front (faststart) so playback starts
+   while the rest downloads - a stream copy, done before the render
+   returns.
+2. In the background (POSTPROCESS_WORKERS threads, off the request path
+   and outside its render slot): re-encoded to H.264 at POSTPROCESS_CRF /
+   POSTPROCESS_PRESET, swapped in if smaller, and optionally scaled down
+   to lower renditions (POSTPROCESS_RENDITIONS, e.g. "480,360"), saved
+   next to it as <name>_<height>p.mp4. Listeners registered with
+   on_optimized() hear about it (storage uploads the new files).
+
+Pool worker processes (batch renders) call defer_optimizations(): they only
+remux, and the parent queues step 2 with optimize_in_background(), since a
+worker's background threads and listeners don't outlive it.
+
+The size saved for each video is logged and kept in delivery_stats.
+"""
+
+import os
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait as futures_wait
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+POSTPROCESS = os.getenv("POSTPROCESS", "on").lower() in ("1", "true", "on")
+POSTPROCESS_CRF = int(os.getenv("POSTPROCESS_CRF", "26"))
+POSTPROCESS_PRESET = os.getenv("POSTPROCESS_PRESET", "medium")
+POSTPROCESS_RENDITIONS = [
+    int(h) for h in os.getenv("POSTPROCESS_RENDITIONS", "").replace(" ", "").split(",") if h
+]
+POSTPROCESS_WORKERS = int(os.getenv("POSTPROCESS_WORKERS", "1"))
+# Renditions are smaller by design, so they get a slightly higher CRF
+RENDITION_CRF_OFFSET = 2
+
+
+def url_to_path(video_url: str) -> str:
+    """Filesystem path of a /static/... video URL."""
+    return os.path.join("app", video_url.lstrip("/"))
+
+
+def rendition_path(video_path: str, height: int) -> str:
+    path = Path(video_path)
+    return str(path.with_name(f"{path.stem}_{height}p{path.suffix}"))
+
+
+def _even(value: float) -> int:
+    # yuv420p needs even dimensions
+    return max(2, int(round(value / 2)) * 2)
+
+
+def encode_h264(input_path: str, output_path: str, crf: int = POSTPROCESS_CRF, preset: str = POSTPROCESS_PRESET,
+                height: Optional[int] = None) -> None:
+    """
+    Re-encodes the video stream to H.264 (yuv420p) with faststart, scaling
+    to the given height if one is set. Audio, if any, is copied.
+    """
+    import av
+
+    with av.open(input_path) as source:
+        in_video = source.streams.video[0]
+        in_audio = source.streams.audio[0] if source.streams.audio else None
+
+        width, out_height = in_video.codec_context.width, in_video.codec_context.height
+        if height and height < out_height:
+            width, out_height = _even(width * height / out_height), _even(height)
+
+        with av.open(output_path, mode="w", format="mp4", options={"movflags": "+faststart"}) as output:
+            out_video = output.add_stream("libx264", rate=in_video.average_rate or 30)
+            out_video.width = width
+            out_video.height = out_height
+            out_video.pix_fmt = "yuv420p"
+            out_video.codec_context.time_base = in_video.time_base
+            out_video.options = {"crf": str(crf), "preset": preset}
+            out_audio = output.add_stream(template=in_audio) if in_audio is not None else None
+
+            streams = [s for s in (in_video, in_audio) if s is not None]
+            for packet in source.demux(*streams):
+                if packet.stream is in_video:
+                    for frame in packet.decode():
+                        if frame.width != width or frame.height != out_height or frame.format.name != "yuv420p":
+                            frame = frame.reformat(width=width, height=out_height, format="yuv420p")
+                        output.mux(out_video.encode(frame))
+                elif packet.dts is not None:
+                    packet.stream = out_audio
+                    output.mux(packet)
+            output.mux(out_video.encode())
+
+
+def remux_faststart(input_path: str, output_path: str) -> None:
+    """Copies all streams unchanged into a file with the moov atom up front."""
+    import av
+
+    with av.open(input_path) as source:
+        with av.open(output_path, mode="w", format="mp4", options={"movflags": "+faststart"}) as output:
+            streams = {s.index: output.add_stream(template=s) for s in source.streams if s.type in ("video", "audio")}
+            for packet in source.demux(*[source.streams[i] for i in streams]):
+                if packet.dts is None:
+                    continue
+                packet.stream = streams[packet.stream.index]
+                output.mux(packet)
+
+
+class DeliveryStats:
+    """Bytes before/after post-processing, per video and in total."""
+
+    RECENT = 100
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.videos = 0
+        self.original_bytes = 0
+        self.optimized_bytes = 0
+        self.recent: List[Dict[str, Any]] = []
+
+    def record(self, result: Dict[str, Any]) -> None:
+        with self._lock:
+            self.videos += 1
+            self.original_bytes += result["original_bytes"]
+            self.optimized_bytes += result["optimized_bytes"]
+            self.recent = (self.recent + [result])[-self.RECENT:]
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            saved = self.original_bytes - self.optimized_bytes
+            return {
+                "videos": self.videos,
+                "original_bytes": self.original_bytes,
+                "optimized_bytes": self.optimized_bytes,
+                "saved_bytes": saved,
+                "saved_percent": round(100 * saved / self.original_bytes, 1) if self.original_bytes else None,
+                "recent": list(self.recent),
+            }
+
+
+class VideoChangedError(Exception):
+    """The video was rewritten (re-rendered) while it was being optimized."""
+
+
+def optimize_video(video_path: str, crf: int = POSTPROCESS_CRF, preset: str = POSTPROCESS_PRESET,
+                   renditions: Optional[List[int]] = None, expected_mtime_ns: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Replaces a rendered MP4 with a delivery-optimized one, and writes the
+    lower renditions next to it.
+
+    With expected_mtime_ns, raises VideoChangedError instead of swapping in
+    the result when the file was rewritten in the meantime.
+
+    Returns:
+        {"path", "original_bytes", "optimized_bytes", "saved_bytes",
+         "reencoded", "renditions": {height: path}, "seconds"}
+    """
+    started = time.monotonic()
+    renditions = POSTPROCESS_RENDITIONS if renditions is None else renditions
+    original_bytes = os.path.getsize(video_path)
+    temp_path = f"{video_path}.tmp.mp4"
+
+    try:
+        encode_h264(video_path, temp_path, crf, preset)
+        reencoded = os.path.getsize(temp_path) < original_bytes
+        if not reencoded:
+            # Manim's encode was already smaller - keep it, just move the index up front
+            remux_faststart(video_path, temp_path)
+
+        rendition_paths = {}
+        source_height = _video_height(temp_path)
+        for height in sorted(set(renditions), reverse=True):
+            if height >= source_height:
+                continue
+            path = rendition_path(video_path, height)
+            encode_h264(temp_path, f"{path}.tmp.mp4", crf + RENDITION_CRF_OFFSET, preset, height=height)
+            os.replace(f"{path}.tmp.mp4", path)
+            rendition_paths[height] = path
+
+        if expected_mtime_ns is not None and os.stat(video_path).st_mtime_ns != expected_mtime_ns:
+            raise VideoChangedError(f"{video_path} was re-rendered")
+        # Atomic swap, so a client never fetches a half-written file
+        os.replace(temp_path, video_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    optimized_bytes = os.path.getsize(video_path)
+    result = {
+        "path": video_path,
+        "original_bytes": original_bytes,
+        "optimized_bytes": optimized_bytes,
+        "saved_bytes": original_bytes - optimized_bytes,
+        "reencoded": reencoded,
+        "renditions": rendition_paths,
+        "seconds": round(time.monotonic() - started, 2),
+    }
+    delivery_stats.record(result)
+
+    saved_percent = 100 * result["saved_bytes"] / original_bytes if original_bytes else 0
+    print(f"📉 {Path(video_path).name}: {original_bytes / 1024:.0f} KB → {optimized_bytes / 1024:.0f} KB "
+          f"({saved_percent:.0f}% saved{', ' + str(len(rendition_paths)) + ' renditions' if rendition_paths else ''}) "
+          f"in {result['seconds']}s")
+    return result
+
+
+def _video_height(video_path: str) -> int:
+    import av
+
+    with av.open(video_path) as container:
+        return container.streams.video[0].codec_context.height
+
+
+_optimize_pool = ThreadPoolExecutor(max_workers=max(1, POSTPROCESS_WORKERS), thread_name_prefix="postprocess")
+_pending: Dict[str, Future] = {}
+_pending_lock = threading.Lock()
+_listeners: List[Callable[[str], Any]] = []
+# Set by defer_optimizations() in pool worker processes
+_defer = False
+
+
+def on_optimized(listener: Callable[[str], Any]) -> None:
+    """Calls listener(video_url) whenever a video was replaced by its optimized version."""
+    _listeners.append(listener)
+
+
+def _optimize_in_background(video_url: str, mtime_ns: int) -> None:
+    try:
+        optimize_video(url_to_path(video_url), expected_mtime_ns=mtime_ns)
+    except VideoChangedError:
+        return
+    except Exception as e:
+        print(f"⚠️  Re-encode skipped for {video_url}: {e}")
+        return
+    for listener in _listeners:
+        try:
+            listener(video_url)
+        except Exception as e:
+            print(f"⚠️  Optimized-video listener failed for {video_url}: {e}")
+
+
+def defer_optimizations() -> None:
+    """
+    Makes postprocess_video_url() in this process stop after the faststart
+    remux; the caller queues the rest with optimize_in_background(). Meant as
+    a process pool initializer.
+    """
+    global _defer
+    _defer = True
+
+
+def optimize_in_background(video_url: str) -> None:
+    """Queues the re-encode and renditions of a rendered (already faststarted) video."""
+    if not POSTPROCESS:
+        return
+    try:
+        mtime_ns = os.stat(url_to_path(video_url)).st_mtime_ns
+    except OSError as e:
+        print(f"⚠️  Re-encode skipped for {video_url}: {e}")
+        return
+
+    future = _optimize_pool.submit(_optimize_in_background, video_url, mtime_ns)
+    with _pending_lock:
+        _pending[video_url] = future
+    future.add_done_callback(lambda done: _forget(video_url, done))
+
+
+def postprocess_video_url(video_url: str) -> str:
+    """
+    Runs the delivery stage on a rendered video, identified by its URL:
+    faststart now, re-encode and renditions in the background (unless
+    deferred to the parent process).
+
+    Never fails the render: on error the video stays as Manim wrote it.
+    """
+    if not POSTPROCESS:
+        return video_url
+    video_path = url_to_path(video_url)
+    temp_path = f"{video_path}.faststart.mp4"
+    try:
+        remux_faststart(video_path, temp_path)
+        os.replace(temp_path, video_path)
+    except Exception as e:
+        print(f"⚠️  Post-processing skipped for {video_url}: {e}")
+        return video_url
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    if not _defer:
+        optimize_in_background(video_url)
+    return video_url
+
+
+def _forget(video_url: str, future: Future) -> None:
+    with _pending_lock:
+        if _pending.get(video_url) is future:
+            del _pending[video_url]
+
+
+def wait_for_optimizations(timeout: Optional[float] = None) -> None:
+    """Blocks until the background re-encodes are done (e.g. before a CLI run or worker exits)."""
+    with _pending_lock:
+        futures = list(_pending.values())
+    futures_wait(futures, timeout=timeout)
+
+
+delivery_stats = DeliveryStats()
@@ -0,0 +1,282 @@
+"""
+On-demand request profiling.
+
+A /chat request is profiled when it carries the profiling header
+(X-Profile) from an admin - app_metadata.role "admin", or the header set
+to PROFILE_TOKEN - or when it falls into the PROFILE_SAMPLE_PERCENT sample.
+For a profiled request:
+
+- cProfile runs on the request thread and on pool threads doing work for
+  it (wrapped with propagate()), covering template selection, codegen,
+  validation and JSON parsing; the merged stats are saved as
+  <request_id>.prof (snakeviz, flameprof, gprof2dot)
+- the same threads' stacks are sampled every PROFILE_INTERVAL_MS and saved
+  as <request_id>.collapsed, folded stacks for flamegraph.pl or speedscope
+- the render reports Manim's per-animation timings (also from a render
+  worker), saved with the summary in <request_id>.json
+
+Profiles are written to PROFILE_DIR (outside /static) and listed by
+GET /profiles; the response's X-Request-ID names them.
+
+Python versions: on 3.11 and older each thread gets its own cProfile, so
+concurrent profiled requests don't mix. From 3.12 cProfile runs on
+sys.monitoring, which allows one active profiler per process and records
+every thread: the first profiled thread gets it (its .prof then includes
+whatever else the process ran meanwhile), and other threads and
+concurrent profiled requests are only sampled.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import cProfile
+import pstats
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_PERCENT = float(os.getenv("PROFILE_SAMPLE_PERCENT", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# Profiles kept on disk, oldest deleted first
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))
+PROFILE_TOP_FUNCTIONS = 30
+
+# Collapsed stacks stop at this depth (deep recursion would blow up the file)
+MAX_STACK_DEPTH = 128
+
+_local = threading.local()
+
+
+def current_session() -> Optional["ProfileSession"]:
+    """Profile of the request this thread is working for, if it is profiled."""
+    return getattr(_local, "session", None)
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+class ProfileSession:
+    """Everything recorded for one profiled request."""
+
+    def __init__(self, request_id: str, label: str):
+        self.request_id = request_id
+        self.label = label
+        self.started = time.time()
+        self.seconds: Optional[float] = None
+        self.animation_timings: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._profiles: List[cProfile.Profile] = []
+        self._sampled_only = 0
+        self._threads: Dict[int, str] = {}
+        self._stacks: Counter = Counter()
+        self._stop = threading.Event()
+
+    def artifact_path(self, suffix: str) -> str:
+        Path(PROFILE_DIR).mkdir(parents=True, exist_ok=True)
+        return os.path.join(PROFILE_DIR, f"{self.request_id}{suffix}")
+
+    @contextmanager
+    def thread(self):
+        """Profiles (and samples) the calling thread for the duration of the block."""
+        previous = current_session()
+        if previous is self:
+            # Already profiled (work propagated to the same thread)
+            yield self
+            return
+        _local.session = self
+        ident = threading.get_ident()
+        profile = self._enable_cprofile()
+        with self._lock:
+            self._threads[ident] = threading.current_thread().name
+        try:
+            yield self
+        finally:
+            if profile is not None:
+                profile.disable()
+            with self._lock:
+                self._threads.pop(ident, None)
+            _local.session = previous
+
+    def _enable_cprofile(self) -> Optional[cProfile.Profile]:
+        """
+        Starts a cProfile for the calling thread, or returns None when
+        another one is active (Python 3.12+) - the thread is then sampled only.
+        """
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            with self._lock:
+                self._sampled_only += 1
+            return None
+        with self._lock:
+            self._profiles.append(profile)
+        return profile
+
+    def add_animation_timings(self, timings: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self.animation_timings.extend(timings)
+
+    def _sample(self) -> None:
+        interval = PROFILE_INTERVAL_MS / 1000
+        while not self._stop.wait(interval):
+            with self._lock:
+                threads = dict(self._threads)
+            frames = sys._current_frames()
+            for ident, thread_name in threads.items():
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                if stack:
+                    self._stacks[";".join([thread_name] + stack[::-1])] += 1
+
+    def start_sampler(self) -> None:
+        threading.Thread(target=self._sample, name=f"profile-{self.request_id[:8]}", daemon=True).start()
+
+    def stop_sampler(self) -> None:
+        self._stop.set()
+
+    def save(self) -> Dict[str, Any]:
+        """Writes the .prof, .collapsed and .json files and returns the summary."""
+        with self._lock:
+            profiles = [p for p in self._profiles if p.getstats()]
+            stacks = dict(self._stacks)
+
+        files = {}
+        top: List[Dict[str, Any]] = []
+        if profiles:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            files["prof"] = self.artifact_path(".prof")
+            stats.dump_stats(files["prof"])
+
+            rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+            for (filename, line, function), (_, calls, own, cumulative, _) in rows[:PROFILE_TOP_FUNCTIONS]:
+                top.append({
+                    "function": f"{function} ({Path(filename).name}:{line})",
+                    "calls": calls,
+                    "own_seconds": round(own, 4),
+                    "cumulative_seconds": round(cumulative, 4),
+                })
+
+        if stacks:
+            files["collapsed"] = self.artifact_path(".collapsed")
+            with open(files["collapsed"], "w", encoding="utf-8") as f:
+                for stack, count in sorted(stacks.items()):
+                    f.write(f"{stack} {count}\n")
+
+        rendered = [t for t in self.animation_timings if not t.get("skipped")]
+        summary = {
+            "request_id": self.request_id,
+            "label": self.label,
+            "started_at": self.started,
+            "seconds": self.seconds,
+            "files": files,
+            "top_functions": top,
+            "sampled_only_threads": self._sampled_only,
+            "animations": self.animation_timings,
+            "animation_seconds": round(sum(t["seconds"] for t in rendered), 3),
+            "slowest_animations": sorted(rendered, key=lambda t: t["seconds"], reverse=True)[:5],
+        }
+        with open(self.artifact_path(".json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+
+class RequestProfiler:
+    """Decides which requests are profiled and keeps their profiles."""
+
+    def should_profile(self, header_value: Optional[str], is_admin: bool) -> bool:
+        if header_value:
+            if is_admin or (PROFILE_TOKEN and header_value == PROFILE_TOKEN):
+                return True
+        return PROFILE_SAMPLE_PERCENT > 0 and random.random() * 100 < PROFILE_SAMPLE_PERCENT
+
+    @contextmanager
+    def profile(self, request_id: str, label: str, enabled: bool = True):
+        """
+        Profiles the block on the calling thread (and on threads it hands
+        work to through propagate()). Yields the session, or None when disabled.
+        """
+        if not enabled:
+            yield None
+            return
+
+        session = ProfileSession(request_id, label)
+        session.start_sampler()
+        started = time.monotonic()
+        try:
+            with session.thread():
+                yield session
+        finally:
+            session.stop_sampler()
+            session.seconds = round(time.monotonic() - started, 3)
+            try:
+                summary = session.save()
+                print(f"🔬 Profiled {label} {request_id} ({session.seconds}s) → {PROFILE_DIR}/{request_id}.*")
+                if summary["slowest_animations"]:
+                    slowest = summary["slowest_animations"][0]
+                    print(f"   Slowest animation: #{slowest['index']} {slowest['kind']} {slowest['animations']} {slowest['seconds']}s")
+            except OSError as e:
+                print(f"⚠️  Could not save profile {request_id}: {e}")
+            self._prune()
+
+    def _prune(self) -> None:
+        summaries = sorted(Path(PROFILE_DIR).glob("*.json"), key=lambda p: p.stat().st_mtime)
+        for summary in summaries[:max(0, len(summaries) - PROFILE_KEEP)]:
+            for suffix in (".json", ".prof", ".collapsed"):
+                summary.with_suffix(suffix).unlink(missing_ok=True)
+
+    def list(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent profiles, newest first."""
+        summaries = sorted(Path(PROFILE_DIR).glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+        profiles = []
+        for path in summaries[:limit]:
+            try:
+                summary = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            profiles.append({key: summary.get(key) for key in ("request_id", "label", "started_at", "seconds", "animation_seconds")})
+        return profiles
+
+    def get(self, request_id: str) -> Optional[Dict[str, Any]]:
+        path = Path(PROFILE_DIR, f"{request_id}.json")
+        if "/" in request_id or "\\" in request_id or not path.is_file():
+            return None
+        return json.loads(path.read_text(encoding="utf-8"))
+
+
+def propagate(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Wraps work handed to another thread (a pool) so it runs as part of the
+    submitting thread's request: profiled with it if it is profiled, and
+    with its context variables (e.g. Gemini background priority).
+    """
+    session = current_session()
+    context = contextvars.copy_context()
+
+    def call(*args, **kwargs):
+        if session is None:
+            return fn(*args, **kwargs)
+        with session.thread():
+            return fn(*args, **kwargs)
+
+    def run(*args, **kwargs):
+        # A copy per call - one context can't be entered by two threads at once
+        return context.copy().run(call, *args, **kwargs)
+    return run
+
+
+request_profiler = RequestProfiler()
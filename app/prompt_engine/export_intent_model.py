@@ -0,0 +1,70 @@
+"""
+Exports the intent encoder to int8-quantized ONNX for INTENT_BACKEND=onnx.
+
+Usage:
+    python -m app.prompt_engine.export_intent_model
+
+Needs sentence-transformers, torch, onnx and onnxruntime at export time
+only - the workers then need just onnxruntime and tokenizers.
+Writes into INTENT_MODEL_DIR:
+- intent_encoder_int8.onnx
+- tokenizer.json
+- intent_embeddings_onnx.npz (precomputed intent description embeddings)
+"""
+
+import os
+
+
+def export_intent_model() -> None:
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    model_dir = os.getenv("INTENT_MODEL_DIR", "app/prompt_engine/models")
+    os.makedirs(model_dir, exist_ok=True)
+    fp32_path = os.path.join(model_dir, "intent_encoder_fp32.onnx")
+    int8_path = os.path.join(model_dir, "intent_encoder_int8.onnx")
+    tokenizer_path = os.path.join(model_dir, "tokenizer.json")
+
+    print("📦 Loading all-MiniLM-L6-v2...")
+    model = SentenceTransformer("all-MiniLM-L6-v2")
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+
+    # Step 1: Export the transformer (pooling/normalizing happens in NumPy at runtime)
+    sample = tokenizer(["an example prompt"], return_tensors="pt")
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+    dynamic_axes = {name: {0: "batch", 1: "tokens"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "tokens"}
+    print("🔄 Exporting to ONNX...")
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+
+    # Step 2: Quantize weights to int8 (~4x smaller, faster matmuls on CPU)
+    print("🔄 Quantizing to int8...")
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+
+    # Step 3: Fast tokenizer for the `tokenizers` package
+    tokenizer.backend_tokenizer.save(tokenizer_path)
+
+    # Step 4: Precompute intent embeddings - loading the detector on the new model stores them
+    os.environ["INTENT_BACKEND"] = "onnx"
+    from app.prompt_engine import smart_intent_detector
+    print(f"✅ Intent embeddings saved to {smart_intent_detector.INTENT_EMBEDDINGS_PATH}")
+
+    size_mb = os.path.getsize(int8_path) / 1e6
+    print(f"✅ Exported {int8_path} ({size_mb:.1f} MB)")
+    print(" Set INTENT_BACKEND=onnx to use it")
+
+
+if __name__ == "__main__":
+    export_intent_model()
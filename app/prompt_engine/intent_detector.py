@@ -23,3 +23,7 @@ def detect_intent(user_prompt: str) -> str:
         return "recipe_instruction"
 
     return "concept_explanation"  # Default fallback
+
+
+def detect_intents(user_prompts: list) -> list:
+    return [detect_intent(prompt) for prompt in user_prompts]
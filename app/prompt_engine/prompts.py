@@ -269,3 +269,39 @@ class GeneratedScene(Scene):
 """
 }
 
+
+
+# Trimmed variant (PROMPT_VARIANT=trimmed/ab): same rules, no worked examples,
+# about a quarter of the tokens. Compared against the full prompts by latency
+# and success rate in GET /llm/usage.
+TRIMMED_SYSTEM_PROMPT = """
+You are an expert Manim CE v0.19.0 developer. Output ONLY valid, executable Python code, no markdown or explanations.
+
+RULES:
+- Start with `from manim import *`, define exactly ONE class GeneratedScene(Scene) with construct()
+- Colors: RED, BLUE, GREEN, YELLOW, ORANGE, PURPLE, WHITE, BLACK, PINK, TEAL
+- Screen bounds: x in [-7, 7], y in [-4, 4]
+- Objects: Circle, Square, Rectangle, Triangle, Polygon, RegularPolygon, Line, Arrow, Dot, MathTex, Text, Axes, NumberPlane, VGroup
+- Animations: Create, Write, FadeIn, FadeOut, Transform, ReplacementTransform, GrowArrow
+- Title at top with .to_edge(UP); main content in the middle; labels/annotations at the bottom
+- Arrange related objects with VGroup(...).arrange(DOWN/RIGHT, buff=0.5); place others with .next_to(ref, dir, buff=0.5)
+- FadeOut old content before adding new content when space is tight; max 3-4 objects animated at once
+- self.wait(0.5) after each major element
+"""
+
+TRIMMED_TASKS = {
+    "math_proof": "TASK: Proof visualization. Theorem at the top, proof steps one at a time in MathTex, shapes/arrows to show relationships.",
+    "graph_function": "TASK: Graph a function. Axes scaled to fit (.scale(0.8)), labels that don't overlap the curve, max 3 annotations.",
+    "concept_explanation": "TASK: Explain a concept visually with simple shapes, short Text labels and arrows, built up step by step.",
+    "step_by_step_process": "TASK: Multi-step process. One step at a time, Transform between steps, self.wait(1) between major steps.",
+    "formula_building": "TASK: Build a formula term by term with ReplacementTransform, then highlight the result with SurroundingRectangle.",
+}
+
+
+def get_system_prompt(intent: str, variant: str = "full") -> str:
+    """Static instructions for raw generation of an intent ("full" or "trimmed" variant)."""
+    if variant == "trimmed":
+        task = TRIMMED_TASKS.get(intent, TRIMMED_TASKS["concept_explanation"])
+        return f"{TRIMMED_SYSTEM_PROMPT.strip()}\n\n{task}"
+    template = PROMPT_TEMPLATES.get(intent, PROMPT_TEMPLATES["concept_explanation"])
+    return template("").strip()
@@ -17,7 +17,7 @@ def check_for_invalid_manim_methods(script_code: str) -> list:
 
     violations = []
     for method in known_invalid_methods:
-        pattern = rf"\\b{method}\\b"
+        pattern = rf"\b{method}\b"
         if re.search(pattern, script_code):
             violations.append(method)
 
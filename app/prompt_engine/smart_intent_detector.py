@@ -1,4 +1,25 @@
-from sentence_transformers import SentenceTransformer, util
+"""
+Embedding-based intent detection.
+
+Prompts are matched to the closest intent description by cosine similarity
+of all-MiniLM-L6-v2 sentence embeddings.
+
+Backends (INTENT_BACKEND):
+- torch: the full sentence-transformers model (default)
+- onnx:  an int8-quantized ONNX export run by onnxruntime - a fraction of
+  the memory per worker and faster on CPU. Create it once with
+  `python -m app.prompt_engine.export_intent_model`.
+
+Intent description embeddings are computed once and stored in a NumPy
+file, so workers don't re-encode them at every startup.
+"""
+
+import os
+import json
+import hashlib
+from typing import List
+
+import numpy as np
 
 # Mapping of intent → purpose
 INTENT_DESCRIPTIONS = {
@@ -12,13 +33,138 @@ INTENT_DESCRIPTIONS = {
     "recipe_instruction": "a cooking recipe or food preparation tutorial",
 }
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+INTENT_MODEL_NAME = "all-MiniLM-L6-v2"
+INTENT_BACKEND = os.getenv("INTENT_BACKEND", "torch").lower()
+INTENT_MODEL_DIR = os.getenv("INTENT_MODEL_DIR", "app/prompt_engine/models")
+ONNX_MODEL_PATH = os.path.join(INTENT_MODEL_DIR, "intent_encoder_int8.onnx")
+TOKENIZER_PATH = os.path.join(INTENT_MODEL_DIR, "tokenizer.json")
+INTENT_EMBEDDINGS_PATH = os.getenv(
+    "INTENT_EMBEDDINGS_PATH", os.path.join(INTENT_MODEL_DIR, f"intent_embeddings_{INTENT_BACKEND}.npz")
+)
+
+# onnxruntime threads per worker - uvicorn workers already run in parallel
+INTENT_THREADS = int(os.getenv("INTENT_THREADS", "1"))
+
+# all-MiniLM-L6-v2 was trained on inputs up to this length
+MAX_TOKENS = 256
+BATCH_SIZE = 32
+
 INTENT_LABELS = list(INTENT_DESCRIPTIONS.keys())
 INTENT_TEXTS = list(INTENT_DESCRIPTIONS.values())
-intent_embeddings = model.encode(INTENT_TEXTS, convert_to_tensor=True)
+
+
+class TorchEncoder:
+    """sentence-transformers model on PyTorch."""
+
+    name = f"torch:{INTENT_MODEL_NAME}"
+
+    def __init__(self):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(INTENT_MODEL_NAME)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """L2-normalized embeddings, one row per text."""
+        return self.model.encode(texts, batch_size=BATCH_SIZE, convert_to_numpy=True, normalize_embeddings=True)
+
+
+class OnnxEncoder:
+    """
+    int8 ONNX export of the same model.
+
+    Reproduces the sentence-transformers pipeline: tokenize, run the
+    transformer, mean-pool token embeddings over the attention mask, normalize.
+    """
+
+    def __init__(self, model_path: str = ONNX_MODEL_PATH, tokenizer_path: str = TOKENIZER_PATH):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = INTENT_THREADS
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=MAX_TOKENS)
+        self.tokenizer.enable_padding()
+
+        stat = os.stat(model_path)
+        self.name = f"onnx:{INTENT_MODEL_NAME}:{stat.st_size}:{int(stat.st_mtime)}"
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """L2-normalized embeddings, one row per text, encoded BATCH_SIZE at a time."""
+        rows = []
+        for start in range(0, len(texts), BATCH_SIZE):
+            encodings = self.tokenizer.encode_batch(texts[start:start + BATCH_SIZE])
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                inputs["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+            token_embeddings = self.session.run(None, inputs)[0]
+
+            # Mean pooling over real (non-padding) tokens
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            rows.append(pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None))
+        return np.concatenate(rows).astype(np.float32)
+
+
+def _fingerprint(encoder) -> str:
+    """Identifies the encoder + intent descriptions a stored embedding file was made from."""
+    payload = json.dumps({"encoder": encoder.name, "intents": INTENT_DESCRIPTIONS}, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def save_intent_embeddings(encoder, path: str = INTENT_EMBEDDINGS_PATH) -> np.ndarray:
+    """Encodes the intent descriptions and stores them next to the model."""
+    embeddings = encoder.encode(INTENT_TEXTS)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    np.savez(path, embeddings=embeddings, labels=np.array(INTENT_LABELS), fingerprint=_fingerprint(encoder))
+    return embeddings
+
+
+def load_intent_embeddings(encoder, path: str = INTENT_EMBEDDINGS_PATH) -> np.ndarray:
+    """
+    Loads the stored intent embeddings, re-encoding (and re-saving) them if
+    the file is missing or was made with another model or other intents.
+    """
+    try:
+        with np.load(path) as stored:
+            if str(stored["fingerprint"]) == _fingerprint(encoder) and list(stored["labels"]) == INTENT_LABELS:
+                return stored["embeddings"]
+    except (OSError, KeyError, ValueError):
+        pass
+
+    print(f"Encoding intent descriptions → {path}")
+    try:
+        return save_intent_embeddings(encoder, path)
+    except OSError:
+        # Read-only deploys still work, they just encode at startup
+        return encoder.encode(INTENT_TEXTS)
+
+
+def _load_encoder():
+    if INTENT_BACKEND == "onnx":
+        return OnnxEncoder()
+    return TorchEncoder()
+
+
+encoder = _load_encoder()
+intent_embeddings = load_intent_embeddings(encoder)
+
+
+def detect_intents(user_prompts: List[str]) -> List[str]:
+    """Detects the intent of several prompts with one batched encode."""
+    if not user_prompts:
+        return []
+    query_embeddings = encoder.encode(list(user_prompts))
+    # Embeddings are normalized, so the dot product is the cosine similarity
+    scores = query_embeddings @ intent_embeddings.T
+    return [INTENT_LABELS[i] for i in scores.argmax(axis=1)]
+
 
 def detect_intent(user_prompt: str) -> str:
-    query_embedding = model.encode(user_prompt, convert_to_tensor=True)
-    scores = util.cos_sim(query_embedding, intent_embeddings)[0]
-    best_match_idx = scores.argmax().item()
-    return INTENT_LABELS[best_match_idx]
+    return detect_intents([user_prompt])[0]
@@ -0,0 +1,293 @@
+"""
+Static render-cost estimates.
+
+Predicts how long a Manim script takes to render before rendering it, from
+what the script asks for:
+
+- frames: seconds of animation (play run_time + wait durations) × fps ×
+  pixels of the quality tier - what cairo spends most of its time on
+- MathTex/Tex objects (LaTeX compile + SVG parse) and Text objects (Pango)
+- play calls (per-animation setup, partial movie file writes)
+- plot sampling (points evaluated and turned into bezier curves)
+
+Template renders are estimated the same way from the code their params
+produce. The estimate is linear in these features; its coefficients start
+from rough defaults and are refitted (least squares) on the render times
+recorded in RENDER_TIMINGS_PATH, every CALIBRATE_EVERY new samples.
+
+Used for shortest-job-first ordering in the render scheduler and for the
+ETAs shown by GET /queue.
+"""
+
+import os
+import ast
+import json
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.renderer import OUTPUT_DIR
+
+RENDER_TIMINGS_PATH = os.getenv("RENDER_TIMINGS_PATH", os.path.join(OUTPUT_DIR, "render_timings.jsonl"))
+CALIBRATE_EVERY = int(os.getenv("RENDER_COST_CALIBRATE_EVERY", "20"))
+# Fewer samples than this per coefficient and the fit is blended with the defaults
+MIN_SAMPLES_PER_FEATURE = 3
+MAX_TIMING_SAMPLES = 5000
+
+# Manim quality flag → (fps, megapixels per frame)
+QUALITY_FRAME_COST = {
+    "l": (15, 854 * 480 / 1e6),
+    "m": (30, 1280 * 720 / 1e6),
+    "h": (60, 1920 * 1080 / 1e6),
+}
+
+# Loops whose length can't be read from the code are assumed to run this often
+LOOP_GUESS = 3
+# Points sampled by a plot without an explicit step (Manim's default is roughly this)
+DEFAULT_PLOT_SAMPLES = 100
+
+FEATURES = ["intercept", "megapixel_frames", "tex_objects", "text_objects", "plays", "plot_ksamples"]
+
+# Seconds per unit of each feature until enough timings are recorded
+DEFAULT_COEFFICIENTS = {
+    "intercept": 4.0,          # interpreter + Manim import, file muxing
+    "megapixel_frames": 0.1,
+    "tex_objects": 0.8,
+    "text_objects": 0.2,
+    "plays": 0.3,
+    "plot_ksamples": 0.5,
+}
+
+TEX_CLASSES = {"MathTex", "Tex", "SingleStringMathTex", "Matrix", "DecimalMatrix", "IntegerMatrix"}
+TEXT_CLASSES = {"Text", "MarkupText", "Paragraph", "Title"}
+PLOT_METHODS = {"plot", "plot_parametric_curve", "plot_polar_graph", "get_graph"}
+PLOT_CLASSES = {"FunctionGraph", "ParametricFunction"}
+
+
+def _number(node: Optional[ast.AST], default: float) -> float:
+    """Value of a numeric literal (or simple arithmetic on literals), else default."""
+    if node is None:
+        return default
+    try:
+        value = ast.literal_eval(node)
+        return float(value) if isinstance(value, (int, float)) else default
+    except (ValueError, TypeError, SyntaxError):
+        pass
+    if isinstance(node, ast.BinOp):
+        left, right = _number(node.left, None), _number(node.right, None)
+        if left is not None and right is not None:
+            ops = {ast.Add: left + right, ast.Sub: left - right, ast.Mult: left * right}
+            if isinstance(node.op, ast.Div) and right:
+                return left / right
+            return ops.get(type(node.op), default)
+    return default
+
+
+def _keyword(call: ast.Call, name: str) -> Optional[ast.AST]:
+    for keyword in call.keywords:
+        if keyword.arg == name:
+            return keyword.value
+    return None
+
+
+def _loop_count(loop: ast.AST) -> float:
+    """Iterations of a for loop over range(<literals>) or a literal sequence, else LOOP_GUESS."""
+    if isinstance(loop, (ast.For, ast.comprehension)):
+        iterator = loop.iter
+        if isinstance(iterator, (ast.List, ast.Tuple, ast.Set)):
+            return len(iterator.elts)
+        if isinstance(iterator, ast.Call) and isinstance(iterator.func, ast.Name) and iterator.func.id == "range":
+            args = [_number(a, None) for a in iterator.args]
+            if args and all(a is not None for a in args):
+                start, stop, step = (0, args[0], 1) if len(args) == 1 else (args[0], args[1], args[2] if len(args) > 2 else 1)
+                if step:
+                    return max(0, int(np.ceil((stop - start) / step)))
+    return LOOP_GUESS
+
+
+def _plot_samples(call: ast.Call) -> float:
+    x_range = _keyword(call, "x_range") or _keyword(call, "t_range")
+    if isinstance(x_range, (ast.List, ast.Tuple)) and len(x_range.elts) >= 3:
+        start, stop, step = (_number(e, None) for e in x_range.elts[:3])
+        if None not in (start, stop, step) and step > 0:
+            return (stop - start) / step
+    return DEFAULT_PLOT_SAMPLES
+
+
+def _call_name(call: ast.Call) -> str:
+    if isinstance(call.func, ast.Name):
+        return call.func.id
+    if isinstance(call.func, ast.Attribute):
+        return call.func.attr
+    return ""
+
+
+def _is_self_call(call: ast.Call, method: str) -> bool:
+    return (isinstance(call.func, ast.Attribute) and call.func.attr == method
+            and isinstance(call.func.value, ast.Name) and call.func.value.id == "self")
+
+
+def _count(node: ast.AST, counts: Dict[str, float], multiplier: float) -> None:
+    """Adds the node's features to counts, scaled by how often enclosing loops run it."""
+    if isinstance(node, (ast.For, ast.While)):
+        _count(node.iter if isinstance(node, ast.For) else node.test, counts, multiplier)
+        inner = multiplier * (_loop_count(node) if isinstance(node, ast.For) else LOOP_GUESS)
+        for child in node.body:
+            _count(child, counts, inner)
+        for child in node.orelse:
+            _count(child, counts, multiplier)
+        return
+    if isinstance(node, (ast.ListComp, ast.GeneratorExp, ast.SetComp)):
+        inner = multiplier
+        for generator in node.generators:
+            _count(generator.iter, counts, inner)
+            inner *= _loop_count(generator)
+        _count(node.elt, counts, inner)
+        return
+
+    if isinstance(node, ast.Call):
+        name = _call_name(node)
+        if _is_self_call(node, "play"):
+            counts["plays"] += multiplier
+            counts["animation_seconds"] += multiplier * _number(_keyword(node, "run_time"), 1.0)
+        elif _is_self_call(node, "wait"):
+            duration = node.args[0] if node.args else _keyword(node, "duration")
+            counts["animation_seconds"] += multiplier * _number(duration, 1.0)
+        elif name in TEX_CLASSES:
+            counts["tex_objects"] += multiplier
+        elif name in TEXT_CLASSES:
+            counts["text_objects"] += multiplier
+        elif name in PLOT_METHODS or name in PLOT_CLASSES:
+            counts["plot_ksamples"] += multiplier * _plot_samples(node) / 1000
+
+    for child in ast.iter_child_nodes(node):
+        _count(child, counts, multiplier)
+
+
+def script_features(script_code: str) -> Optional[Dict[str, float]]:
+    """
+    Quality-independent features of a script: animation seconds, TeX/Text
+    objects, play calls and thousands of plot samples. None if it doesn't parse.
+    """
+    try:
+        tree = ast.parse(script_code)
+    except SyntaxError:
+        return None
+    counts = {"animation_seconds": 0.0, "tex_objects": 0.0, "text_objects": 0.0, "plays": 0.0, "plot_ksamples": 0.0}
+    _count(tree, counts, 1.0)
+    return counts
+
+
+def template_features(template_name: str, params: Dict[str, Any]) -> Optional[Dict[str, float]]:
+    """Features of a template render, from the code its params generate."""
+    from app.template_engine import TEMPLATE_REGISTRY
+
+    try:
+        return script_features(TEMPLATE_REGISTRY[template_name].generate_code(params))
+    except Exception:
+        return None
+
+
+def feature_vector(features: Dict[str, float], quality: str) -> np.ndarray:
+    fps, megapixels = QUALITY_FRAME_COST[quality]
+    return np.array([
+        1.0,
+        features["animation_seconds"] * fps * megapixels,
+        features["tex_objects"],
+        features["text_objects"],
+        features["plays"],
+        features["plot_ksamples"],
+    ])
+
+
+class RenderCostModel:
+    """Linear render-time model, calibrated on recorded render timings."""
+
+    def __init__(self, timings_path: str = RENDER_TIMINGS_PATH):
+        self.timings_path = timings_path
+        self._lock = threading.Lock()
+        self.coefficients = np.array([DEFAULT_COEFFICIENTS[f] for f in FEATURES])
+        self.samples = 0
+        self._since_fit = 0
+        self.calibrate()
+
+    def predict(self, features: Optional[Dict[str, float]], quality: str) -> Optional[float]:
+        """Predicted render seconds at a quality tier, or None without features."""
+        if features is None or quality not in QUALITY_FRAME_COST:
+            return None
+        return max(1.0, float(feature_vector(features, quality) @ self.coefficients))
+
+    def predict_tiers(self, features: Optional[Dict[str, float]]) -> Dict[str, Optional[float]]:
+        return {quality: self.predict(features, quality) for quality in QUALITY_FRAME_COST}
+
+    def estimate_script(self, script_code: str, quality: str) -> Optional[float]:
+        return self.predict(script_features(script_code), quality)
+
+    def record(self, features: Optional[Dict[str, float]], quality: str, seconds: float) -> None:
+        """Stores a measured render time and refits every CALIBRATE_EVERY samples."""
+        if features is None or quality not in QUALITY_FRAME_COST:
+            return
+        predicted = self.predict(features, quality)
+        line = json.dumps({"features": features, "quality": quality, "seconds": round(seconds, 3)})
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(self.timings_path) or ".", exist_ok=True)
+                with open(self.timings_path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                print(f"⚠️  Could not record render timing: {e}")
+                return
+            self._since_fit += 1
+            refit = self._since_fit >= CALIBRATE_EVERY
+        print(f"⏱️  Render took {seconds:.1f}s (predicted {predicted:.1f}s at -q{quality})")
+        if refit:
+            self.calibrate()
+
+    def _load_samples(self) -> List[Dict[str, Any]]:
+        try:
+            with open(self.timings_path, "r", encoding="utf-8") as f:
+                lines = f.readlines()[-MAX_TIMING_SAMPLES:]
+        except OSError:
+            return []
+        samples = []
+        for line in lines:
+            try:
+                samples.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        return samples
+
+    def calibrate(self) -> None:
+        """
+        Least-squares fit of the coefficients on the recorded timings.
+        Negative coefficients are clipped (every feature costs time), and
+        with few samples the fit is blended with the defaults.
+        """
+        samples = self._load_samples()
+        defaults = np.array([DEFAULT_COEFFICIENTS[f] for f in FEATURES])
+        if not samples:
+            return
+
+        X = np.array([feature_vector(s["features"], s["quality"]) for s in samples])
+        y = np.array([s["seconds"] for s in samples])
+        fitted, *_ = np.linalg.lstsq(X, y, rcond=None)
+        fitted = np.clip(fitted, 0.0, None)
+
+        trust = min(1.0, len(samples) / (MIN_SAMPLES_PER_FEATURE * len(FEATURES)))
+        coefficients = trust * fitted + (1 - trust) * defaults
+        error = float(np.mean(np.abs(X @ coefficients - y)))
+        with self._lock:
+            self.coefficients = coefficients
+            self.samples = len(samples)
+            self._since_fit = 0
+        print(f"📐 Render cost model calibrated on {len(samples)} renders (mean abs error {error:.1f}s)")
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "samples": self.samples,
+            "coefficients": dict(zip(FEATURES, (round(float(c), 4) for c in self.coefficients))),
+        }
+
+
+render_cost_model = RenderCostModel()
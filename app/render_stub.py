@@ -0,0 +1,81 @@
+"""
+Stand-in for the manim CLI, for load tests (RENDER_STUB_SECONDS).
+
+Accepts the manim arguments the renderer passes, sleeps instead of
+rendering and writes a placeholder file where Manim would have written
+its output, so the rest of the pipeline (URLs, previews, uploads) runs
+unchanged:
+
+- videos: sleeps RENDER_STUB_SECONDS (± RENDER_STUB_JITTER) and writes
+  videos/<module>/<quality dir>/<output_file>
+- frames (-s): sleeps RENDER_STUB_FRAME_SECONDS and writes
+  images/<module>/<output_file>.png
+- --dry_run: sleeps RENDER_STUB_FRAME_SECONDS, writes nothing
+
+Process start-up is real, as with Manim.
+"""
+
+import os
+import re
+import sys
+import time
+import random
+from pathlib import Path
+
+RENDER_STUB_SECONDS = float(os.getenv("RENDER_STUB_SECONDS", "0") or 0)
+RENDER_STUB_JITTER = float(os.getenv("RENDER_STUB_JITTER", "0.2"))
+RENDER_STUB_FRAME_SECONDS = float(os.getenv("RENDER_STUB_FRAME_SECONDS", str(RENDER_STUB_SECONDS / 10)))
+
+QUALITY_DIRS = {"l": "480p15", "m": "720p30", "h": "1080p60"}
+
+# Options that take a value
+VALUE_OPTIONS = {"--media_dir", "--output_file", "-n", "-v", "--progress_bar", "--format", "-o"}
+
+
+def _sleep(seconds: float) -> None:
+    time.sleep(max(0.0, seconds * random.uniform(1 - RENDER_STUB_JITTER, 1 + RENDER_STUB_JITTER)))
+
+
+def main(argv=None) -> None:
+    args = list(sys.argv[1:] if argv is None else argv)
+    options, positional, flags = {}, [], set()
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg in VALUE_OPTIONS and i + 1 < len(args):
+            options[arg] = args[i + 1]
+            i += 2
+            continue
+        if arg.startswith("-"):
+            flags.add(arg)
+        else:
+            positional.append(arg)
+        i += 1
+
+    quality = "h"
+    for flag in flags:
+        match = re.fullmatch(r"-p?s?q([lmh])", flag)
+        if match:
+            quality = match.group(1)
+
+    script_path = positional[0]
+    module = Path(script_path).stem
+    media_dir = Path(options.get("--media_dir", "media"))
+    output = options.get("--output_file", "scene")
+
+    if "--dry_run" in flags:
+        _sleep(RENDER_STUB_FRAME_SECONDS)
+        return
+
+    if "-s" in flags:
+        _sleep(RENDER_STUB_FRAME_SECONDS)
+        path = media_dir / "images" / module / f"{Path(output).stem}.png"
+    else:
+        _sleep(RENDER_STUB_SECONDS)
+        path = media_dir / "videos" / module / QUALITY_DIRS[quality] / output
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"render stub " + script_path.encode("utf-8"))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,496 @@
 import os
+import ast
+import sys
 import subprocess
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+from app.manim_timing import merge_animation_timings
+from app.postprocess import postprocess_video_url
+
+OUTPUT_DIR = "app/static/outputs"
+
+# Most processes one sectioned render may use, one per render slot it holds
+SECTION_WORKERS = int(os.getenv("SECTION_WORKERS", "4"))
+
+# Maximum key frames in a storyboard strip (0 disables storyboards)
+STORYBOARD_FRAMES = int(os.getenv("STORYBOARD_FRAMES", "6"))
+
+# Load tests: a stub that sleeps this long stands in for manim (app/render_stub.py)
+RENDER_STUB_SECONDS = float(os.getenv("RENDER_STUB_SECONDS", "0") or 0)
+
+# Manim quality flag → directory name Manim writes the video into
+QUALITY_DIRS = {
+    "l": "480p15",
+    "m": "720p30",
+    "h": "1080p60",
+}
+
+# Manim quality flag → config value used when rendering in-process
+QUALITY_NAMES = {
+    "l": "low_quality",
+    "m": "medium_quality",
+    "h": "high_quality",
+}
 
 def camel_to_snake(name: str) -> str:
     """Converts CamelCase to snake_case"""
     s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
     return re.sub('([a-z0-9])([A-Z])', r'\1_\2', s1).lower()
 
-def render_manim_script(script_path: str, class_name: str = "GeneratedScene") -> str:
-    output_dir = "app/static/outputs"
-    
-    # Path used by Manim internally (don't modify)
-    manim_output_subpath = f"videos/{class_name}/480p15/scene.mp4"
-    manim_output_path = os.path.join(output_dir, manim_output_subpath)
+def video_url_for(script_path: str, quality: str = "h", output_dir: str = OUTPUT_DIR, file_name: str = "scene.mp4") -> str:
+    """
+    Returns the /static URL of the video Manim writes for a script.
+    Manim names the video folder after the script's module, not the scene class.
+    """
+    module_name = Path(script_path).stem
+    relative_dir = Path(output_dir).relative_to("app")
+    return f"/{relative_dir.as_posix()}/videos/{module_name}/{QUALITY_DIRS[quality]}/{file_name}"
+
+class RenderCancelledError(Exception):
+    """Raised when a cancellable render was stopped before Manim finished."""
+
+
+def manim_command(timings_path: Optional[str] = None) -> List[str]:
+    """The manim CLI, or with timings_path, the CLI wrapped to time each animation (app/manim_timing.py)."""
+    if RENDER_STUB_SECONDS > 0:
+        return [sys.executable, "-m", "app.render_stub"]
+    if timings_path:
+        return [sys.executable, "-m", "app.manim_timing", timings_path]
+    return ["manim"]
+
+def run_manim(command: List[str], cancel: Optional[threading.Event] = None) -> None:
+    """
+    Runs a manim command, raising CalledProcessError when it fails.
 
-    # Use the exact class name for the URL path to match Manim's output directory
-    url_path = f"/static/outputs/videos/{class_name}/480p15/scene.mp4"
+    With cancel, Manim is terminated as soon as the event is set
+    (RenderCancelledError). Animations it finished stay in Manim's
+    partial movie cache, so a later render of the script resumes there.
+    """
+    if cancel is None:
+        subprocess.run(command, check=True)
+        return
+
+    process = subprocess.Popen(command)
+    while True:
+        try:
+            returncode = process.wait(timeout=0.2)
+            break
+        except subprocess.TimeoutExpired:
+            if cancel.is_set():
+                process.terminate()
+                try:
+                    process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+                raise RenderCancelledError("Manim was stopped before it finished")
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, command)
+
+def render_manim_script(script_path: str, class_name: str = "GeneratedScene", quality: str = "h", preview: bool = True, output_file: str = "scene.mp4", quiet: bool = False, timings_path: Optional[str] = None, cancel: Optional[threading.Event] = None) -> str:
+    output_dir = OUTPUT_DIR
+
+    if quality not in QUALITY_DIRS:
+        raise ValueError(f"Unknown render quality: {quality}")
+
+    # URL of the file Manim writes: videos/<module_name>/<quality_dir>/<output_file>
+    url_path = video_url_for(script_path, quality, output_dir, output_file)
 
     # Run the Manim render command
-    command = [
-        "manim",
-        "-pqh",
+    command = manim_command(timings_path) + [
+        f"-{'p' if preview else ''}q{quality}",
         script_path,
         class_name,
         "--media_dir", output_dir,
-        "--output_file", "scene.mp4"
+        "--output_file", output_file
+    ]
+    if quiet:
+        # No log lines or progress bars (e.g. under the batch progress display)
+        command += ["-v", "WARNING", "--progress_bar", "none"]
+    run_manim(command, cancel)
+
+    return postprocess_video_url(url_path)
+
+def dry_run_manim_script(script_path: str, class_name: str = "GeneratedScene", timeout: float = 60) -> Tuple[bool, str]:
+    """
+    Runs the scene's construct() without writing any frames (manim --dry_run).
+
+    Catches what static checks can't: unknown names and methods, bad
+    arguments, LaTeX errors. TeX compiled here is cached for the real render.
+
+    Returns:
+        (passed, error) - error is the tail of Manim's output when it failed
+    """
+    command = manim_command() + [
+        "--dry_run",
+        script_path,
+        class_name,
+        "--media_dir", OUTPUT_DIR,
     ]
-    subprocess.run(command, check=True)
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return False, f"dry run took longer than {timeout}s"
+    if result.returncode != 0:
+        lines = (result.stderr or result.stdout).strip().splitlines()
+        return False, "\n".join(lines[-5:])
+    return True, ""
+
+def render_template_scene(template_name: str, params: dict, output_name: str, quality: str = "h", quiet: bool = False) -> str:
+    """
+    Renders a template's Scene class inside the current process.
+
+    No script is generated, written or imported - the validated params go
+    straight into the Scene. Meant for warm worker processes that have
+    already paid for importing Manim.
+
+    The video lands where render_manim_script would put it for a script
+    named <output_name>.py.
+    """
+    from manim import tempconfig
+    from app.duration_budget import duration_scale
+    from app.template_engine import TEMPLATE_REGISTRY
+
+    if quality not in QUALITY_DIRS:
+        raise ValueError(f"Unknown render quality: {quality}")
+
+    template = TEMPLATE_REGISTRY[template_name]
+    scene_class = template.get_scene_class()
+    # Same duration budget as the template's generated code would get
+    time_scale = duration_scale(template.generate_code(params), quality)
+    render_config = {
+        "quality": QUALITY_NAMES[quality],
+        "media_dir": OUTPUT_DIR,
+        "video_dir": f"{{media_dir}}/videos/{output_name}/{{quality}}",
+        "output_file": "scene.mp4",
+        "preview": False,
+    }
+    if quiet:
+        render_config.update({"verbosity": "WARNING", "progress_bar": "none"})
+    with tempconfig(render_config):
+        scene = scene_class(params=params, time_scale=time_scale)
+        scene.render()
+
+    return postprocess_video_url(video_url_for(output_name, quality))
+
+
+def section_starts(script_code: str) -> Optional[Tuple[List[int], int]]:
+    """
+    Animation numbers at which each Manim section of a script starts,
+    plus the total number of animations.
+
+    Every self.play/self.wait call is one animation; self.next_section()
+    marks a boundary. Only straight-line scripts (like the template ones)
+    can be counted statically - anything with loops, branches or helper
+    methods returns None.
+    """
+    try:
+        tree = ast.parse(script_code)
+    except SyntaxError:
+        return None
+
+    construct = None
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.For, ast.While, ast.AsyncFor, ast.If, ast.comprehension)):
+            return None
+        if isinstance(node, ast.FunctionDef):
+            if node.name != "construct" or construct is not None:
+                return None
+            construct = node
+    if construct is None:
+        return None
+
+    starts = [0]
+    count = 0
+    for statement in construct.body:
+        for node in ast.walk(statement):
+            if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                    and isinstance(node.func.value, ast.Name) and node.func.value.id == "self"):
+                if node.func.attr in ("play", "wait"):
+                    count += 1
+                elif node.func.attr == "next_section" and count > starts[-1]:
+                    starts.append(count)
+
+    if not count:
+        return None
+    return starts, count
+
+
+def _split_ranges(starts: List[int], total: int, parts: int) -> List[Tuple[int, int]]:
+    """
+    Groups consecutive sections into at most `parts` animation ranges
+    (inclusive, as Manim's -n expects) of roughly equal size.
+    """
+    bounds = starts + [total]
+    target = total / parts
+    ranges = []
+    range_start = 0
+    for end in bounds[1:-1]:
+        if end - range_start >= target and len(ranges) < parts - 1:
+            ranges.append((range_start, end - 1))
+            range_start = end
+    ranges.append((range_start, total - 1))
+    return ranges
+
+
+def section_workers() -> int:
+    """Processes a sectioned render may split into (SECTION_WORKERS, at least 1)."""
+    return max(1, SECTION_WORKERS)
+
+
+def renders_in_sections(script_code: str, workers: Optional[int] = None) -> bool:
+    """Whether render_manim_script_sections could split this script over several processes."""
+    if workers is None:
+        workers = section_workers()
+    sections = section_starts(script_code)
+    return workers >= 2 and bool(sections) and len(sections[0]) >= 2
+
+
+def concat_videos(part_paths: List[str], output_path: str) -> None:
+    """
+    Joins MP4 parts with identical encoding by stream copy (no re-encode):
+    packets are remuxed with their timestamps shifted past the previous part.
+    """
+    import av
+
+    with av.open(output_path, mode="w") as output:
+        out_stream = None
+        offset = 0
+        last_dts = None
+        for part_path in part_paths:
+            with av.open(part_path) as part:
+                in_stream = part.streams.video[0]
+                if out_stream is None:
+                    out_stream = output.add_stream(template=in_stream)
+
+                part_offset = None
+                part_end = offset
+                for packet in part.demux(in_stream):
+                    # Flush packets carry no timestamps
+                    if packet.dts is None:
+                        continue
+                    if packet.pts is None:
+                        packet.pts = packet.dts
+                    if part_offset is None:
+                        # B-frames can start a part with negative dts - keep dts increasing across the seam
+                        part_offset = offset if last_dts is None else max(offset, last_dts + 1 - packet.dts)
+                    packet.pts += part_offset
+                    packet.dts += part_offset
+                    last_dts = packet.dts
+                    part_end = max(part_end, packet.pts + (packet.duration or 0))
+                    packet.stream = out_stream
+                    output.mux(packet)
+                offset = part_end
+
+
+class _AnySet:
+    """Reads as set once any of its events is (run_manim only polls is_set())."""
+
+    def __init__(self, *events: Optional[threading.Event]):
+        self.events = [event for event in events if event is not None]
+
+    def is_set(self) -> bool:
+        return any(event.is_set() for event in self.events)
+
+
+def _section_media_dir(script_path: str, quality: str, output_file: str, first: int, last: int) -> str:
+    """
+    Media dir of one section range. Every range gets its own, so parallel
+    Manim processes don't share (and overwrite) the scene's partial movie
+    files and file list; the TeX and text caches stay shared through links.
+    """
+    media_dir = os.path.join(OUTPUT_DIR, "sections",
+                             f"{Path(script_path).stem}_{quality}_{Path(output_file).stem}_{first}-{last}")
+    os.makedirs(media_dir, exist_ok=True)
+    for cache in ("Tex", "texts"):
+        shared, link = os.path.join(OUTPUT_DIR, cache), os.path.join(media_dir, cache)
+        if os.path.lexists(link):
+            continue
+        os.makedirs(shared, exist_ok=True)
+        try:
+            os.symlink(os.path.abspath(shared), link, target_is_directory=True)
+        except OSError:
+            # No symlinks (e.g. Windows without privileges) - the range compiles its own TeX
+            pass
+    return media_dir
+
+
+def render_manim_script_sections(script_path: str, class_name: str = "GeneratedScene", quality: str = "h", output_file: str = "scene.mp4", workers: Optional[int] = None, timings_path: Optional[str] = None, cancel: Optional[threading.Event] = None, slots=None) -> str:
+    """
+    Renders a sectioned script in parallel and stitches the result.
+
+    Each process renders one range of sections with Manim's -n flag, in its
+    own media dir: the animations before the range still run (so the scene
+    reaches the right starting state) but are skipped without writing
+    frames. The parts are then joined by stream copy.
+
+    With slots (the RenderScheduler the caller holds a slot of), every
+    process past the first needs an idle slot of its own (spare_slots), so
+    the split only uses capacity nobody is waiting for; without, up to
+    `workers` processes run. Falls back to a single render_manim_script
+    call when the script has a single section, can't be split statically,
+    or only one process is available.
+
+    With cancel, all Manim processes stop as soon as the event is set
+    (RenderCancelledError); a failing range stops the others too. With
+    timings_path, per-animation timings of all parts are written there.
+    """
+    if workers is None:
+        workers = section_workers()
+
+    script_code = Path(script_path).read_text(encoding="utf-8")
+    if not renders_in_sections(script_code, workers):
+        return render_manim_script(script_path, class_name, quality, preview=False, output_file=output_file,
+                                   timings_path=timings_path, cancel=cancel)
+
+    if quality not in QUALITY_DIRS:
+        raise ValueError(f"Unknown render quality: {quality}")
+
+    with (slots.spare_slots(workers - 1) if slots is not None else nullcontext(workers - 1)) as extra:
+        if not renders_in_sections(script_code, 1 + extra):
+            return render_manim_script(script_path, class_name, quality, preview=False, output_file=output_file,
+                                       timings_path=timings_path, cancel=cancel)
+
+        starts, total = section_starts(script_code)
+        ranges = _split_ranges(starts, total, 1 + extra)
+        stem = Path(output_file).stem
+        print(f"🧩 Rendering {len(ranges)} section ranges in parallel: {ranges}")
+
+        failed = threading.Event()
+        stop = _AnySet(cancel, failed)
+
+        def render_range(index_range: Tuple[int, int]) -> str:
+            first, last = index_range
+            media_dir = _section_media_dir(script_path, quality, output_file, first, last)
+            part_file = f"{stem}_part{first}-{last}.mp4"
+            part_timings = f"{timings_path}.part{first}" if timings_path else None
+            try:
+                run_manim(manim_command(part_timings) + [
+                    f"-q{quality}",
+                    script_path,
+                    class_name,
+                    "-n", f"{first},{last}",
+                    "--media_dir", media_dir,
+                    "--output_file", part_file,
+                ], stop)
+            except BaseException:
+                failed.set()
+                raise
+            return os.path.join(media_dir, "videos", Path(script_path).stem, QUALITY_DIRS[quality], part_file)
+
+        with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+            futures = [pool.submit(render_range, index_range) for index_range in ranges]
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            # The range that failed, not the ones stopped because of it
+            raise next((e for e in errors if not isinstance(e, RenderCancelledError)), errors[0])
+        part_paths = [future.result() for future in futures]
+
+    video_dir = os.path.join(OUTPUT_DIR, "videos", Path(script_path).stem, QUALITY_DIRS[quality])
+    os.makedirs(video_dir, exist_ok=True)
+    concat_videos(part_paths, os.path.join(video_dir, output_file))
+    for part_path in part_paths:
+        os.remove(part_path)
+    if timings_path:
+        part_timings = [f"{timings_path}.part{first}" for first, _ in ranges]
+        merge_animation_timings(part_timings, timings_path)
+        for path in part_timings:
+            Path(path).unlink(missing_ok=True)
+
+    return postprocess_video_url(video_url_for(script_path, quality, OUTPUT_DIR, output_file))
+
+
+def render_frame(script_path: str, class_name: str = "GeneratedScene", quality: str = "h", output_name: str = "poster", upto_animation: Optional[int] = None, cancel: Optional[threading.Event] = None) -> str:
+    """
+    Renders a single PNG with Manim's save-last-frame mode (-s).
+
+    Animations are skipped rather than rendered, so this takes a fraction
+    of the video render time. With upto_animation the scene stops after that
+    animation, giving the frame at that point instead of the last one.
+
+    Returns:
+        /static URL of the image
+    """
+    command = manim_command() + [
+        "-s",
+        f"-q{quality}",
+        script_path,
+        class_name,
+        "--media_dir", OUTPUT_DIR,
+        "--output_file", output_name,
+    ]
+    if upto_animation is not None:
+        command += ["-n", f"0,{upto_animation}"]
+    run_manim(command, cancel)
+
+    # Manim may add its version to the file name (<name>_ManimCE_v0.19.0.png)
+    images_dir = Path(OUTPUT_DIR) / "images" / Path(script_path).stem
+    candidates = sorted(images_dir.glob(f"{output_name}*.png"), key=lambda p: p.stat().st_mtime)
+    if not candidates:
+        raise FileNotFoundError(f"Manim did not write an image for {output_name}")
+
+    relative_path = candidates[-1].relative_to("app")
+    return f"/{relative_path.as_posix()}"
+
+
+def storyboard_frames(script_code: str, max_frames: int = STORYBOARD_FRAMES) -> List[int]:
+    """
+    Animation numbers to snapshot for a storyboard: the end of each section
+    (evenly thinned out to max_frames). The last frame is the poster, so it
+    isn't repeated here.
+    """
+    sections = section_starts(script_code)
+    if not sections or max_frames <= 0:
+        return []
+
+    starts, _ = sections
+    ends = [start - 1 for start in starts[1:]]
+    if len(ends) > max_frames:
+        step = len(ends) / max_frames
+        ends = [ends[int(i * step)] for i in range(max_frames)]
+    return ends
+
+
+def render_frames(script_path: str, class_name: str = "GeneratedScene", quality: str = "h", name: str = "scene", frames: Sequence[Optional[int]] = (None,)) -> List[Optional[str]]:
+    """
+    Renders still frames in parallel processes: None is the poster (last
+    frame), n the frame after animation n. They are saved as
+    {name}_poster / {name}_frame{n}.
+
+    Returns:
+        /static URL per frame, None for a frame that failed
+    """
+    def render_one(upto_animation: Optional[int]) -> Optional[str]:
+        suffix = "poster" if upto_animation is None else f"frame{upto_animation}"
+        try:
+            return render_frame(script_path, class_name, quality, f"{name}_{suffix}", upto_animation)
+        except Exception as e:
+            print(f"❌ Preview frame {suffix} failed: {e}")
+            return None
+
+    if not frames:
+        return []
+    with ThreadPoolExecutor(max_workers=len(frames)) as pool:
+        return list(pool.map(render_one, frames))
+
+
+def render_previews(script_path: str, class_name: str = "GeneratedScene", quality: str = "h", name: str = "scene", storyboard: bool = True, poster: bool = True) -> dict:
+    """
+    Renders the poster (last frame) and the storyboard key frames in
+    parallel processes.
+
+    Returns:
+        {"poster_url": str or None, "storyboard_urls": [str]}
+    """
+    frames = storyboard_frames(Path(script_path).read_text(encoding="utf-8")) if storyboard else []
+    urls = render_frames(script_path, class_name, quality, name, ([None] if poster else []) + frames)
 
-    return url_path
+    return {
+        "poster_url": urls.pop(0) if poster else None,
+        "storyboard_urls": [url for url in urls if url],
+    }
@@ -0,0 +1,423 @@
+"""
+Render scheduler - bounds render concurrency and adapts quality to load.
+
+Load = (renders running + renders waiting + admitted requests that haven't
+        reached a render yet, e.g. still in their LLM phase) / render workers
+
+- load < QUALITY_MEDIUM_LOAD → high quality (-qh)
+- load < QUALITY_LOW_LOAD    → medium quality (-qm)
+- load < MAX_LOAD            → low quality (-ql)
+- load ≥ MAX_LOAD            → new work is rejected (429 + Retry-After)
+
+Videos rendered below high quality are queued for an upgrade, which a
+background thread re-renders once load falls under UPGRADE_LOAD.
+
+Render slots are shared fairly between users (keyed by JWT sub), weighted
+by priority class (TIER_WEIGHTS) and capped per user (TIER_INFLIGHT_CAPS).
+
+With predicted render times (app/render_cost.py), shorter jobs go first:
+each user's queue is ordered shortest-first, and users are served by
+virtual finish time, so a quick render isn't stuck behind a long one while
+long renders still get their fair share (and jump ahead once they have
+waited SJF_MAX_WAIT_SECONDS).
+"""
+
+import os
+import time
+import queue
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def _parse_tier_map(value: str) -> Dict[str, float]:
+    """Parses "paid:4,free:1" into {"paid": 4.0, "free": 1.0}."""
+    result = {}
+    for item in value.split(","):
+        if ":" in item:
+            tier, number = item.split(":", 1)
+            result[tier.strip()] = float(number)
+    return result
+
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(os.cpu_count() or 1)))
+QUALITY_MEDIUM_LOAD = float(os.getenv("QUALITY_MEDIUM_LOAD", "1.0"))
+QUALITY_LOW_LOAD = float(os.getenv("QUALITY_LOW_LOAD", "2.0"))
+MAX_LOAD = float(os.getenv("MAX_LOAD", "4.0"))
+UPGRADE_LOAD = float(os.getenv("UPGRADE_LOAD", "0.5"))
+
+# Fair share: relative weight and concurrent renders per priority class
+TIER_WEIGHTS = _parse_tier_map(os.getenv("TIER_WEIGHTS", "paid:4,free:1,background:0.25"))
+TIER_INFLIGHT_CAPS = _parse_tier_map(os.getenv("TIER_INFLIGHT_CAPS", "paid:3,free:1,background:1"))
+MAX_USER_QUEUED = int(os.getenv("MAX_USER_QUEUED", "5"))
+
+SJF_SCHEDULING = os.getenv("SJF_SCHEDULING", "on").lower() in ("1", "true", "on")
+SJF_MAX_WAIT_SECONDS = float(os.getenv("SJF_MAX_WAIT_SECONDS", "120"))
+
+ANONYMOUS_USER = "anonymous"
+
+# With a capacity source (render workers behind a queue): seconds between capacity checks
+CAPACITY_REFRESH_SECONDS = 10.0
+
+# Initial guess for Retry-After until real render times are measured
+DEFAULT_RENDER_SECONDS = 30.0
+
+
+class OverloadedError(Exception):
+    """Raised when the render backlog is past the hard threshold."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Render capacity exhausted, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    """A render waiting for (or holding) a worker slot."""
+
+    def __init__(self, user_id: str, tier: str, seq: int, predicted_seconds: Optional[float] = None):
+        self.user_id = user_id
+        self.tier = tier
+        self.seq = seq
+        self.predicted_seconds = predicted_seconds
+        self.enqueued = time.monotonic()
+        self.started: Optional[float] = None
+        self.granted = threading.Event()
+
+
+class RenderScheduler:
+    """
+    Tracks render load, picks render quality and runs renders in bounded slots.
+
+    Slots are handed out fairly between users rather than first come, first
+    served: each user has a virtual time that advances by 1/weight per render
+    granted, and the waiting user with the lowest virtual time goes next.
+    Paid tiers get a larger weight and in-flight cap, so one user's burst
+    only delays their own queue.
+    """
+
+    def __init__(self, workers: int = RENDER_WORKERS):
+        self.workers = max(1, workers)
+        self._lock = threading.Lock()
+        self.running = 0
+        self.avg_render_seconds = DEFAULT_RENDER_SECONDS
+
+        self._waiting: Dict[str, List[_Ticket]] = {}
+        self._running: Dict[int, _Ticket] = {}
+        self._in_flight: Dict[str, int] = {}
+        # Requests admitted (admit → release), per user, whether or not they hold a ticket yet
+        self._admitted: Dict[str, int] = {}
+        self._vtime: Dict[str, float] = {}
+        self._vclock = 0.0
+        self._seq = itertools.count()
+
+        self._upgrades: "queue.Queue[Callable[[], Any]]" = queue.Queue()
+        self._upgrade_thread = None
+
+        # When slots stand for remote render workers (RENDER_BACKEND=queue), a
+        # callable returning their live total capacity; the slot count follows it
+        self.capacity_source: Optional[Callable[[], int]] = None
+        self._capacity_checked = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(tickets) for tickets in self._waiting.values())
+
+    def _refresh_capacity(self) -> None:
+        """Resizes the slot count to the capacity source's, at most every CAPACITY_REFRESH_SECONDS."""
+        now = time.monotonic()
+        if self.capacity_source is None or now - self._capacity_checked < CAPACITY_REFRESH_SECONDS:
+            return
+        self._capacity_checked = now
+        try:
+            capacity = int(self.capacity_source())
+        except Exception as e:
+            print(f"⚠️  Could not read render capacity: {e}")
+            return
+        with self._lock:
+            if capacity != self.workers:
+                # No live workers → one slot, so the backlog shows up as load and is shed
+                self.workers = max(1, capacity)
+                self._dispatch()
+
+    def _tickets(self, user_id: str) -> int:
+        """A user's renders waiting for or holding a slot (lock held)."""
+        return len(self._waiting.get(user_id, ())) + self._in_flight.get(user_id, 0)
+
+    def _outstanding(self, user_id: str) -> int:
+        """
+        A user's requests in the system (lock held): admitted ones, or their
+        slot tickets when there are more (renders not admitted, like upgrades).
+        """
+        return max(self._admitted.get(user_id, 0), self._tickets(user_id))
+
+    def _backlog(self) -> int:
+        """Renders running or waiting plus admitted requests without a ticket yet (lock held)."""
+        pre_render = sum(max(0, count - self._tickets(user_id)) for user_id, count in self._admitted.items())
+        return self.running + self.waiting + pre_render
+
+    def load(self) -> float:
+        self._refresh_capacity()
+        with self._lock:
+            return self._backlog() / self.workers
+
+    def retry_after(self) -> int:
+        """Rough seconds until the backlog drains back under the hard threshold."""
+        with self._lock:
+            return self._retry_after()
+
+    def _retry_after(self) -> int:
+        excess = self._backlog() - int(MAX_LOAD * self.workers) + 1
+        return max(1, int(max(1, excess) * self.avg_render_seconds / self.workers))
+
+    def choose_quality(self) -> str:
+        return self._quality_for(self.load())
+
+    def _quality_for(self, load: float) -> str:
+        if load < QUALITY_MEDIUM_LOAD:
+            return "h"
+        if load < QUALITY_LOW_LOAD:
+            return "m"
+        return "l"
+
+    def admit(self, user_id: str = ANONYMOUS_USER, tier: str = "free") -> str:
+        """
+        Admission control for a new render job. An admitted request counts
+        towards load and the user's queue from here on - through its LLM
+        phase, before it asks for a slot - until release() is called for it.
+
+        Returns:
+            The render quality to use for it
+        Raises:
+            OverloadedError if the backlog is past MAX_LOAD or the user
+            already has too many requests queued
+        """
+        self._refresh_capacity()
+        with self._lock:
+            load = self._backlog() / self.workers
+            if load >= MAX_LOAD:
+                raise OverloadedError(self._retry_after())
+
+            queued = self._outstanding(user_id)
+            if queued >= MAX_USER_QUEUED:
+                raise OverloadedError(max(1, int(self.avg_render_seconds * queued / self._cap(tier))))
+
+            self._admitted[user_id] = self._admitted.get(user_id, 0) + 1
+        return self._quality_for(load)
+
+    def release(self, user_id: str = ANONYMOUS_USER) -> None:
+        """Ends an admitted request (done or failed)."""
+        with self._lock:
+            count = self._admitted.get(user_id, 0) - 1
+            if count > 0:
+                self._admitted[user_id] = count
+            else:
+                self._admitted.pop(user_id, None)
+
+    def _weight(self, tier: str) -> float:
+        return TIER_WEIGHTS.get(tier, TIER_WEIGHTS.get("free", 1.0))
+
+    def _cap(self, tier: str) -> int:
+        return max(1, int(TIER_INFLIGHT_CAPS.get(tier, TIER_INFLIGHT_CAPS.get("free", 1))))
+
+    def _seconds(self, ticket: _Ticket) -> float:
+        return ticket.predicted_seconds or self.avg_render_seconds
+
+    def _units(self, ticket: _Ticket) -> float:
+        """Job size relative to an average render (1.0 without a prediction or with SJF off)."""
+        if not SJF_SCHEDULING or not ticket.predicted_seconds:
+            return 1.0
+        return min(10.0, max(0.1, ticket.predicted_seconds / self.avg_render_seconds))
+
+    def _user_head(self, tickets: List[_Ticket], now: float) -> _Ticket:
+        """Which of a user's waiting tickets goes next: shortest first, unless one has waited too long."""
+        if not SJF_SCHEDULING:
+            return tickets[0]
+        return min(tickets, key=lambda t: (now - t.enqueued < SJF_MAX_WAIT_SECONDS, self._units(t), t.seq))
+
+    def _finish_key(self, vtime: float, ticket: _Ticket) -> tuple:
+        """Virtual finish time - lowest goes first across users."""
+        return vtime + self._units(ticket) / self._weight(ticket.tier), ticket.seq
+
+    def _next_ticket(self) -> Optional[_Ticket]:
+        """Next ticket of an eligible user, by virtual finish time (lock held)."""
+        now = time.monotonic()
+        best = None
+        for user_id, tickets in self._waiting.items():
+            if not tickets:
+                continue
+            head = self._user_head(tickets, now)
+            if self._in_flight.get(user_id, 0) >= self._cap(head.tier):
+                continue
+            key = self._finish_key(self._vtime.get(user_id, 0.0), head)
+            if best is None or key < best[0]:
+                best = (key, head)
+        return best[1] if best else None
+
+    def _dispatch(self) -> None:
+        """Grants free slots to waiting tickets (lock held)."""
+        while self.running < self.workers:
+            ticket = self._next_ticket()
+            if ticket is None:
+                return
+            user_id = ticket.user_id
+            self._waiting[user_id].remove(ticket)
+            if not self._waiting[user_id]:
+                del self._waiting[user_id]
+
+            self._vclock = self._vtime.get(user_id, 0.0)
+            self._vtime[user_id] = self._vclock + self._units(ticket) / self._weight(ticket.tier)
+            self._in_flight[user_id] = self._in_flight.get(user_id, 0) + 1
+            self.running += 1
+            ticket.started = time.monotonic()
+            self._running[ticket.seq] = ticket
+            ticket.granted.set()
+
+    def _remaining(self, ticket: _Ticket, now: float) -> float:
+        """Predicted seconds left of a running render (never below one second)."""
+        return max(1.0, self._seconds(ticket) - (now - ticket.started))
+
+    def _schedule(self, extra: Optional[_Ticket] = None) -> Dict[int, Tuple[int, float]]:
+        """
+        Simulates the grant order of everything waiting (plus an optional
+        hypothetical ticket) and returns ticket seq → (place in line, ETA
+        in seconds until it finishes), where place 0 means it starts right
+        away and 1 means it's next (lock held). In-flight caps are ignored,
+        so both are estimates.
+        """
+        now = time.monotonic()
+        queues = {user_id: list(tickets) for user_id, tickets in self._waiting.items()}
+        if extra is not None:
+            queues.setdefault(extra.user_id, []).append(extra)
+        vtime = {
+            user_id: max(self._vtime.get(user_id, 0.0), self._vclock)
+            for user_id in queues
+        }
+
+        # When each worker slot frees up
+        slots = sorted(self._remaining(t, now) for t in self._running.values())
+        slots = [0.0] * max(0, self.workers - len(slots)) + slots
+
+        schedule = {}
+        free_slots = self.workers - self.running
+        order = 0
+        while any(queues.values()):
+            heads = {u: self._user_head(tickets, now) for u, tickets in queues.items() if tickets}
+            user_id = min(heads, key=lambda u: self._finish_key(vtime[u], heads[u]))
+            ticket = heads[user_id]
+            queues[user_id].remove(ticket)
+            vtime[user_id] += self._units(ticket) / self._weight(ticket.tier)
+
+            start = heapq.heappop(slots)
+            finish = start + self._seconds(ticket)
+            heapq.heappush(slots, finish)
+            schedule[ticket.seq] = (order - free_slots + 1 if order >= free_slots else 0, finish)
+            order += 1
+        return schedule
+
+    def _positions(self, extra: Optional[_Ticket] = None) -> Dict[int, int]:
+        return {seq: position for seq, (position, _) in self._schedule(extra).items()}
+
+    def estimate_position(self, user_id: str = ANONYMOUS_USER, tier: str = "free") -> int:
+        """Place in line a render submitted now would get (0 = starts right away)."""
+        with self._lock:
+            probe = _Ticket(user_id, tier, next(self._seq))
+            return self._positions(extra=probe)[probe.seq]
+
+    def user_queue(self, user_id: str) -> Dict[str, Any]:
+        """In-flight count, queue positions and ETAs (seconds until done) of a user's renders."""
+        now = time.monotonic()
+        with self._lock:
+            schedule = self._schedule()
+            waiting = sorted(self._waiting.get(user_id, ()), key=lambda t: schedule[t.seq])
+            running = [t for t in self._running.values() if t.user_id == user_id]
+            return {
+                "admitted": self._admitted.get(user_id, 0),
+                "in_flight": self._in_flight.get(user_id, 0),
+                "queue_positions": [schedule[t.seq][0] for t in waiting],
+                "running_eta_seconds": [round(self._remaining(t, now)) for t in running],
+                "queued_eta_seconds": [round(schedule[t.seq][1]) for t in waiting],
+            }
+
+    @contextmanager
+    def slot(self, user_id: str = ANONYMOUS_USER, tier: str = "free", predicted_seconds: Optional[float] = None):
+        """
+        Holds one render worker slot for the duration of the block.
+
+        Args:
+            predicted_seconds: Estimated render time (app/render_cost.py),
+                for shortest-job-first ordering and ETAs
+        """
+        self._refresh_capacity()
+        with self._lock:
+            ticket = _Ticket(user_id, tier, next(self._seq), predicted_seconds)
+            if user_id not in self._waiting and not self._in_flight.get(user_id):
+                # A returning user doesn't get credit for the time they were idle
+                self._vtime[user_id] = max(self._vtime.get(user_id, 0.0), self._vclock)
+            self._waiting.setdefault(user_id, []).append(ticket)
+            self._dispatch()
+        ticket.granted.wait()
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self.running -= 1
+                self._running.pop(ticket.seq, None)
+                self._in_flight[user_id] -= 1
+                if not self._in_flight[user_id]:
+                    del self._in_flight[user_id]
+                # Exponential moving average keeps Retry-After close to recent reality
+                self.avg_render_seconds = 0.8 * self.avg_render_seconds + 0.2 * elapsed
+                self._dispatch()
+
+    @contextmanager
+    def spare_slots(self, wanted: int):
+        """
+        Holds up to `wanted` more slots for a render that already has one
+        and can use extra processes (section-parallel rendering), for the
+        duration of the block. Only slots that are idle right now are
+        taken, and none while anything is waiting. Yields how many it got.
+        """
+        self._refresh_capacity()
+        with self._lock:
+            count = 0 if self.waiting else max(0, min(wanted, self.workers - self.running))
+            self.running += count
+        try:
+            yield count
+        finally:
+            if count:
+                with self._lock:
+                    self.running -= count
+                    self._dispatch()
+
+    def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Runs a render function inside an anonymous worker slot."""
+        with self.slot():
+            return fn(*args, **kwargs)
+
+    def schedule_upgrade(self, upgrade: Callable[[], Any]) -> None:
+        """Queues a re-render at full quality for when load is low."""
+        self._upgrades.put(upgrade)
+        if self._upgrade_thread is None or not self._upgrade_thread.is_alive():
+            self._upgrade_thread = threading.Thread(target=self._upgrade_loop, daemon=True)
+            self._upgrade_thread.start()
+
+    def _upgrade_loop(self) -> None:
+        while True:
+            upgrade = self._upgrades.get()
+
+            # Upgrades only use spare capacity - wait for interactive load to drop
+            while self.load() >= UPGRADE_LOAD:
+                time.sleep(1)
+
+            try:
+                upgrade()
+            except Exception as e:
+                print(f"❌ Background quality upgrade failed: {e}")
+
+
+render_scheduler = RenderScheduler()
@@ -1,26 +1,62 @@
 import os
 import re
 import ast
-import requests
+import json
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 
-from app.prompt_engine.prompts import PROMPT_TEMPLATES
+from app.prompt_engine.prompts import get_system_prompt
 try:
-    from app.prompt_engine.smart_intent_detector import detect_intent
+    from app.prompt_engine.smart_intent_detector import detect_intent, detect_intents
     print("Using smart intent detector (embedding-based)")
 except Exception:
-    from app.prompt_engine.intent_detector import detect_intent
+    from app.prompt_engine.intent_detector import detect_intent, detect_intents
     print("Falling back to keyword-based intent detector")
 
 from app.prompt_engine.script_validation import check_for_invalid_manim_methods
+from app.tex_prewarm import TEX_PREWARM, TexPrewarmer
+from app.renderer import dry_run_manim_script
+from app.gemini_client import GeminiUnavailableError, gemini_client
+from app.llm_context import STALE_CONTEXT_STATUSES, build_payload, choose_prompt_variant, context_cache, llm_usage
+from app.profiling import propagate
 
 # NEW: Import template engine
-from app.template_engine import generate_from_template
+from app.template_engine import generate_template_script
 
 # Load environment variables
 load_dotenv()
 
+RAW_LLM_TIMEOUT_SECONDS = 120
+
+# Streamed raw generation: give up on replies that clearly aren't a Manim scene
+STREAM_PROSE_LIMIT = int(os.getenv("STREAM_PROSE_LIMIT", "2000"))      # chars of reply without any code
+STREAM_SCENE_LINE_LIMIT = int(os.getenv("STREAM_SCENE_LINE_LIMIT", "60"))  # code lines without a Scene class
+STREAM_CHECK_EVERY_LINES = 10
+
+# Parallel raw candidates (1 = off): the first to pass static checks and a dry run wins
+RAW_CANDIDATES = max(1, int(os.getenv("RAW_CANDIDATES", "1")))
+RAW_DRY_RUN_TIMEOUT_SECONDS = float(os.getenv("RAW_DRY_RUN_TIMEOUT_SECONDS", "60"))
+# Threads for raw candidates - separate from the hedge pool, whose raw path waits on them
+RAW_CANDIDATE_WORKERS = int(os.getenv("RAW_CANDIDATE_WORKERS", "16"))
+# A candidate set gives up after streaming plus a dry run, even if candidates never got a thread
+RAW_CANDIDATES_DEADLINE_SECONDS = RAW_LLM_TIMEOUT_SECONDS + RAW_DRY_RUN_TIMEOUT_SECONDS
+
+# Syntax errors that only mean the code isn't finished yet
+INCOMPLETE_CODE_ERRORS = ("was never closed", "unexpected EOF", "expected an indented block", "unterminated triple-quoted")
+
+# Hedging: race the raw LLM path against the template path to cut tail latency
+HEDGE_MODE = os.getenv("HEDGE_MODE", "off").lower() in ("1", "true", "on")
+HEDGE_CONFIDENCE = float(os.getenv("HEDGE_CONFIDENCE", "0.85"))
+HEDGE_BUDGET_SECONDS = float(os.getenv("HEDGE_BUDGET_SECONDS", "8"))
+
+_hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+_candidate_pool = ThreadPoolExecutor(max_workers=max(1, RAW_CANDIDATE_WORKERS), thread_name_prefix="raw-candidate")
+
 def extract_code_from_response(text: str) -> str:
     match = re.search(r"```(?:python)?\n(.*?)```", text, re.DOTALL)
     if match:
@@ -29,56 +65,342 @@ def extract_code_from_response(text: str) -> str:
     start_index = text.find("from manim import *")
     return text[start_index:].strip() if start_index != -1 else text.strip()
 
+class StreamingCodeExtractor:
+    """
+    Follows a streamed LLM reply and pulls out the Python code as it arrives,
+    the same way extract_code_from_response does for a full reply.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.code_start: Optional[int] = None
+        self.closed = False
+        self.lines_done = 0
+
+    def feed(self, chunk: str) -> List[str]:
+        """Adds streamed text and returns the code lines completed by it."""
+        self.text += chunk
+        if self.code_start is None:
+            fence = re.search(r"```(?:python)?\n", self.text)
+            if fence:
+                self.code_start = fence.end()
+            elif "from manim import *" in self.text:
+                self.code_start = self.text.find("from manim import *")
+            else:
+                return []
+
+        lines = self.code.split("\n")
+        if not self.closed:
+            lines = lines[:-1]  # the last line may still be growing
+        new_lines = lines[self.lines_done:]
+        self.lines_done = len(lines)
+        return new_lines
+
+    @property
+    def code(self) -> str:
+        if self.code_start is None:
+            return ""
+        code = self.text[self.code_start:]
+        end = code.find("```")
+        if end != -1:
+            self.closed = True
+            code = code[:end]
+        return code
+
+    def complete_lines(self) -> List[str]:
+        return self.code.split("\n")[:self.lines_done]
+
+
+def partial_syntax_error(lines: List[str]) -> Optional[str]:
+    """
+    Syntax error in an unfinished script that finishing it can't fix.
+    Errors at the end or about unclosed brackets/blocks are just the cut.
+    """
+    try:
+        ast.parse("\n".join(lines))
+    except SyntaxError as e:
+        if (e.lineno or 0) >= len(lines) or any(msg in str(e.msg) for msg in INCOMPLETE_CODE_ERRORS):
+            return None
+        return f"line {e.lineno}: {e.msg}"
+    return None
+
+
+def early_abort_reason(extractor: StreamingCodeExtractor) -> Optional[str]:
+    """Why a reply that's still streaming can't become a valid scene, or None."""
+    if extractor.code_start is None:
+        if len(extractor.text) > STREAM_PROSE_LIMIT:
+            return f"no code in the first {STREAM_PROSE_LIMIT} characters"
+        return None
+
+    lines = extractor.complete_lines()
+    if len(lines) >= STREAM_SCENE_LINE_LIMIT and not re.search(r"class\s+\w+\s*\(.*Scene", "\n".join(lines)):
+        return f"no Scene class in the first {STREAM_SCENE_LINE_LIMIT} lines"
+
+    error = partial_syntax_error(lines)
+    if error:
+        return f"syntax error at {error}"
+    return None
+
+
+def stream_gemini_text(response, extractor: StreamingCodeExtractor, on_lines=None,
+                       cancel_event: Optional[threading.Event] = None, deadline: Optional[float] = None,
+                       usage: Optional[Dict] = None) -> Optional[str]:
+    """
+    Reads a streamGenerateContent (alt=sse) response into the extractor.
+
+    Stops as soon as the code block is closed (the rest is explanation),
+    and aborts when the partial reply can't become a valid scene. The
+    latest usageMetadata seen is copied into usage.
+
+    Returns:
+        None when the stream was read, or the reason it was stopped early
+    """
+    lines_since_check = 0
+    for raw_line in response.iter_lines(decode_unicode=True):
+        if cancel_event is not None and cancel_event.is_set():
+            return "cancelled"
+        if deadline is not None and time.monotonic() > deadline:
+            return f"no complete reply within {RAW_LLM_TIMEOUT_SECONDS}s"
+        if not raw_line or not raw_line.startswith("data:"):
+            continue
+
+        try:
+            event = json.loads(raw_line[len("data:"):])
+            if usage is not None and "usageMetadata" in event:
+                usage.update(event["usageMetadata"])
+            parts = event["candidates"][0]["content"]["parts"]
+        except (ValueError, KeyError, IndexError):
+            continue
+
+        new_lines = extractor.feed("".join(part.get("text", "") for part in parts))
+        if new_lines and on_lines is not None:
+            on_lines(new_lines)
+
+        lines_since_check += len(new_lines)
+        if extractor.closed:
+            return None
+        if lines_since_check >= STREAM_CHECK_EVERY_LINES or extractor.code_start is None:
+            lines_since_check = 0
+            reason = early_abort_reason(extractor)
+            if reason:
+                return reason
+    return None
+
+
 def generate_prompt_parts(user_prompt: str) -> list:
-    intent = detect_intent(user_prompt)
-    template = PROMPT_TEMPLATES.get(intent, PROMPT_TEMPLATES["concept_explanation"])
-    parts = [
-        {"text": template("").strip()},
-        {"text": user_prompt.strip()}
-    ]
-    return [{"parts": parts}]
+    """User turn of a raw generation request (the static instructions go in the system context)."""
+    return [{"role": "user", "parts": [{"text": user_prompt.strip()}]}]
+
+def save_script(script_code: str, output_path: str) -> None:
+    """Writes a generated script to disk, creating parent folders as needed."""
+    output_file = Path(output_path)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    output_file.write_text(script_code, encoding="utf-8")
+    print(f" Manim script saved to: {output_path}\n")
 
-def generate_script_with_raw_llm(user_prompt: str, model: str, output_path: str) -> str:
+def _post_stream(model: str, payload: Dict):
+    return gemini_client.post(
+        f"models/{model}:streamGenerateContent?alt=sse",
+        payload,
+        timeout=RAW_LLM_TIMEOUT_SECONDS,
+        stream=True
+    )
+
+def generate_script_with_raw_llm(user_prompt: str, model: str, output_path: str, cancel_event: Optional[threading.Event] = None,
+                                 intent: Optional[str] = None) -> str:
     """
     Original code generation approach - generates raw code using LLM prompts.
     Used as fallback when template system doesn't match.
+    
+    intent can be passed in when it was already detected (e.g. batched for
+    many prompts with detect_intents).
+    
+    The intent's static instructions are sent as (cached) system context,
+    in the full or trimmed variant (PROMPT_VARIANT); tokens, latency and
+    outcome are recorded per intent and variant.
+    
+    With RAW_CANDIDATES > 1, several candidates are generated in parallel
+    and the first one to pass static checks and a Manim dry run wins.
+    
+    If cancel_event is set while the request is in flight (another hedged
+    path already won), the response is dropped.
+    
+    While Gemini is unavailable (circuit open), only a script generated
+    earlier for the same prompt is returned - nothing is sent.
     """
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
         raise EnvironmentError("❌ GEMINI_API_KEY environment variable is not set.")
 
-    payload = {"contents": generate_prompt_parts(user_prompt)}
+    intent = intent or detect_intent(user_prompt)
+    result_key = gemini_client.results.key("raw", model, intent, " ".join(user_prompt.split()).lower())
+    if gemini_client.degraded:
+        cached = gemini_client.results.get(result_key)
+        if cached:
+            print("♻️  Gemini unavailable, using the script generated earlier for this prompt")
+            return cached
+        print("⛔ Gemini unavailable, skipping raw generation")
+        return ""
+
+    if RAW_CANDIDATES > 1:
+        script_code = _generate_raw_candidates(user_prompt, model, output_path, intent, cancel_event)
+    else:
+        script_code = _generate_raw_candidate(user_prompt, model, intent, cancel_event)
+    if script_code:
+        gemini_client.results.put(result_key, script_code)
+    return script_code
+
+
+def _generate_raw_candidates(user_prompt: str, model: str, output_path: str, intent: str,
+                             cancel_event: Optional[threading.Event] = None) -> str:
+    """
+    Streams RAW_CANDIDATES generations at once and returns the first that
+    passes static checks (hallucinated methods included) and a dry run.
+    The others are cancelled mid-stream. Returns "" when none passed within
+    RAW_CANDIDATES_DEADLINE_SECONDS.
+    """
+    print(f"\n🎲 Generating {RAW_CANDIDATES} raw candidates in parallel...")
+    results: "queue.Queue[Tuple[int, str, str]]" = queue.Queue()
+    cancel_rest = threading.Event()
+    output_file = Path(output_path)
+
+    def run_candidate(index: int) -> None:
+        if cancel_rest.is_set():
+            # Waited for a thread past the point anyone needs the result
+            results.put((index, "", "cancelled"))
+            return
+        try:
+            # No TeX prewarm here - the dry run compiles the same TeX itself
+            code = _generate_raw_candidate(user_prompt, model, intent, cancel_rest, prewarm=False, strict=True)
+        except Exception as e:
+            results.put((index, "", str(e)))
+            return
+        if not code or cancel_rest.is_set():
+            results.put((index, "", "invalid script"))
+            return
+
+        candidate_path = output_file.with_name(f"{output_file.stem}_candidate{index}.py")
+        save_script(code, str(candidate_path))
+        try:
+            passed, error = dry_run_manim_script(str(candidate_path), timeout=RAW_DRY_RUN_TIMEOUT_SECONDS)
+        except OSError as e:
+            passed, error = False, str(e)
+        finally:
+            candidate_path.unlink(missing_ok=True)
+        results.put((index, code if passed else "", error))
+
+    for index in range(1, RAW_CANDIDATES + 1):
+        _candidate_pool.submit(propagate(run_candidate), index)
+
+    deadline = time.monotonic() + RAW_CANDIDATES_DEADLINE_SECONDS
+    finished = 0
+    while finished < RAW_CANDIDATES:
+        if cancel_event is not None and cancel_event.is_set():
+            cancel_rest.set()
+            print(" Raw generation cancelled")
+            return ""
+        if time.monotonic() > deadline:
+            cancel_rest.set()
+            print(f"❌ No raw candidate finished within {RAW_CANDIDATES_DEADLINE_SECONDS:.0f}s")
+            return ""
+        try:
+            index, code, error = results.get(timeout=0.2)
+        except queue.Empty:
+            continue
+        finished += 1
+        if code:
+            cancel_rest.set()
+            print(f"✅ Candidate {index} passed the dry run ({finished}/{RAW_CANDIDATES} finished)")
+            return code
+        print(f" Candidate {index} rejected: {error}")
+
+    print("❌ No raw candidate passed validation")
+    return ""
+
+
+def _generate_raw_candidate(user_prompt: str, model: str, intent: str,
+                            cancel_event: Optional[threading.Event] = None, prewarm: bool = True,
+                            strict: bool = False) -> str:
+    """
+    Streams one raw generation and validates it.
+    
+    Args:
+        prewarm: Compile the script's TeX in the background while streaming
+        strict: Reject scripts with known hallucinated Manim methods
+            instead of only warning about them
+    """
+    variant = choose_prompt_variant(user_prompt)
+    label = f"raw:{intent}"
+    system_text = get_system_prompt(intent, variant)
+    contents = generate_prompt_parts(user_prompt)
+    payload, cached_name = build_payload(model, contents, system_text)
     print(f"\n⚠️  Using fallback raw generation mode")
-    print(f" Sending prompt to model: {model}")
+    print(f" Streaming prompt to model: {model} ({intent}, {variant} prompt{', cached context' if cached_name else ''})")
 
-    response = requests.post(
-        f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}",
-        headers={"Content-Type": "application/json"},
-        json=payload
-    )
+    # TeX strings are compiled while the rest of the reply streams in
+    prewarmer = TexPrewarmer(enabled=prewarm and TEX_PREWARM)
+    extractor = StreamingCodeExtractor()
+    usage: Dict = {}
+    started = time.monotonic()
+    deadline = started + RAW_LLM_TIMEOUT_SECONDS
 
-    if response.status_code != 200:
-        print(f" API request failed: {response.status_code}")
-        print(response.text)
+    def failed() -> str:
+        prewarmer.cancel()
+        llm_usage.record(label, variant, usage=usage or None, latency=time.monotonic() - started, success=False)
         return ""
 
     try:
-        raw_output = response.json()["candidates"][0]["content"]["parts"][0]["text"]
-    except (KeyError, IndexError) as e:
-        print(f" Failed to parse response: {e}")
-        print(response.text)
+        response = _post_stream(model, payload)
+        if response.status_code in STALE_CONTEXT_STATUSES and cached_name:
+            # Cached context expired or was evicted - resend it inline
+            response.close()
+            context_cache.invalidate(model, system_text)
+            payload, _ = build_payload(model, contents, system_text, use_cache=False)
+            response = _post_stream(model, payload)
+    except GeminiUnavailableError as e:
+        print(f"⛔ {e}")
+        prewarmer.cancel()
+        return ""
+
+    with response:
+        if response.status_code != 200:
+            print(f" API request failed: {response.status_code}")
+            print(response.text)
+            return failed()
+
+        stopped = stream_gemini_text(
+            response, extractor,
+            on_lines=lambda lines: [prewarmer.add_line(line) for line in lines],
+            cancel_event=cancel_event, deadline=deadline, usage=usage
+        )
+
+    if cancel_event is not None and cancel_event.is_set():
+        prewarmer.cancel()
+        print(" Raw generation cancelled")
         return ""
 
+    if stopped:
+        print(f" Aborted generation early: {stopped}")
+        print(" Partial output:\n", extractor.text)
+        return failed()
+
+    raw_output = extractor.text
+    if not raw_output.strip():
+        print(" Empty response from model")
+        return failed()
+
     script_code = extract_code_from_response(raw_output)
 
     if "Scene" not in script_code or "class" not in script_code:
         print(" Invalid response: Not a Manim script. Skipping save.")
         print(" Raw output:\n", raw_output)
-        return ""
+        return failed()
 
     invalids = check_for_invalid_manim_methods(script_code)
     if invalids:
         print(f" Warning: Detected hallucinated Manim methods: {', '.join(invalids)}")
+        if strict:
+            return failed()
 
     if "from manim import *" not in script_code:
         script_code = "from manim import *\n" + script_code
@@ -90,39 +412,139 @@ def generate_script_with_raw_llm(user_prompt: str, model: str, output_path: str)
         print(" Syntax error in generated code. Skipping save.")
         print(f" Error: {e}")
         print(" Raw output:\n", script_code)
-        return ""
+        return failed()
 
+    llm_usage.record(label, variant, usage=usage or None, latency=time.monotonic() - started, success=True)
+    prewarmer.finish()
     return script_code
 
 
-def generate_script(user_prompt: str, model: str = "gemini-2.0-flash", output_path: str = "app/static/outputs/generated_scene.py") -> str:
-    """
-    Main script generation function.
-    
-    NEW BEHAVIOR:
-    1. Try template system first (guaranteed layout)
-    2. Fall back to raw LLM generation if no template matches
-    """
+def _generate_sequential(user_prompt: str, model: str, output_path: str) -> Tuple[str, Optional[str], Optional[Dict]]:
+    """Template path first, raw LLM generation only once it has failed."""
     
     # Step 1: Try template system
     print("\n🎯 Attempting template-based generation...")
-    script_code, status = generate_from_template(user_prompt)
+    script_code, status, template_name, params = generate_template_script(user_prompt)
     
     if script_code:
         print("✅ Template generation successful!")
-    else:
-        print(f"❌ Template generation failed: {status}")
-        print("🔄 Falling back to raw LLM generation...")
-        script_code = generate_script_with_raw_llm(user_prompt, model, output_path)
+        return script_code, template_name, params
+    
+    print(f"❌ Template generation failed: {status}")
+    print("🔄 Falling back to raw LLM generation...")
+    script_code = generate_script_with_raw_llm(user_prompt, model, output_path)
+    
+    if not script_code:
+        print("❌ Raw generation also failed")
+    return script_code, None, None
+
+
+def _generate_hedged(user_prompt: str, model: str, output_path: str) -> Tuple[str, Optional[str], Optional[Dict]]:
+    """
+    Runs the template path and, speculatively, the raw LLM path.
+    
+    The raw path starts as soon as classification confidence is below
+    HEDGE_CONFIDENCE, the template path runs past HEDGE_BUDGET_SECONDS,
+    or the template path fails. The first valid script wins and the
+    other path is cancelled.
+    """
+    results: "queue.Queue[Tuple[str, str, Optional[str], Optional[Dict]]]" = queue.Queue()
+    cancel_template = threading.Event()
+    cancel_raw = threading.Event()
+    lock = threading.Lock()
+    started = {"template": True, "raw": False}
+    
+    def run_raw():
+        try:
+            code = generate_script_with_raw_llm(user_prompt, model, output_path, cancel_event=cancel_raw)
+        except Exception as e:
+            print(f" Raw generation error: {e}")
+            code = ""
+        results.put(("raw", code, None, None))
+    
+    def start_raw(reason: str) -> bool:
+        with lock:
+            if started["raw"]:
+                return False
+            started["raw"] = True
+        print(f"🏁 Hedging: starting raw LLM generation ({reason})")
+        _hedge_pool.submit(propagate(run_raw))
+        return True
+    
+    def on_classified(template_name: Optional[str], confidence: float):
+        if not template_name or confidence < HEDGE_CONFIDENCE:
+            start_raw(f"classification confidence {confidence:.2f}")
+    
+    def run_template():
+        try:
+            code, status, template_name, params = generate_template_script(
+                user_prompt, on_classified=on_classified, cancel_event=cancel_template
+            )
+        except Exception as e:
+            code, status, template_name, params = None, str(e), None, None
+        if not code and not cancel_template.is_set():
+            print(f"❌ Template generation failed: {status}")
+        results.put(("template", code, template_name, params))
+    
+    print("\n🎯 Attempting template-based generation (hedged)...")
+    _hedge_pool.submit(propagate(run_template))
+    deadline = time.monotonic() + HEDGE_BUDGET_SECONDS
+    finished = 0
+    
+    while True:
+        with lock:
+            running = sum(started.values()) - finished
+        if running == 0:
+            break
         
-        if not script_code:
-            print("❌ Raw generation also failed")
-            return ""
+        timeout = None if started["raw"] else max(0.0, deadline - time.monotonic())
+        try:
+            source, code, template_name, params = results.get(timeout=timeout)
+        except queue.Empty:
+            start_raw(f"template path over {HEDGE_BUDGET_SECONDS}s budget")
+            continue
+        finished += 1
+        
+        if code:
+            # First valid script wins - cancel the other path
+            (cancel_raw if source == "template" else cancel_template).set()
+            print(f"✅ {source.capitalize()} generation won the hedge")
+            return code, template_name, params
+        
+        if source == "template":
+            start_raw("template path failed")
     
-    # Save the generated script
-    output_file = Path(output_path)
-    output_file.parent.mkdir(parents=True, exist_ok=True)
-    output_file.write_text(script_code, encoding="utf-8")
-    print(f" Manim script saved to: {output_path}\n")
+    print("❌ Template and raw generation both failed")
+    return "", None, None
+
 
-    return script_code
\ No newline at end of file
+def generate_script_with_params(user_prompt: str, model: str = "gemini-2.0-flash", output_path: str = "app/static/outputs/generated_scene.py") -> Tuple[str, Optional[str], Optional[Dict]]:
+    """
+    Same as generate_script, but also returns which template and
+    parameters produced the script (both None for raw generation).
+    """
+    if HEDGE_MODE:
+        script_code, template_name, params = _generate_hedged(user_prompt, model, output_path)
+    else:
+        script_code, template_name, params = _generate_sequential(user_prompt, model, output_path)
+    
+    if not script_code:
+        return "", None, None
+    
+    save_script(script_code, output_path)
+    return script_code, template_name, params
+
+
+def generate_script(user_prompt: str, model: str = "gemini-2.0-flash", output_path: str = "app/static/outputs/generated_scene.py") -> str:
+    """
+    Main script generation function.
+    
+    NEW BEHAVIOR:
+    1. Try template system first (guaranteed layout)
+    2. Fall back to raw LLM generation if no template matches
+    
+    With HEDGE_MODE on, the raw path is started speculatively instead
+    of strictly after the template path (see _generate_hedged).
+    """
+    script_code, _, _ = generate_script_with_params(user_prompt, model, output_path)
+    return script_code
@@ -0,0 +1,226 @@
+"""
+Request coalescing and idempotency.
+
+- SingleFlight: concurrent calls with the same key share one execution
+  (e.g. several users submitting the same prompt at once → one Gemini
+  pipeline run and one render).
+- IdempotencyStore: remembers finished results by client-supplied key (in
+  SQLite, shared by the API processes on a host), so a retried request gets
+  the original response instead of running again.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+# Outside /static: it holds users' responses
+IDEMPOTENCY_DB = os.getenv("IDEMPOTENCY_DB", "idempotency.db")
+# A request still running after this long is assumed lost with its process
+IDEMPOTENCY_CLAIM_SECONDS = int(os.getenv("IDEMPOTENCY_CLAIM_SECONDS", "900"))
+
+CLAIM_POLL_SECONDS = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    result TEXT,                 -- JSON, NULL while the request is running
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idempotency_keys_expiry ON idempotency_keys (expires_at);
+"""
+
+
+class _Call:
+    """One in-flight execution and everyone waiting on it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time; duplicates wait for and share its result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Runs fn, or waits for the identical call already in flight.
+
+        Returns:
+            (result, shared) - shared is True when another caller did the work
+        Raises:
+            Whatever fn raised, for the leader and every waiter
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, False
+
+
+class IdempotencyConflictError(Exception):
+    """Raised when an idempotency key is reused for a different request."""
+
+
+class IdempotencyStore:
+    """
+    Stores successful results by idempotency key for IDEMPOTENCY_TTL_SECONDS,
+    in SQLite (IDEMPOTENCY_DB), so retries are answered from any API process
+    on the host and across restarts.
+
+    A fingerprint of the request is stored with each result, so reusing a key
+    with a different request is rejected rather than answered with the
+    wrong result. Failures are not stored - a retry runs again.
+
+    A request being processed holds a claim on its key: a retry arriving
+    meanwhile (in any process) waits for its result instead of running
+    again. A claim older than IDEMPOTENCY_CLAIM_SECONDS is taken to belong
+    to a process that died, and the key runs again. Results must be JSON
+    serializable. Like the render queue, the database is for processes on
+    one host (SQLite WAL doesn't work over network filesystems).
+    """
+
+    def __init__(self, path: str = IDEMPOTENCY_DB, ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._flight = SingleFlight()
+        self._ready = False
+        self._init_lock = threading.Lock()
+
+    @contextmanager
+    def _connect(self):
+        # A connection per operation - used from many threads and processes
+        with self._init_lock:
+            if not self._ready:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with closing(sqlite3.connect(self.path, timeout=30, isolation_level=None)) as db:
+                    db.execute("PRAGMA journal_mode=WAL")
+                    db.executescript(SCHEMA)
+                self._ready = True
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def _key(key: Hashable) -> str:
+        return json.dumps(key)
+
+    def get(self, key: Hashable, fingerprint: str) -> Optional[Any]:
+        """Returns the stored result for key, or None if there is none (or it expired, or is still running)."""
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT fingerprint, result FROM idempotency_keys WHERE key = ? AND expires_at >= ?",
+                (self._key(key), time.time()),
+            ).fetchone()
+        if row is None or row[1] is None:
+            return None
+
+        stored_fingerprint, result = row
+        if stored_fingerprint != fingerprint:
+            raise IdempotencyConflictError("Idempotency key was already used for a different request")
+        return json.loads(result)
+
+    def _claim(self, key: str, fingerprint: str) -> Tuple[bool, Optional[Any]]:
+        """(True, None) when this caller should run the request, else (False, its result or None while running)."""
+        now = time.time()
+        with self._connect() as db:
+            # Take the write lock up front, so two processes can't both claim the key
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT fingerprint, result, expires_at FROM idempotency_keys WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None or row[2] < now:
+                    db.execute(
+                        "INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, result, expires_at)"
+                        " VALUES (?, ?, NULL, ?)",
+                        (key, fingerprint, now + IDEMPOTENCY_CLAIM_SECONDS),
+                    )
+                    claimed = (True, None)
+                elif row[0] != fingerprint:
+                    raise IdempotencyConflictError("Idempotency key was already used for a different request")
+                else:
+                    claimed = (False, json.loads(row[1]) if row[1] is not None else None)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return claimed
+
+    def _run_once(self, key: Hashable, fingerprint: str, fn: Callable[[], Any]) -> Any:
+        db_key = self._key(key)
+        while True:
+            claimed, result = self._claim(db_key, fingerprint)
+            if claimed:
+                break
+            if result is not None:
+                return result
+            # Running in another process - wait for its result
+            time.sleep(CLAIM_POLL_SECONDS)
+
+        try:
+            result = fn()
+        except BaseException:
+            with self._connect() as db:
+                db.execute("DELETE FROM idempotency_keys WHERE key = ? AND result IS NULL", (db_key,))
+            raise
+
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "UPDATE idempotency_keys SET result = ?, expires_at = ? WHERE key = ?",
+                (json.dumps(result), now + self.ttl_seconds, db_key),
+            )
+            # Drop expired entries on the way, keeps the store bounded by TTL
+            db.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (now,))
+        return result
+
+    def run(self, key: Hashable, fingerprint: str, fn: Callable[[], Any]) -> Any:
+        """Returns the stored result for key, or runs fn once (even if retried concurrently) and stores it."""
+        cached = self.get(key, fingerprint)
+        if cached is not None:
+            return cached
+
+        result, shared = self._flight.do(key, lambda: self._run_once(key, fingerprint, fn))
+        if shared:
+            # A concurrent request with the same key but a different body shouldn't get this result
+            self.get(key, fingerprint)
+        return result
+
+
+# Shared by the chat pipeline: concurrent identical prompts render once
+generation_flight = SingleFlight()
+
+# /chat responses by (user_id, Idempotency-Key)
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,337 @@
+"""
+Object storage for rendered videos.
+
+With STORAGE_BACKEND=local (default) videos are served from disk through
+the /static mount, as before. With s3 or supabase, every finished video is
+uploaded in the background (multipart for large files) and clients are
+sent signed or CDN URLs instead; the local copies become a cache that is
+trimmed least-recently-used first once it exceeds LOCAL_CACHE_MAX_MB.
+
+Videos keep their /static/... URL as their identity (that's what the chat
+history and batch manifests store). resolve_url() turns it into the URL to
+hand out, and GET /static/outputs/videos/... redirects to storage when the
+file isn't (or is no longer) on this node.
+
+Any S3-compatible server works, e.g. a local MinIO for testing:
+
+    docker run -p 9000:9000 minio/minio server /data
+    STORAGE_BACKEND=s3 S3_ENDPOINT_URL=http://localhost:9000 \
+    AWS_ACCESS_KEY_ID=minioadmin AWS_SECRET_ACCESS_KEY=minioadmin
+"""
+
+import os
+import time
+import mimetypes
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.postprocess import POSTPROCESS_RENDITIONS, on_optimized, rendition_path, url_to_path
+
+load_dotenv()
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+STORAGE_BUCKET = os.getenv("STORAGE_BUCKET", "videos")
+STORAGE_PREFIX = os.getenv("STORAGE_PREFIX", "")
+# CDN in front of the bucket - when set, URLs are <base>/<key> instead of signed URLs
+STORAGE_PUBLIC_BASE_URL = os.getenv("STORAGE_PUBLIC_BASE_URL", "").rstrip("/")
+SIGNED_URL_TTL_SECONDS = int(os.getenv("SIGNED_URL_TTL_SECONDS", "3600"))
+STORAGE_UPLOAD_WORKERS = int(os.getenv("STORAGE_UPLOAD_WORKERS", "2"))
+MULTIPART_CHUNK_MB = int(os.getenv("MULTIPART_CHUNK_MB", "8"))
+# Keys are overwritten in place (re-renders, the background re-encode), so CDNs and
+# browsers may only keep an object this long before revalidating it
+STORAGE_CACHE_MAX_AGE_SECONDS = int(os.getenv("STORAGE_CACHE_MAX_AGE_SECONDS", "300"))
+
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+
+# Local videos kept once uploaded (0 = keep everything)
+LOCAL_CACHE_MAX_MB = int(os.getenv("LOCAL_CACHE_MAX_MB", "2048"))
+
+STATIC_DIR = "app/static"
+
+
+def storage_key(video_url: str) -> str:
+    """Object key of a /static/... URL, e.g. outputs/videos/chat_x/480p15/turn_1.mp4"""
+    relative = Path(url_to_path(video_url)).relative_to(STATIC_DIR).as_posix()
+    return f"{STORAGE_PREFIX.strip('/')}/{relative}" if STORAGE_PREFIX.strip("/") else relative
+
+
+def path_to_url(path: str) -> str:
+    return "/" + Path(path).relative_to("app").as_posix()
+
+
+def object_headers(path: str) -> Dict[str, str]:
+    """Content-Type (videos, poster and storyboard PNGs) and Cache-Control for an uploaded file."""
+    return {
+        "ContentType": mimetypes.guess_type(path)[0] or "application/octet-stream",
+        "CacheControl": f"public, max-age={STORAGE_CACHE_MAX_AGE_SECONDS}",
+    }
+
+
+class LocalStorage:
+    """Videos stay on disk and are served through /static."""
+
+    remote = False
+
+    def upload(self, path: str, key: str) -> None:
+        pass
+
+    def exists(self, key: str) -> bool:
+        return False
+
+    def url_for(self, key: str) -> Optional[str]:
+        return None
+
+
+class S3Storage:
+    """Any S3-compatible store (AWS S3, MinIO, R2, ...), via boto3."""
+
+    remote = True
+
+    def __init__(self, bucket: str = STORAGE_BUCKET, endpoint_url: Optional[str] = S3_ENDPOINT_URL,
+                 region: str = S3_REGION, access_key: Optional[str] = None, secret_key: Optional[str] = None):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket = bucket
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+        )
+        # Files above one chunk go up as a multipart upload, parts in parallel
+        chunk = MULTIPART_CHUNK_MB * 1024 * 1024
+        self.transfer_config = TransferConfig(multipart_threshold=chunk, multipart_chunksize=chunk, max_concurrency=4)
+        self._signed: Dict[str, Tuple[str, float]] = {}
+
+    def upload(self, path: str, key: str) -> None:
+        self.client.upload_file(
+            path, self.bucket, key,
+            ExtraArgs=object_headers(path),
+            Config=self.transfer_config,
+        )
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError:
+            return False
+
+    def url_for(self, key: str) -> Optional[str]:
+        if STORAGE_PUBLIC_BASE_URL:
+            return f"{STORAGE_PUBLIC_BASE_URL}/{key}"
+
+        # Signed URLs are reused for half their lifetime, so responses embedding
+        # them stay the same between polls (and keep their ETag)
+        url, valid_until = self._signed.get(key, (None, 0.0))
+        if time.time() < valid_until:
+            return url
+        url = self._sign(key)
+        self._signed[key] = (url, time.time() + SIGNED_URL_TTL_SECONDS / 2)
+        return url
+
+    def _sign(self, key: str) -> str:
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": key}, ExpiresIn=SIGNED_URL_TTL_SECONDS
+        )
+
+
+class SupabaseStorage(S3Storage):
+    """
+    Supabase Storage: uploads through its S3-compatible endpoint (multipart),
+    signed URLs from the Storage API.
+    """
+
+    def __init__(self):
+        supabase_url = os.getenv("SUPABASE_URL", "").rstrip("/")
+        super().__init__(
+            endpoint_url=f"{supabase_url}/storage/v1/s3",
+            region=os.getenv("SUPABASE_S3_REGION", S3_REGION),
+            access_key=os.getenv("SUPABASE_S3_ACCESS_KEY_ID"),
+            secret_key=os.getenv("SUPABASE_S3_SECRET_ACCESS_KEY"),
+        )
+
+    def _sign(self, key: str) -> str:
+        # An API call here, not local signing
+        from app.supabase_client import supabase, supabase_admin
+        client = supabase_admin if supabase_admin else supabase
+        signed = client.storage.from_(self.bucket).create_signed_url(key, SIGNED_URL_TTL_SECONDS)
+        return signed.get("signedURL") or signed.get("signedUrl")
+
+
+class VideoStore:
+    """
+    Uploads finished videos off the request path and decides which URL
+    a client gets for a video.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=STORAGE_UPLOAD_WORKERS, thread_name_prefix="upload")
+        self._pending: Dict[str, Future] = {}
+        self._uploaded = set()
+        self._last_access: Dict[str, float] = {}
+
+    @property
+    def remote(self) -> bool:
+        return self.backend.remote
+
+    def offload(self, video_url: Optional[str]) -> Optional[str]:
+        """Queues a rendered video (and its renditions) for upload. Returns the URL unchanged."""
+        if not video_url or not self.remote:
+            return video_url
+
+        for path, key in self._files(video_url):
+            with self._lock:
+                # A re-render overwrote the file, so upload it again
+                self._uploaded.discard(key)
+                self._pending[key] = self._pool.submit(self._upload, path, key)
+        return video_url
+
+    def upload_now(self, video_url: str) -> str:
+        """
+        Uploads a rendered video (and its renditions) before returning, for
+        render workers: their output only reaches clients through storage.
+
+        Raises:
+            RuntimeError without a remote backend, or the backend's error
+            when an upload fails
+        """
+        if not self.remote:
+            raise RuntimeError(f"STORAGE_BACKEND={STORAGE_BACKEND} keeps {video_url} on this node only")
+        files = self._files(video_url)
+        if not files:
+            raise FileNotFoundError(f"Nothing to upload for {video_url}")
+        for path, key in files:
+            with self._lock:
+                self._uploaded.discard(key)
+            self._upload(path, key, raise_errors=True)
+        return video_url
+
+    def _files(self, video_url: str) -> List[Tuple[str, str]]:
+        """(path, storage key) of a video and its renditions that exist on disk."""
+        video_path = url_to_path(video_url)
+        paths = [video_path] + [rendition_path(video_path, h) for h in POSTPROCESS_RENDITIONS]
+        return [(path, storage_key(path_to_url(path))) for path in paths if os.path.exists(path)]
+
+    def _upload(self, path: str, key: str, raise_errors: bool = False) -> None:
+        started = time.monotonic()
+        try:
+            self.backend.upload(path, key)
+        except Exception as e:
+            with self._lock:
+                self._pending.pop(key, None)
+            if raise_errors:
+                raise
+            print(f"❌ Upload of {key} failed, keeping it local: {e}")
+            return
+
+        with self._lock:
+            self._pending.pop(key, None)
+            self._uploaded.add(key)
+        size_mb = os.path.getsize(path) / 1e6
+        print(f"☁️  Uploaded {key} ({size_mb:.1f} MB) in {time.monotonic() - started:.1f}s")
+        self.evict()
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Blocks until the queued uploads are done (e.g. before a batch process exits)."""
+        with self._lock:
+            futures = list(self._pending.values())
+        for future in futures:
+            future.result(timeout=timeout)
+
+    def resolve_url(self, video_url: Optional[str]) -> Optional[str]:
+        """
+        URL to hand to clients: the storage URL once the video is uploaded,
+        the local /static URL while it's still only on this node.
+        """
+        if not video_url or not self.remote or not video_url.startswith("/static/"):
+            return video_url
+        key = storage_key(video_url)
+        with self._lock:
+            uploading = key in self._pending
+        if uploading or (key not in self._uploaded and os.path.exists(url_to_path(video_url))):
+            return video_url
+        try:
+            return self.backend.url_for(key) or video_url
+        except Exception as e:
+            print(f"⚠️  No storage URL for {key}: {e}")
+            return video_url
+
+    def resolve_media(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """A copy of a message/preview with its video, poster and storyboard URLs resolved."""
+        resolved = dict(item)
+        for key in ("video_url", "poster_url"):
+            if key in resolved:
+                resolved[key] = self.resolve_url(resolved[key])
+        if resolved.get("storyboard_urls"):
+            resolved["storyboard_urls"] = [self.resolve_url(url) for url in resolved["storyboard_urls"]]
+        return resolved
+
+    def touch(self, path: str) -> None:
+        """Marks a local video as just served (for LRU eviction)."""
+        self._last_access[os.path.normpath(path)] = time.time()
+
+    def _cached_videos(self) -> List[Tuple[float, int, str]]:
+        # Final videos only: videos/<module>/<quality>/<file>.mp4 (not Manim's partial movie files)
+        videos = []
+        for path in Path(STATIC_DIR, "outputs", "videos").glob("*/*/*.mp4"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            last_used = max(stat.st_mtime, self._last_access.get(os.path.normpath(str(path)), 0.0))
+            videos.append((last_used, stat.st_size, str(path)))
+        return sorted(videos)
+
+    def evict(self) -> None:
+        """Deletes least recently used local videos that are safely in storage, down to LOCAL_CACHE_MAX_MB."""
+        if not self.remote or LOCAL_CACHE_MAX_MB <= 0:
+            return
+        videos = self._cached_videos()
+        total = sum(size for _, size, _ in videos)
+        limit = LOCAL_CACHE_MAX_MB * 1024 * 1024
+        for _, size, path in videos:
+            if total <= limit:
+                break
+            key = storage_key(path_to_url(path))
+            with self._lock:
+                if key in self._pending:
+                    continue
+                uploaded = key in self._uploaded
+            # Uploaded before a restart (or by another node) - check before deleting the only copy
+            if not uploaded and not self.backend.exists(key):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            with self._lock:
+                self._uploaded.add(key)
+            self._last_access.pop(os.path.normpath(path), None)
+            total -= size
+            print(f"🧹 Evicted local copy of {key}")
+
+
+def _load_backend():
+    if STORAGE_BACKEND == "s3":
+        return S3Storage()
+    if STORAGE_BACKEND == "supabase":
+        return SupabaseStorage()
+    return LocalStorage()
+
+
+video_store = VideoStore(_load_backend())
+
+# The background re-encode replaces the file and adds renditions - upload those too
+on_optimized(video_store.offload)
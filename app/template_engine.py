@@ -8,14 +8,18 @@ Flow:
 """
 
 import os
+import re
 import json
-import requests
-from typing import Optional, Dict, Any, Tuple
+import time
+import threading
+from typing import Callable, Optional, Dict, Any, List, Tuple
 from dotenv import load_dotenv
 
 from app.templates.function_graph import FunctionGraphTemplate
 from app.templates.algebraic_steps import AlgebraicStepsTemplate
 from app.templates.geometric_proof import GeometricProofTemplate
+from app.gemini_client import GeminiUnavailableError, gemini_client
+from app.llm_context import STALE_CONTEXT_STATUSES, build_payload, context_cache, llm_usage
 
 load_dotenv()
 
@@ -45,6 +49,54 @@ Respond with ONLY a JSON object in this format:
 If you're not confident (< 0.7), use "unknown" as the template name."""
 
 
+REFINEMENT_PROMPT = """The user previously generated a "{template}" animation with these parameters:
+
+{params}
+
+Now they sent this follow-up message in the same chat:
+
+USER PROMPT: "{prompt}"
+
+If the message asks to change the existing animation (e.g. change a color, add or remove a step,
+adjust a range), apply ONLY that change and keep every other value exactly as it is.
+If the message asks for a completely different animation, it is not a refinement.
+
+Respond with ONLY a JSON object in this format:
+{{
+    "is_refinement": true,
+    "params": {{ ...full updated parameters, same format as above... }}
+}}"""
+
+
+BATCH_CLASSIFICATION_PROMPT = """Classify each of the following {count} user prompts into ONE of these animation types:
+
+1. function_graph - Plotting one or more mathematical functions (e.g., "graph y=x^2", "plot sin and cos")
+2. algebraic_steps - Step-by-step equation solving (e.g., "solve 2x+4=10", "derive the quadratic formula")
+3. geometric_proof - Visual proof using shapes (e.g., "prove Pythagorean theorem", "show area of circle")
+
+USER PROMPTS:
+{prompts}
+
+Respond with ONLY a JSON array with exactly {count} objects, one per prompt, in the same order:
+[
+    {{"template": "template_name", "confidence": 0.95}}
+]
+
+If you're not confident (< 0.7) about a prompt, use "unknown" as its template name."""
+
+
+BATCH_EXTRACTION_PROMPT = """You will extract parameters for {count} separate user prompts.
+Apply the instructions below to EACH prompt independently.
+
+{instructions}
+
+USER PROMPTS:
+{prompts}
+
+Respond with ONLY a JSON array with exactly {count} objects, one per prompt, in the same order.
+Each object must follow the format described above."""
+
+
 def get_parameter_extraction_prompt(template_name: str, user_prompt: str) -> str:
     """Generate parameter extraction prompt based on template type."""
     
@@ -117,32 +169,54 @@ CRITICAL:
     return ""
 
 
-def call_gemini_api(prompt: str, model: str = "gemini-2.0-flash") -> Optional[Dict]:
-    """Call Gemini API and return parsed JSON response."""
+# Stands in for the user prompt in static instructions, which are sent as system context
+PROMPT_PLACEHOLDER = "<the user prompt given below>"
+
+
+def user_prompt_part(user_prompt: str) -> str:
+    return f'USER PROMPT: "{user_prompt}"'
+
+
+def call_gemini_api(prompt: str, model: str = "gemini-2.0-flash", system: Optional[str] = None,
+                    label: str = "json") -> Optional[Dict]:
+    """
+    Call Gemini API and return parsed JSON response.
+    
+    Args:
+        system: Static instructions, sent as (cached) system context
+            instead of being repeated in the prompt
+        label: Name the call's token usage is recorded under
+    
+    When the call fails or Gemini is unavailable (circuit open, rate
+    limited), the last successful result for the same request is
+    returned if there is one.
+    """
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
         print("❌ GEMINI_API_KEY not set")
         return None
     
-    payload = {
-        "contents": [{
-            "parts": [{"text": prompt}]
-        }]
-    }
+    contents = [{"role": "user", "parts": [{"text": prompt}]}]
+    payload, cached_name = build_payload(model, contents, system)
+    path = f"models/{model}:generateContent"
+    result_key = gemini_client.results.key(model, system, prompt)
+    started = time.monotonic()
     
     try:
-        response = requests.post(
-            f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}",
-            headers={"Content-Type": "application/json"},
-            json=payload,
-            timeout=30
-        )
+        response = gemini_client.post(path, payload, timeout=30)
+        if response.status_code in STALE_CONTEXT_STATUSES and cached_name:
+            # Cached context expired or was evicted - resend it inline
+            context_cache.invalidate(model, system)
+            payload, _ = build_payload(model, contents, system, use_cache=False)
+            response = gemini_client.post(path, payload, timeout=30)
         
         if response.status_code != 200:
             print(f"API error: {response.status_code}")
-            return None
+            llm_usage.record(label, latency=time.monotonic() - started, success=False)
+            return _cached_result(result_key, label)
         
         result = response.json()
+        usage = result.get("usageMetadata")
         text = result["candidates"][0]["content"]["parts"][0]["text"]
         
         # Extract JSON from response (remove markdown if present)
@@ -155,24 +229,98 @@ def call_gemini_api(prompt: str, model: str = "gemini-2.0-flash") -> Optional[Di
             text = text[:-3]
         text = text.strip()
         
-        return json.loads(text)
+        parsed = json.loads(text)
+        llm_usage.record(label, usage=usage, latency=time.monotonic() - started, success=True)
+        gemini_client.results.put(result_key, parsed)
+        return parsed
+    
+    except GeminiUnavailableError as e:
+        # Nothing was sent - not a failed call
+        print(f"⛔ {e}")
+        return _cached_result(result_key, label)
     
     except Exception as e:
         print(f"Error calling Gemini: {e}")
+        llm_usage.record(label, latency=time.monotonic() - started, success=False)
+        return _cached_result(result_key, label)
+
+
+def _cached_result(result_key: str, label: str) -> Optional[Any]:
+    cached = gemini_client.results.get(result_key)
+    if cached is not None:
+        print(f"♻️  Using the cached result of an identical {label} call")
+    return cached
+
+
+# Local routing while Gemini is unavailable: explicit function plots only
+LOCAL_ROUTING_CONFIDENCE = 0.75
+LOCAL_COLORS = ["BLUE", "RED", "GREEN", "YELLOW", "ORANGE", "PURPLE"]
+# "y = x^2", "f(x) = sin(x)" up to a separator word or punctuation
+_LOCAL_EQUATION = re.compile(
+    r"\b(?:y|[fgh]\s*\(\s*x\s*\))\s*=\s*(.+?)(?=\s*(?:[,;]|\band\b|\bfrom\b|\bfor\b|\bover\b|\bon\b"
+    r"|\bwith\b|\bbetween\b|\bin\b|$))",
+    re.IGNORECASE,
+)
+# "plot sin and cos" - bare function names
+_LOCAL_FUNCTION_NAME = re.compile(r"\b(sin|cos|tan|exp|sqrt|sinh|cosh|tanh|ln|log)\b(?!\s*\()", re.IGNORECASE)
+_LOCAL_RANGE = re.compile(r"\bfrom\s+(-?\d+(?:\.\d+)?)\s+to\s+(-?\d+(?:\.\d+)?)", re.IGNORECASE)
+_PLOT_WORDS = ("graph", "plot", "draw", "curve", "function")
+
+
+def extract_parameters_locally(user_prompt: str) -> Optional[Dict[str, Any]]:
+    """
+    function_graph params read straight from the prompt, for prompts that
+    spell their functions out ("plot y = x^2 and y = 2x from -3 to 3").
+    The template's validation normalizes the expressions and fits y_range.
+    
+    Returns:
+        Params, or None when no function could be read from the prompt
+    """
+    expressions = [m.group(1).strip().rstrip(".") for m in _LOCAL_EQUATION.finditer(user_prompt)]
+    if not expressions and any(word in user_prompt.lower() for word in _PLOT_WORDS):
+        expressions = [f"{name.lower()}(x)" for name in _LOCAL_FUNCTION_NAME.findall(user_prompt)]
+    if not expressions:
         return None
+    
+    params: Dict[str, Any] = {
+        "title": "Function Graph",
+        "functions": [
+            {"expr": expr.replace("^", "**"), "label": f"y = {expr}", "color": LOCAL_COLORS[i % len(LOCAL_COLORS)]}
+            for i, expr in enumerate(expressions)
+        ],
+    }
+    x_range = _LOCAL_RANGE.search(user_prompt)
+    if x_range:
+        start, stop = float(x_range.group(1)), float(x_range.group(2))
+        if stop > start:
+            params["x_range"] = [start, stop, max(1, round((stop - start) / 10))]
+    return params
+
+
+def classify_prompt_locally(user_prompt: str) -> Tuple[Optional[str], float]:
+    """Template for a prompt without asking Gemini (function plots only)."""
+    if extract_parameters_locally(user_prompt) is not None:
+        return "function_graph", LOCAL_ROUTING_CONFIDENCE
+    return None, 0.0
 
 
 def classify_prompt(user_prompt: str) -> Tuple[Optional[str], float]:
     """
     Classify user prompt to determine which template to use.
     
+    While Gemini is unavailable, prompts without a cached classification
+    are routed locally.
+    
     Returns:
         (template_name, confidence)
     """
-    prompt = CLASSIFICATION_PROMPT.format(prompt=user_prompt)
-    result = call_gemini_api(prompt)
+    system = CLASSIFICATION_PROMPT.format(prompt=PROMPT_PLACEHOLDER)
+    result = call_gemini_api(user_prompt_part(user_prompt), system=system, label="classify")
     
     if not result:
+        if gemini_client.degraded:
+            print("🧭 Gemini unavailable, routing the prompt locally")
+            return classify_prompt_locally(user_prompt)
         return None, 0.0
     
     template_name = result.get("template", "unknown")
@@ -191,55 +339,202 @@ def extract_parameters(template_name: str, user_prompt: str) -> Optional[Dict[st
     Returns:
         Dictionary of parameters or None if extraction failed
     """
-    prompt = get_parameter_extraction_prompt(template_name, user_prompt)
-    if not prompt:
+    system = get_parameter_extraction_prompt(template_name, PROMPT_PLACEHOLDER)
+    if not system:
         return None
     
-    result = call_gemini_api(prompt)
+    result = call_gemini_api(user_prompt_part(user_prompt), system=system, label=f"extract:{template_name}")
+    if result is None and template_name == "function_graph" and gemini_client.degraded:
+        result = extract_parameters_locally(user_prompt)
     print(f"DEBUG: Extracted parameters for {template_name}: {json.dumps(result, indent=2)}")
     return result
 
 
-def generate_from_template(user_prompt: str) -> Tuple[Optional[str], str]:
+def classify_prompts(user_prompts: List[str]) -> List[Tuple[Optional[str], float]]:
     """
-    Main entry point: classify prompt, extract parameters, generate code.
+    Classify several prompts with a single LLM call.
+    
+    Falls back to one call per prompt if the batched response
+    is missing or doesn't line up with the input.
+    
+    Returns:
+        List of (template_name, confidence), one per prompt
+    """
+    if not user_prompts:
+        return []
+    
+    numbered = "\n".join(f"{i+1}. \"{p}\"" for i, p in enumerate(user_prompts))
+    prompt = BATCH_CLASSIFICATION_PROMPT.format(count=len(user_prompts), prompts=numbered)
+    result = call_gemini_api(prompt, label="classify_batch")
+    
+    if not isinstance(result, list) or len(result) != len(user_prompts):
+        print("⚠️  Batched classification failed, classifying one by one")
+        return [classify_prompt(p) for p in user_prompts]
+    
+    classifications = []
+    for item in result:
+        item = item if isinstance(item, dict) else {}
+        template_name = item.get("template", "unknown")
+        confidence = item.get("confidence", 0.0)
+        if template_name == "unknown" or confidence < 0.7:
+            classifications.append((None, confidence))
+        else:
+            classifications.append((template_name, confidence))
+    
+    return classifications
+
+
+def extract_parameters_batch(template_name: str, user_prompts: List[str]) -> List[Optional[Dict[str, Any]]]:
+    """
+    Extract parameters for several prompts of the same template in one LLM call.
+    
+    Returns:
+        List of parameter dicts (or None), one per prompt
+    """
+    if not user_prompts:
+        return []
+    
+    instructions = get_parameter_extraction_prompt(template_name, "<each of the prompts listed below>")
+    if not instructions:
+        return [None] * len(user_prompts)
+    
+    numbered = "\n".join(f"{i+1}. \"{p}\"" for i, p in enumerate(user_prompts))
+    prompt = BATCH_EXTRACTION_PROMPT.format(
+        count=len(user_prompts),
+        instructions=instructions,
+        prompts=numbered
+    )
+    result = call_gemini_api(prompt, label=f"extract_batch:{template_name}")
+    
+    if not isinstance(result, list) or len(result) != len(user_prompts):
+        print(f"⚠️  Batched extraction failed for {template_name}, extracting one by one")
+        return [extract_parameters(template_name, p) for p in user_prompts]
+    
+    return [item if isinstance(item, dict) else None for item in result]
+
+
+def validate_template_params(template_name: str, params: Optional[Dict[str, Any]]) -> Tuple[bool, str]:
+    """
+    Check that a template exists and the extracted parameters fit it.
+    
+    Returns:
+        (is_valid, error_message)
+    """
+    template_class = TEMPLATE_REGISTRY.get(template_name)
+    if not template_class:
+        return False, f"Template '{template_name}' not found in registry"
+    
+    if not params:
+        return False, "Failed to extract parameters from prompt"
+    
+    return template_class.validate_params(params)
+
+
+def generate_from_params(template_name: str, params: Optional[Dict[str, Any]]) -> Tuple[Optional[str], str]:
+    """
+    Validate already-extracted parameters and fill the template with them.
     
     Returns:
         (generated_code, status_message)
     """
+    is_valid, error_msg = validate_template_params(template_name, params)
+    if not is_valid:
+        return None, f"Parameter validation failed: {error_msg}"
+    
+    try:
+        return TEMPLATE_REGISTRY[template_name].generate_code(params), "success"
+    except Exception as e:
+        return None, f"Error generating code: {str(e)}"
+
+
+def refine_parameters(template_name: str, previous_params: Dict[str, Any], user_prompt: str) -> Optional[Dict[str, Any]]:
+    """
+    Apply a follow-up request ("make the second curve red") to the
+    parameters of the previous turn in the same chat.
+    
+    Returns:
+        Full updated dictionary of parameters or None if refinement failed
+    """
+    if template_name not in TEMPLATE_REGISTRY:
+        return None
+    
+    prompt = REFINEMENT_PROMPT.format(
+        template=template_name,
+        params=json.dumps(previous_params, indent=2),
+        prompt=user_prompt
+    )
+    result = call_gemini_api(prompt, label=f"refine:{template_name}")
+    
+    if not isinstance(result, dict):
+        return None
+    if result.get("is_refinement") is False:
+        return None
+    
+    params = result.get("params")
+    return params if isinstance(params, dict) else None
+
+
+def generate_template_script(
+    user_prompt: str,
+    on_classified: Optional[Callable[[Optional[str], float], None]] = None,
+    cancel_event: Optional[threading.Event] = None,
+) -> Tuple[Optional[str], str, Optional[str], Optional[Dict[str, Any]]]:
+    """
+    Classify prompt, extract parameters, generate code - keeping the
+    template name and parameters that produced the code.
+    
+    Args:
+        on_classified: Called with (template_name, confidence) as soon as
+            classification is known, e.g. to start a hedged raw generation
+        cancel_event: When set, the remaining steps are skipped
+    
+    Returns:
+        (generated_code, status_message, template_name, params)
+    """
     # Step 1: Classify
     print(f"\n📋 Classifying prompt...")
     template_name, confidence = classify_prompt(user_prompt)
     
+    if on_classified:
+        on_classified(template_name, confidence)
+    if cancel_event is not None and cancel_event.is_set():
+        return None, "Cancelled", template_name, None
+    
     if not template_name:
-        return None, "Could not classify prompt into a known template"
+        return None, "Could not classify prompt into a known template", None, None
     
     print(f"✅ Classified as: {template_name} (confidence: {confidence:.2f})")
     
     # Step 2: Get template class
     template_class = TEMPLATE_REGISTRY.get(template_name)
     if not template_class:
-        return None, f"Template '{template_name}' not found in registry"
+        return None, f"Template '{template_name}' not found in registry", None, None
     
     # Step 3: Extract parameters
     print(f"🔍 Extracting parameters...")
     params = extract_parameters(template_name, user_prompt)
     
+    if cancel_event is not None and cancel_event.is_set():
+        return None, "Cancelled", template_name, None
     if not params:
-        return None, "Failed to extract parameters from prompt"
+        return None, "Failed to extract parameters from prompt", template_name, None
     
     print(f"✅ Extracted parameters: {json.dumps(params, indent=2)}")
     
-    # Step 4: Validate parameters
-    is_valid, error_msg = template_class.validate_params(params)
-    if not is_valid:
-        return None, f"Parameter validation failed: {error_msg}"
-    
-    # Step 5: Generate code
+    # Step 4: Validate parameters and generate code
     print(f"🎬 Generating code from template...")
-    try:
-        code = template_class.generate_code(params)
+    code, status = generate_from_params(template_name, params)
+    if code:
         print(f"✅ Code generated successfully")
-        return code, "success"
-    except Exception as e:
-        return None, f"Error generating code: {str(e)}"
+    return code, status, template_name, params
+
+
+def generate_from_template(user_prompt: str) -> Tuple[Optional[str], str]:
+    """
+    Main entry point: classify prompt, extract parameters, generate code.
+    
+    Returns:
+        (generated_code, status_message)
+    """
+    code, status, _, _ = generate_template_script(user_prompt)
+    return code, status
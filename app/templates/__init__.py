@@ -34,6 +34,23 @@ class AnimationTemplate:
     
     metadata: TemplateMetadata = None
     
+    # Name of the matching Scene class in app.templates.scenes
+    scene_name: str = None
+    
+    @classmethod
+    def get_scene_class(cls):
+        """
+        Return the importable Scene class that renders this template
+        directly from params (no generated source).
+        
+        Imported lazily so only render processes pay for loading Manim.
+        """
+        if not cls.scene_name:
+            raise NotImplementedError(f"{cls.__name__} has no scene class")
+        
+        from app.templates import scenes
+        return getattr(scenes, cls.scene_name)
+    
     @classmethod
     def generate_code(cls, params: Dict[str, Any]) -> str:
         """
@@ -6,6 +6,7 @@ Layout is pre-designed:
 - Each step centered vertically
 - Smooth transitions between steps
 - Annotations on the side if needed
+- One Manim section per step, so long derivations can render in parallel
 """
 
 from app.templates import AnimationTemplate, TemplateMetadata
@@ -21,6 +22,8 @@ class AlgebraicStepsTemplate(AnimationTemplate):
         optional_params=["title", "show_annotations"]
     )
     
+    scene_name = "AlgebraicStepsScene"
+    
     @classmethod
     def generate_code(cls, params):
         """Generate Manim code for algebraic steps."""
@@ -40,13 +43,14 @@ class AlgebraicStepsTemplate(AnimationTemplate):
                 # First step - just display
                 step_lines.append(f'''
         # Step {i+1}
-        eq{i} = MathTex(r"{equation}").scale(1.2)
+        self.next_section("step_{i+1}")
+        eq{i} = MathTex({equation!r}).scale(1.2)
         self.play(Write(eq{i}))
         self.wait(1)''')
                 
                 if show_annotations and annotation:
                     step_lines.append(f'''
-        note{i} = Text("{annotation}").scale(0.5).to_edge(DOWN, buff=0.5)
+        note{i} = Text({annotation!r}).scale(0.5).to_edge(DOWN, buff=0.5)
         self.play(FadeIn(note{i}))
         self.wait(1)
         self.play(FadeOut(note{i}))''')
@@ -54,13 +58,14 @@ class AlgebraicStepsTemplate(AnimationTemplate):
                 # Transform from previous step
                 step_lines.append(f'''
         # Step {i+1}
-        eq{i} = MathTex(r"{equation}").scale(1.2)
+        self.next_section("step_{i+1}")
+        eq{i} = MathTex({equation!r}).scale(1.2)
         self.play(Transform(eq0, eq{i}))
         self.wait(1)''')
                 
                 if show_annotations and annotation:
                     step_lines.append(f'''
-        note{i} = Text("{annotation}").scale(0.5).to_edge(DOWN, buff=0.5)
+        note{i} = Text({annotation!r}).scale(0.5).to_edge(DOWN, buff=0.5)
         self.play(FadeIn(note{i}))
         self.wait(1)
         self.play(FadeOut(note{i}))''')
@@ -69,6 +74,7 @@ class AlgebraicStepsTemplate(AnimationTemplate):
         final_step = len(steps) - 1
         step_lines.append(f'''
         # Highlight final answer
+        self.next_section("final_answer")
         box = SurroundingRectangle(eq0, color=YELLOW, buff=0.2, stroke_width=4)
         self.play(Create(box))
         self.wait(2)''')
@@ -78,7 +84,7 @@ class AlgebraicStepsTemplate(AnimationTemplate):
 class GeneratedScene(Scene):
     def construct(self):
         # Title - fixed at top
-        title = Text("{title}").scale(0.8).to_edge(UP, buff=0.3)
+        title = Text({title!r}).scale(0.8).to_edge(UP, buff=0.3)
         self.play(Write(title))
         self.wait(0.5)
         
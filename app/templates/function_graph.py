@@ -6,11 +6,351 @@ Layout is pre-designed to avoid overlaps:
 - Axes centered and scaled
 - Function labels positioned above axes
 - Legend in top-right corner
+
+Params are checked numerically before any render: each expression is
+parsed against a whitelist, evaluated over the x-range with NumPy in one
+vectorized pass, and the params are fixed up in place (normalized
+expressions, auto-fitted y_range, discontinuity points) or rejected.
 """
 
+import ast
+import math
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
 from app.templates import AnimationTemplate, TemplateMetadata
 
 
+# Points per function in the pre-render evaluation
+SAMPLES = 2001
+
+# A step this many times larger than both neighbouring steps is a jump
+JUMP_FACTOR = 4.0
+
+# Bisection rounds that pin each jump down to ~1e-9 of the sample spacing
+JUMP_REFINE_STEPS = 30
+
+# More jumps than this and the curve is noise, not a plottable function
+MAX_DISCONTINUITIES = 20
+
+# Interior gaps longer than this fraction of the x-range can't be bridged
+MAX_GAP_FRACTION = 0.02
+
+# Axis bounds beyond this magnitude can't be labelled or drawn sensibly
+MAX_MAGNITUDE = 1e8
+
+# Function names the LLM may use → NumPy ufunc names
+FUNCTIONS = {
+    "sin": "sin", "cos": "cos", "tan": "tan",
+    "asin": "arcsin", "acos": "arccos", "atan": "arctan",
+    "arcsin": "arcsin", "arccos": "arccos", "arctan": "arctan",
+    "sinh": "sinh", "cosh": "cosh", "tanh": "tanh",
+    "exp": "exp", "log": "log", "ln": "log", "log10": "log10", "log2": "log2",
+    "sqrt": "sqrt", "abs": "abs", "fabs": "abs",
+    "floor": "floor", "ceil": "ceil", "sign": "sign",
+}
+
+CONSTANTS = {"pi": "pi", "e": "e", "PI": "pi", "E": "e"}
+
+_ALLOWED_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd, ast.Mod, ast.FloorDiv)
+
+# "2x" → "2*x", "3(x+1)" → "3*(x+1)", ")(" → ")*("
+_IMPLICIT_MULTIPLY = re.compile(r"(?<![\w.])(\d+(?:\.\d+)?)\s*(?=[a-zA-Z(])(?!e[-+]?\d)|(\))\s*(?=[\w(])")
+
+
+class _ExpressionRewriter(ast.NodeTransformer):
+    """Checks an expression against the whitelist and rewrites names to np.*"""
+
+    def visit_BinOp(self, node):
+        if not isinstance(node.op, _ALLOWED_OPERATORS):
+            raise ValueError(f"operator {type(node.op).__name__} not allowed")
+        self.generic_visit(node)
+        return node
+
+    visit_UnaryOp = visit_BinOp
+
+    def visit_Constant(self, node):
+        if not isinstance(node.value, (int, float)) or isinstance(node.value, bool):
+            raise ValueError(f"constant {node.value!r} not allowed")
+        # Python ints have unbounded size (9**9**9 would take forever), floats overflow right away
+        try:
+            return ast.Constant(value=float(node.value))
+        except OverflowError:
+            raise ValueError("constant too large") from None
+
+    def visit_Name(self, node):
+        if node.id == "x":
+            return node
+        if node.id in CONSTANTS:
+            return ast.Attribute(value=ast.Name(id="np", ctx=ast.Load()), attr=CONSTANTS[node.id], ctx=ast.Load())
+        raise ValueError(f"unknown name '{node.id}'")
+
+    def visit_Call(self, node):
+        func = node.func
+        # sin(x), math.sin(x) and np.sin(x) all become np.sin(x), which works on arrays
+        if isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name) and func.value.id in ("np", "numpy", "math"):
+            name = func.attr
+        elif isinstance(func, ast.Name):
+            name = func.id
+        else:
+            raise ValueError("only plain function calls are allowed")
+
+        if name not in FUNCTIONS:
+            raise ValueError(f"unknown function '{name}'")
+        if node.keywords or len(node.args) != 1:
+            raise ValueError(f"{name}() takes exactly one argument")
+
+        node.func = ast.Attribute(value=ast.Name(id="np", ctx=ast.Load()), attr=FUNCTIONS[name], ctx=ast.Load())
+        node.args = [self.visit(arg) for arg in node.args]
+        return node
+
+    def visit_Attribute(self, node):
+        # np.pi / math.e
+        if isinstance(node.value, ast.Name) and node.value.id in ("np", "numpy", "math") and node.attr in CONSTANTS:
+            return ast.Attribute(value=ast.Name(id="np", ctx=ast.Load()), attr=CONSTANTS[node.attr], ctx=ast.Load())
+        raise ValueError("attribute access not allowed")
+
+    def generic_visit(self, node):
+        if not isinstance(node, (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Load) + _ALLOWED_OPERATORS):
+            raise ValueError(f"{type(node).__name__} not allowed")
+        return super().generic_visit(node)
+
+
+def normalize_expression(expr: str) -> str:
+    """
+    Parses an LLM-written expression of x into safe, vectorizable Python.
+
+    e.g. "2x^2 + sin(x)" → "2.0 * x ** 2.0 + np.sin(x)"
+
+    Raises:
+        ValueError if the expression is invalid or uses anything outside
+        arithmetic, x, pi/e and the FUNCTIONS whitelist
+    """
+    text = str(expr).strip()
+    if not text:
+        raise ValueError("empty expression")
+    # "x^2" means power, not XOR (and has to be swapped before parsing, XOR binds looser)
+    text = text.replace("^", "**")
+    text = _IMPLICIT_MULTIPLY.sub(lambda m: (m.group(1) or m.group(2)) + "*", text)
+
+    try:
+        tree = ast.parse(text, mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"invalid syntax in '{expr}': {e.msg}") from None
+
+    tree = ast.fix_missing_locations(_ExpressionRewriter().visit(tree))
+    return ast.unparse(tree)
+
+
+def evaluate_expression(expr: str, xs: np.ndarray) -> np.ndarray:
+    """Evaluates a normalized expression over all xs at once (NaN/inf where undefined)."""
+    code = compile(expr, "<expr>", "eval")
+    with np.errstate(all="ignore"):
+        try:
+            ys = eval(code, {"__builtins__": {}, "np": np}, {"x": xs})
+        except OverflowError:
+            # Constant parts are computed with Python floats, which raise instead of giving inf
+            raise ValueError("expression overflows") from None
+    ys = np.asarray(ys)
+    if np.iscomplexobj(ys):
+        raise ValueError("expression has complex values")
+    # Constant expressions evaluate to a scalar
+    return np.broadcast_to(ys.astype(float), xs.shape)
+
+
+def find_discontinuities(expr: str, xs: np.ndarray, ys: np.ndarray) -> List[float]:
+    """
+    x positions of jumps (tan, 1/x, floor) and isolated undefined points.
+
+    A jump is a step that either reverses direction against both neighbouring
+    steps while being larger than them (poles), or is much larger than both
+    (steps). Steep but continuous curves like exp(x) match neither. Each jump
+    is then pinned down by bisection, all of them at once.
+    """
+    finite = np.isfinite(ys)
+    points = []
+
+    # Isolated undefined samples between defined ones (e.g. 1/x sampled at 0)
+    undefined = np.flatnonzero(~finite[1:-1] & finite[:-2] & finite[2:]) + 1
+    points.extend(xs[undefined])
+
+    dy = np.diff(ys)
+    dy[~(finite[:-1] & finite[1:])] = 0.0
+    before = np.concatenate(([0.0], dy[:-1]))
+    after = np.concatenate((dy[1:], [0.0]))
+    size = np.abs(dy)
+    neighbours = np.maximum(np.abs(before), np.abs(after))
+    scale = np.max(np.abs(ys[finite])) if finite.any() else 0.0
+
+    reverses = (np.sign(dy) * np.sign(before) < 0) & (np.sign(dy) * np.sign(after) < 0) & (size > neighbours)
+    steps = size > JUMP_FACTOR * neighbours
+    jumps = np.flatnonzero((reverses | steps) & (size > 1e-9 * max(scale, 1.0)))
+
+    if len(jumps):
+        low, high = xs[jumps], xs[jumps + 1]
+        y_low, y_high = ys[jumps], ys[jumps + 1]
+        for _ in range(JUMP_REFINE_STEPS):
+            mid = (low + high) / 2
+            y_mid = evaluate_expression(expr, mid)
+            # The jump is in whichever half changes more
+            left = ~np.isfinite(y_mid) | (np.abs(y_mid - y_low) > np.abs(y_high - y_mid))
+            high, y_high = np.where(left, mid, high), np.where(left, y_mid, y_high)
+            low, y_low = np.where(left, low, mid), np.where(left, y_low, y_mid)
+        points.extend((low + high) / 2)
+
+    # A jump right at the range ends is just where the curve stops
+    margin = 1e-6 * (xs[-1] - xs[0])
+    return sorted(set(
+        round(float(p), 6) + 0.0 for p in points if xs[0] + margin < p < xs[-1] - margin
+    ))
+
+
+def _undefined_runs(finite: np.ndarray) -> List[Tuple[int, int]]:
+    """[start, end) index runs where the function is undefined."""
+    edges = np.flatnonzero(np.diff(np.concatenate(([1], finite.astype(int), [1]))))
+    return list(zip(edges[::2], edges[1::2]))
+
+
+def nice_step(span: float, ticks: int = 8) -> float:
+    """Tick step of 1, 2 or 5 × 10^k giving about `ticks` ticks over span."""
+    raw = span / ticks
+    magnitude = 10 ** math.floor(math.log10(raw))
+    for multiple in (1, 2, 5, 10):
+        if multiple * magnitude >= raw:
+            return float(multiple * magnitude)
+    return float(10 * magnitude)
+
+
+def fit_range(values: np.ndarray) -> List[float]:
+    """[min, max, step] covering values with a little padding, on tick boundaries."""
+    low, high = float(np.min(values)), float(np.max(values))
+    if high - low < 1e-9:
+        low, high = low - 1, high + 1
+    pad = 0.1 * (high - low)
+    step = nice_step(high - low + 2 * pad)
+    low = math.floor((low - pad) / step) * step
+    high = math.ceil((high + pad) / step) * step
+    return [_clean(low), _clean(high), _clean(step)]
+
+
+def _clean(value: float):
+    """
+    Rounds float noise off tick values (0.30000000000000004 → 0.3, 2.0 → 2)
+    and returns a builtin int/float - NumPy scalars would end up in the
+    generated script as np.float64(...).
+    """
+    value = round(float(value), 10)
+    return int(value) if value == int(value) else value
+
+
+def _parse_range(value: Any, name: str) -> Optional[List[float]]:
+    """Validates an [min, max] or [min, max, step] range, adding a step if missing."""
+    if value is None:
+        return None
+    if not isinstance(value, (list, tuple)) or len(value) not in (2, 3):
+        raise ValueError(f"{name} must be [min, max] or [min, max, step]")
+    try:
+        numbers = [float(v) for v in value]
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must contain numbers") from None
+    if not all(math.isfinite(v) for v in numbers) or numbers[0] >= numbers[1]:
+        raise ValueError(f"{name} must have min < max")
+    if max(abs(numbers[0]), abs(numbers[1])) > MAX_MAGNITUDE:
+        raise ValueError(f"{name} must stay within ±{MAX_MAGNITUDE:g}")
+    if len(numbers) == 2 or numbers[2] <= 0:
+        numbers = numbers[:2] + [nice_step(numbers[1] - numbers[0])]
+    return [_clean(v) for v in numbers]
+
+
+def prevalidate_functions(params: Dict[str, Any]) -> Tuple[bool, str]:
+    """
+    Numerically checks and fixes function graph params in place.
+
+    - normalizes every expr (x^2 → x ** 2, sin → np.sin), rejects unsafe ones
+    - evaluates all of them over x_range in one vectorized pass each
+    - restricts a function to the part of x_range where it is defined
+    - records jump points as "discontinuities" so Manim doesn't draw
+      vertical lines across them
+    - auto-fits y_range if the given one is missing or doesn't show the curves
+    - rejects ranges and curves beyond ±MAX_MAGNITUDE
+
+    Returns:
+        (is_valid, error_message)
+    """
+    functions = params.get("functions")
+    if not isinstance(functions, list) or not functions:
+        return False, "functions must be a non-empty list"
+
+    try:
+        x_range = _parse_range(params.get("x_range", [-5, 5, 1]), "x_range")
+    except ValueError as e:
+        return False, str(e)
+    try:
+        y_range = _parse_range(params.get("y_range"), "y_range")
+    except ValueError:
+        # Only a hint - fitted from the curves below instead
+        y_range = None
+
+    xs = np.linspace(x_range[0], x_range[1], SAMPLES)
+    span = x_range[1] - x_range[0]
+    visible = []
+
+    for i, func in enumerate(functions):
+        if not isinstance(func, dict):
+            return False, f"functions[{i}] must be an object"
+        try:
+            func["expr"] = normalize_expression(func.get("expr", "x"))
+            ys = evaluate_expression(func["expr"], xs)
+        except (ValueError, ArithmeticError, TypeError) as e:
+            return False, f"functions[{i}]: {e}"
+
+        finite = np.isfinite(ys)
+        if finite.sum() < 2:
+            return False, f"functions[{i}] ('{func['expr']}') is undefined over x_range {x_range[:2]}"
+
+        # Trim undefined ends (sqrt(x) on [-5, 5] plots from 0); interior gaps must be short
+        defined = np.flatnonzero(finite)
+        first, last = defined[0], defined[-1]
+        for start, end in _undefined_runs(finite[first:last + 1]):
+            if (end - start) / SAMPLES > MAX_GAP_FRACTION:
+                return False, f"functions[{i}] ('{func['expr']}') is undefined on part of x_range, narrow x_range"
+        if first > 0 or last < SAMPLES - 1:
+            func["x_range"] = [_clean(round(xs[first], 6)), _clean(round(xs[last], 6))]
+
+        discontinuities = find_discontinuities(func["expr"], xs[first:last + 1], ys[first:last + 1])
+        if len(discontinuities) > MAX_DISCONTINUITIES:
+            return False, f"functions[{i}] ('{func['expr']}') has too many discontinuities to plot"
+        if discontinuities:
+            func["discontinuities"] = discontinuities
+        else:
+            func.pop("discontinuities", None)
+
+        values = ys[finite]
+        low, high = np.percentile(values, [5, 95])
+        if discontinuities and np.ptp(values) > 4 * (high - low):
+            # Poles would stretch the range towards infinity - fit the bulk of the curve
+            values = values[(values >= low) & (values <= high)]
+        if np.max(np.abs(values)) > MAX_MAGNITUDE:
+            return False, f"functions[{i}] ('{func['expr']}') grows beyond ±{MAX_MAGNITUDE:g} over x_range, narrow x_range"
+        visible.append(values)
+
+    values = np.concatenate(visible)
+    if y_range is not None:
+        inside = np.mean((values >= y_range[0]) & (values <= y_range[1]))
+        used = (np.max(values) - np.min(values)) / (y_range[1] - y_range[0])
+        # Keep the LLM's range if it shows the curves without squashing them flat
+        if inside < 0.9 or used < 0.2:
+            y_range = None
+    if y_range is None:
+        y_range = fit_range(values)
+
+    params["x_range"] = x_range
+    params["y_range"] = y_range
+    return True, ""
+
+
 class FunctionGraphTemplate(AnimationTemplate):
     """Template for plotting mathematical functions."""
     
@@ -21,6 +361,16 @@ class FunctionGraphTemplate(AnimationTemplate):
         optional_params=["title", "x_range", "y_range", "show_grid"]
     )
     
+    scene_name = "FunctionGraphScene"
+    
+    @classmethod
+    def validate_params(cls, params):
+        """Required params, then the numeric pre-check (which fixes params in place)."""
+        is_valid, error_msg = super().validate_params(params)
+        if not is_valid:
+            return is_valid, error_msg
+        return prevalidate_functions(params)
+    
     @classmethod
     def generate_code(cls, params):
         """Generate Manim code for function graph."""
@@ -40,11 +390,17 @@ class FunctionGraphTemplate(AnimationTemplate):
             label = func.get("label", f"f{i+1}(x)")
             color = func.get("color", ["BLUE", "RED", "GREEN", "YELLOW", "PURPLE"][i % 5])
             
+            plot_options = ""
+            if func.get("x_range"):
+                plot_options += f", x_range={func['x_range']}"
+            if func.get("discontinuities"):
+                plot_options += f", discontinuities={func['discontinuities']}"
+            
             function_lines.append(
-                f"        graph{i} = axes.plot(lambda x: {expr}, color={color}, stroke_width=4)"
+                f"        graph{i} = axes.plot(lambda x: {expr}{plot_options}, color={color}, stroke_width=4)"
             )
             label_lines.append(
-                f'        label{i} = MathTex(r"{label}").scale(0.6).set_color({color})'
+                f'        label{i} = MathTex({label!r}).scale(0.6).set_color({color})'
             )
         
         # Build legend
@@ -56,7 +412,7 @@ class FunctionGraphTemplate(AnimationTemplate):
 class GeneratedScene(Scene):
     def construct(self):
         # Title - fixed at top
-        title = Text("{title}").scale(0.8).to_edge(UP, buff=0.3)
+        title = Text({title!r}).scale(0.8).to_edge(UP, buff=0.3)
         self.play(Write(title))
         self.wait(0.5)
         
@@ -6,6 +6,7 @@ Layout is pre-designed:
 - Main diagram centered
 - Labels positioned relative to shapes (no overlaps)
 - Step-by-step reveal of proof elements
+- One Manim section per proof step, so long proofs can render in parallel
 """
 
 from app.templates import AnimationTemplate, TemplateMetadata
@@ -21,6 +22,8 @@ class GeometricProofTemplate(AnimationTemplate):
         optional_params=["proof_steps"]
     )
     
+    scene_name = "GeometricProofScene"
+    
     @classmethod
     def generate_code(cls, params):
         """Generate Manim code for geometric proof."""
@@ -68,7 +71,7 @@ class GeometricProofTemplate(AnimationTemplate):
             # Add label
             if label:
                 label_lines.append(
-                    f'        label{i} = MathTex(r"{label}").scale(0.7).next_to(shape{i}, DOWN, buff=0.3)'
+                    f'        label{i} = MathTex({label!r}).scale(0.7).next_to(shape{i}, DOWN, buff=0.3)'
                 )
         
         # Build shapes group
@@ -91,7 +94,8 @@ class GeometricProofTemplate(AnimationTemplate):
             step_text = step.get("text", "")
             if step_text:
                 steps_code.append(f'''
-        step{i} = Text("{step_text}").scale(0.6).to_edge(DOWN, buff=0.5)
+        self.next_section("proof_step_{i+1}")
+        step{i} = Text({step_text!r}).scale(0.6).to_edge(DOWN, buff=0.5)
         self.play(Write(step{i}))
         self.wait(2)
         self.play(FadeOut(step{i}))''')
@@ -104,7 +108,7 @@ class GeometricProofTemplate(AnimationTemplate):
 class GeneratedScene(Scene):
     def construct(self):
         # Theorem statement - fixed at top
-        theorem = MathTex(r"{theorem}").scale(0.9).to_edge(UP, buff=0.3)
+        theorem = MathTex({theorem!r}).scale(0.9).to_edge(UP, buff=0.3)
         self.play(Write(theorem))
         self.wait(1)
         
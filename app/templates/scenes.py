@@ -0,0 +1,247 @@
+"""
+Parametric Scene classes for the templates.
+
+Each class mirrors the code its template generates, but takes the
+validated params directly instead of going through generated source.
+A warm render process can instantiate them without codegen, file I/O
+or module compilation, and labels/annotations are passed as plain
+strings so they need no escaping.
+
+Usage:
+    scene = FunctionGraphScene(params={"functions": [...]})
+    scene.render()
+
+Importing this module loads Manim, so keep it out of the API process.
+"""
+
+import math
+
+import numpy as np
+from manim import *
+
+from app.duration_budget import MIN_RUN_TIME, MIN_WAIT
+
+
+DEFAULT_COLORS = ["BLUE", "RED", "GREEN", "YELLOW", "PURPLE"]
+
+# Names available to function expressions (mirrors what `from manim import *` gives generated code)
+EXPR_NAMESPACE = {
+    "__builtins__": {},
+    "np": np,
+    "math": math,
+    "pi": np.pi,
+    "e": np.e,
+    "abs": abs,
+    "sin": np.sin,
+    "cos": np.cos,
+    "tan": np.tan,
+    "exp": np.exp,
+    "log": np.log,
+    "sqrt": np.sqrt,
+}
+
+
+def manim_color(name: str):
+    """Resolves a color name from the params (e.g. "BLUE") to a Manim color."""
+    return globals().get(str(name).upper(), WHITE)
+
+
+class TemplateScene(Scene):
+    """
+    Base class for parametric template scenes.
+
+    Params can be passed to the constructor or set as a class attribute,
+    so subclasses can also be declared with fixed params.
+
+    time_scale (≤ 1) shortens every wait and play run_time, the runtime
+    equivalent of the duration budget rewrite applied to generated scripts.
+    """
+
+    params: dict = {}
+    time_scale: float = 1.0
+
+    def __init__(self, params: dict = None, time_scale: float = None, **kwargs):
+        if params is not None:
+            self.params = params
+        if time_scale is not None:
+            self.time_scale = time_scale
+        super().__init__(**kwargs)
+
+    def play(self, *args, **kwargs):
+        if self.time_scale < 1.0:
+            # Animations without a run_time default to one second
+            kwargs["run_time"] = max(MIN_RUN_TIME, kwargs.get("run_time", 1.0) * self.time_scale)
+        super().play(*args, **kwargs)
+
+    def wait(self, duration: float = 1.0, *args, **kwargs):
+        if self.time_scale < 1.0:
+            duration = max(MIN_WAIT, duration * self.time_scale)
+        super().wait(duration, *args, **kwargs)
+
+
+class FunctionGraphScene(TemplateScene):
+    """Scene for FunctionGraphTemplate."""
+
+    def construct(self):
+        functions = self.params["functions"]
+        title_text = self.params.get("title", "Function Graph")
+        x_range = self.params.get("x_range", [-5, 5, 1])
+        y_range = self.params.get("y_range", [-5, 5, 1])
+
+        # Title - fixed at top
+        title = Text(title_text).scale(0.8).to_edge(UP, buff=0.3)
+        self.play(Write(title))
+        self.wait(0.5)
+
+        # Axes - centered and scaled to fit
+        axes = Axes(
+            x_range=x_range,
+            y_range=y_range,
+            x_length=7,
+            y_length=5,
+            axis_config={"color": WHITE, "stroke_width": 2}
+        ).scale(0.75)
+
+        x_label = axes.get_x_axis_label("x")
+        y_label = axes.get_y_axis_label("y")
+
+        self.play(Create(axes), Write(x_label), Write(y_label))
+        self.wait(0.5)
+
+        # Functions and their legend labels
+        graphs = []
+        labels = []
+        for i, func in enumerate(functions):
+            expr = func.get("expr", "x")
+            color = manim_color(func.get("color", DEFAULT_COLORS[i % len(DEFAULT_COLORS)]))
+            fn = eval(f"lambda x: {expr}", EXPR_NAMESPACE)
+
+            graphs.append(axes.plot(
+                fn,
+                x_range=func.get("x_range"),
+                discontinuities=func.get("discontinuities"),
+                color=color,
+                stroke_width=4
+            ))
+            labels.append(MathTex(func.get("label", f"f{i+1}(x)")).scale(0.6).set_color(color))
+
+        legend = VGroup(*labels).arrange(DOWN, buff=0.2, aligned_edge=LEFT)
+        legend.scale(0.8).to_corner(UR, buff=0.5)
+
+        # Animate graphs
+        self.play(*[Create(graph) for graph in graphs])
+        self.wait(0.5)
+
+        # Show legend
+        self.play(FadeIn(legend))
+        self.wait(2)
+
+
+class AlgebraicStepsScene(TemplateScene):
+    """Scene for AlgebraicStepsTemplate."""
+
+    def construct(self):
+        steps = self.params["steps"]
+        title_text = self.params.get("title", "Step-by-Step Solution")
+        show_annotations = self.params.get("show_annotations", True)
+
+        # Title - fixed at top
+        title = Text(title_text).scale(0.8).to_edge(UP, buff=0.3)
+        self.play(Write(title))
+        self.wait(0.5)
+
+        current = None
+        for i, step in enumerate(steps):
+            self.next_section(f"step_{i+1}")
+            equation = MathTex(step.get("equation", "")).scale(1.2)
+            annotation = step.get("annotation", "")
+
+            if current is None:
+                # First step - just display
+                current = equation
+                self.play(Write(current))
+            else:
+                # Transform from previous step
+                self.play(Transform(current, equation))
+            self.wait(1)
+
+            if show_annotations and annotation:
+                note = Text(annotation).scale(0.5).to_edge(DOWN, buff=0.5)
+                self.play(FadeIn(note))
+                self.wait(1)
+                self.play(FadeOut(note))
+
+        # Highlight final answer
+        self.next_section("final_answer")
+        box = SurroundingRectangle(current, color=YELLOW, buff=0.2, stroke_width=4)
+        self.play(Create(box))
+        self.wait(2)
+
+
+class GeometricProofScene(TemplateScene):
+    """Scene for GeometricProofTemplate."""
+
+    def build_shape(self, shape: dict):
+        shape_type = shape.get("type", "Square")
+        style = {"color": manim_color(shape.get("color", "BLUE")), "fill_opacity": 0.5, "stroke_width": 4}
+
+        if shape_type == "Square":
+            return Square(side_length=shape.get("side", 2), **style)
+        if shape_type == "Circle":
+            return Circle(radius=shape.get("radius", 1), **style)
+        if shape_type == "Triangle":
+            vertices = shape.get("vertices", [[0, 0, 0], [2, 0, 0], [1, 2, 0]])
+            return Polygon(*vertices, **style)
+        if shape_type == "Rectangle":
+            return Rectangle(width=shape.get("width", 2), height=shape.get("height", 1), **style)
+        return None
+
+    def construct(self):
+        shapes = self.params["shapes"]
+        proof_steps = self.params.get("proof_steps", [])
+
+        # Theorem statement - fixed at top
+        theorem = MathTex(self.params["theorem"]).scale(0.9).to_edge(UP, buff=0.3)
+        self.play(Write(theorem))
+        self.wait(1)
+
+        # Create shapes (unknown shape types are skipped, like the generated code)
+        mobjects = []
+        for shape in shapes:
+            mobject = self.build_shape(shape)
+            if mobject is None:
+                continue
+            position = shape.get("position", [0, 0, 0])
+            if position != [0, 0, 0]:
+                mobject.shift(position[0] * RIGHT + position[1] * UP)
+            mobjects.append((shape, mobject))
+
+        # Organize shapes in a group and center
+        shapes_group = VGroup(*[mobject for _, mobject in mobjects])
+        shapes_group.move_to(ORIGIN)
+
+        # Create labels
+        labels = [
+            MathTex(shape["label"]).scale(0.7).next_to(mobject, DOWN, buff=0.3)
+            for shape, mobject in mobjects if shape.get("label")
+        ]
+
+        # Animate shapes
+        self.play(*[Create(mobject) for _, mobject in mobjects])
+        self.wait(0.5)
+
+        # Show labels
+        if labels:
+            self.play(*[Write(label) for label in labels])
+            self.wait(1)
+
+        for i, step in enumerate(proof_steps):
+            step_text = step.get("text", "")
+            if step_text:
+                self.next_section(f"proof_step_{i+1}")
+                text = Text(step_text).scale(0.6).to_edge(DOWN, buff=0.5)
+                self.play(Write(text))
+                self.wait(2)
+                self.play(FadeOut(text))
+
+        self.wait(2)
@@ -0,0 +1,135 @@
+"""
+TeX cache warm-up.
+
+Manim compiles every MathTex/Tex string with LaTeX and caches the SVG under
+<media_dir>/Tex. A streamed script reveals its TeX strings long before the
+reply is complete, so they can be compiled while the LLM is still writing
+and the render then finds them cached.
+
+TexPrewarmer (API side) collects expressions and feeds them, one JSON line
+each, to a worker process:
+
+    python -m app.tex_prewarm
+
+which imports Manim once and builds each Mobject with the same media_dir
+as the render, so the cache keys match.
+"""
+
+import os
+import sys
+import ast
+import json
+import subprocess
+from typing import Any, Dict, List, Optional
+
+TEX_PREWARM = os.getenv("TEX_PREWARM", "on").lower() in ("1", "true", "on")
+TEX_PREWARM_TIMEOUT_SECONDS = float(os.getenv("TEX_PREWARM_TIMEOUT_SECONDS", "30"))
+
+TEX_CLASSES = ("MathTex", "Tex")
+
+# Keyword arguments that change the compiled TeX (everything else, like color, doesn't)
+TEX_KWARGS = ("tex_environment", "arg_separator")
+
+
+def find_tex_calls(line: str) -> List[Dict[str, Any]]:
+    """
+    TeX objects built from literals on one line of code, e.g.
+    `eq = MathTex(r"a^2", "+", r"b^2", color=BLUE)` →
+    [{"cls": "MathTex", "args": ["a^2", "+", "b^2"], "kwargs": {}}]
+
+    Calls with computed strings or a custom tex_template are skipped,
+    they can't be known before the scene runs.
+    """
+    if not any(name in line for name in TEX_CLASSES):
+        return []
+    try:
+        tree = ast.parse(line.strip())
+    except SyntaxError:
+        return []
+
+    calls = []
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in TEX_CLASSES):
+            continue
+        if not node.args or not all(isinstance(a, ast.Constant) and isinstance(a.value, str) for a in node.args):
+            continue
+        kwargs = {}
+        for keyword in node.keywords:
+            if keyword.arg in TEX_KWARGS and isinstance(keyword.value, ast.Constant):
+                kwargs[keyword.arg] = keyword.value.value
+            elif keyword.arg in TEX_KWARGS or keyword.arg in ("tex_template", "substrings_to_isolate", "tex_to_color_map", None):
+                break
+        else:
+            calls.append({"cls": node.func.id, "args": [a.value for a in node.args], "kwargs": kwargs})
+    return calls
+
+
+class TexPrewarmer:
+    """Compiles TeX strings in a background process as they are found."""
+
+    def __init__(self, enabled: bool = TEX_PREWARM):
+        self.enabled = enabled
+        self.process: Optional[subprocess.Popen] = None
+        self.seen = set()
+
+    def add_line(self, line: str) -> None:
+        for call in find_tex_calls(line):
+            self.add(call)
+
+    def add(self, call: Dict[str, Any]) -> None:
+        key = json.dumps(call, sort_keys=True)
+        if not self.enabled or key in self.seen:
+            return
+        self.seen.add(key)
+        try:
+            if self.process is None:
+                # Started on the first expression, so importing Manim overlaps the stream
+                self.process = subprocess.Popen(
+                    [sys.executable, "-m", "app.tex_prewarm"],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    text=True,
+                )
+            self.process.stdin.write(key + "\n")
+            self.process.stdin.flush()
+        except OSError as e:
+            print(f" TeX prewarm unavailable: {e}")
+            self.process = None
+
+    def finish(self, timeout: float = TEX_PREWARM_TIMEOUT_SECONDS) -> None:
+        """Waits (up to timeout) for the queued expressions to finish compiling."""
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=timeout)
+            print(f" Prewarmed {len(self.seen)} TeX expressions")
+        except (OSError, subprocess.TimeoutExpired):
+            # The render compiles whatever is left itself
+            self.process.kill()
+
+    def cancel(self) -> None:
+        if self.process is not None:
+            self.process.kill()
+
+
+def main() -> None:
+    from manim import MathTex, Tex, config
+
+    from app.renderer import OUTPUT_DIR
+
+    config.media_dir = OUTPUT_DIR
+    classes = {"MathTex": MathTex, "Tex": Tex}
+
+    for line in sys.stdin:
+        try:
+            call = json.loads(line)
+            classes[call["cls"]](*call["args"], **call.get("kwargs", {}))
+        except Exception as e:
+            # Bad TeX fails again at render time with a proper error
+            print(f"TeX prewarm skipped {line.strip()}: {e}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
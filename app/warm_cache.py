@@ -0,0 +1,167 @@
+"""
+Pre-warmed generations and renders (filled by app/warmer.py).
+
+Two layers, both on disk under WARM_DIR so every API process on the node
+shares them:
+
+- prompts: normalized prompt → the LLM's result for it (template, params,
+  script). A chat whose first prompt was warmed skips classification,
+  extraction and code generation.
+- renders: sha1 of a script → its full-quality video, poster and
+  storyboard. Any turn whose script comes out identical - a warmed prompt,
+  the same params reached by different wording, a popular refinement -
+  reuses the video instead of rendering it again.
+
+Warm renders are made at WARM_QUALITY (full quality), so they can stand in
+for a render at any tier.
+"""
+
+import os
+import json
+import time
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.batch import normalize_prompt, prompt_key
+from app.duration_budget import apply_duration_budget
+from app.postprocess import url_to_path
+from app.render_cost import render_cost_model, script_features
+from app.renderer import OUTPUT_DIR, render_frame, render_manim_script, storyboard_frames
+from app.script_gen import save_script
+from app.storage import storage_key, video_store
+
+WARM_DIR = os.path.join(OUTPUT_DIR, "warm")
+WARM_QUALITY = "h"
+
+
+def script_sha1(script_code: str) -> str:
+    return hashlib.sha1(script_code.encode("utf-8")).hexdigest()
+
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads(Path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    # Written aside and renamed, so readers in other processes never see half a file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    Path(tmp_path).write_text(json.dumps(data, indent=2), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+class WarmCache:
+    """Warmed LLM results per prompt and warmed renders per script."""
+
+    def __init__(self, warm_dir: str = WARM_DIR):
+        self.warm_dir = warm_dir
+        self.hits = {"prompts": 0, "renders": 0}
+
+    def _prompt_path(self, prompt: str) -> str:
+        return os.path.join(self.warm_dir, "prompts", f"{prompt_key(prompt)}.json")
+
+    def _render_path(self, script_code: str) -> str:
+        return os.path.join(self.warm_dir, "renders", f"{script_sha1(script_code)}.json")
+
+    def script_path(self, script_code: str) -> str:
+        """Where a warm script is rendered from (its module name keeps its videos apart)."""
+        return os.path.join(self.warm_dir, f"warm_{script_sha1(script_code)[:16]}.py")
+
+    def get_prompt(self, prompt: str, count_hit: bool = True) -> Optional[Dict[str, Any]]:
+        """{"script_code", "template", "params"} generated for the prompt ahead of time, if any."""
+        entry = _read_json(self._prompt_path(prompt))
+        if not entry or entry.get("prompt") != normalize_prompt(prompt) or not entry.get("script_code"):
+            return None
+        if count_hit:
+            self.hits["prompts"] += 1
+        return entry
+
+    def has_prompt(self, prompt: str) -> bool:
+        return os.path.exists(self._prompt_path(prompt))
+
+    def put_prompt(self, prompt: str, script_code: str, template: Optional[str], params: Optional[Dict]) -> None:
+        _write_json(self._prompt_path(prompt), {
+            "prompt": normalize_prompt(prompt),
+            "script_code": script_code,
+            "template": template,
+            "params": params,
+            "warmed_at": time.time(),
+        })
+
+    def _video_available(self, video_url: str) -> bool:
+        if os.path.exists(url_to_path(video_url)):
+            return True
+        if not video_store.remote:
+            return False
+        try:
+            return video_store.backend.exists(storage_key(video_url))
+        except Exception:
+            return False
+
+    def get_render(self, script_code: str, count_hit: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        {"video_url", "poster_url", "storyboard_urls", "quality"} of a warm
+        render of exactly this script, if its video is still available.
+        """
+        entry = _read_json(self._render_path(script_code))
+        if not entry or not self._video_available(entry["video_url"]):
+            return None
+        if count_hit:
+            self.hits["renders"] += 1
+        return {key: entry.get(key) for key in ("video_url", "poster_url", "storyboard_urls", "quality")}
+
+    def has_render(self, script_code: str) -> bool:
+        """Whether a warm render of this script can be served (an evicted video doesn't count)."""
+        return self.get_render(script_code, count_hit=False) is not None
+
+    def render(self, script_code: str, cancel=None) -> Dict[str, Any]:
+        """
+        Renders a script at WARM_QUALITY: poster, storyboard frames, then the
+        video, one Manim process at a time. With cancel (threading.Event) it
+        stops as soon as the event is set (RenderCancelledError); Manim's
+        partial movie cache keeps finished animations for the next attempt.
+        """
+        script_path = self.script_path(script_code)
+        save_script(script_code, script_path)
+        apply_duration_budget(script_path, WARM_QUALITY)
+        features = script_features(Path(script_path).read_text(encoding="utf-8"))
+
+        started = time.monotonic()
+        poster_url = render_frame(script_path, quality=WARM_QUALITY, output_name="warm_poster", cancel=cancel)
+        storyboard_urls: List[str] = []
+        for frame in storyboard_frames(Path(script_path).read_text(encoding="utf-8")):
+            storyboard_urls.append(render_frame(script_path, quality=WARM_QUALITY, output_name=f"warm_frame{frame}",
+                                                upto_animation=frame, cancel=cancel))
+
+        video_started = time.monotonic()
+        video_url = render_manim_script(script_path, quality=WARM_QUALITY, preview=False, quiet=True, cancel=cancel)
+        render_cost_model.record(features, WARM_QUALITY, time.monotonic() - video_started)
+        video_store.offload(video_url)
+
+        rendered = {
+            "video_url": video_url,
+            "poster_url": poster_url,
+            "storyboard_urls": storyboard_urls,
+            "quality": WARM_QUALITY,
+        }
+        _write_json(self._render_path(script_code), {
+            **rendered,
+            "script_sha1": script_sha1(script_code),
+            "render_seconds": round(time.monotonic() - started, 2),
+            "warmed_at": time.time(),
+        })
+        return rendered
+
+    def stats(self) -> Dict[str, Any]:
+        counts = {
+            layer: len(list(Path(self.warm_dir, layer).glob("*.json"))) if Path(self.warm_dir, layer).is_dir() else 0
+            for layer in ("prompts", "renders")
+        }
+        return {"entries": counts, "hits": dict(self.hits)}
+
+
+warm_cache = WarmCache()
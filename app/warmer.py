@@ -0,0 +1,335 @@
+"""
+Popularity-driven pre-warming.
+
+Popular lesson prompts would otherwise be generated and rendered on
+demand, every time, by whoever asks first. A background thread in the
+API finds what's popular and computes it ahead of time into the warm cache
+(app/warm_cache.py), which chat turns check before calling the LLM or
+rendering:
+
+- prompts: the opening prompts of chats created in the last
+  WARM_WINDOW_DAYS (messages table), counted once per chat. Those asked
+  WARM_MIN_COUNT times or more get their LLM result generated and rendered.
+- template params: the params chats ended up with (their render state),
+  counted the same way. Popular ones are rendered straight from the params
+  - no LLM call - so differently worded prompts that land on them reuse it.
+
+The warmer only uses idle time and a CPU budget:
+
+- it starts a job only when no render has been running or queued, and no
+  /chat request in flight, for WARM_IDLE_SECONDS and the machine's load
+  average is below WARM_MAX_CPU_LOAD per core
+- its Gemini calls are background priority in the rate limit (they leave
+  GEMINI_BACKGROUND_RESERVE tokens to interactive requests)
+- after a job it rests long enough to average WARM_CPU_BUDGET cores
+- renders run one Manim process at a time, and the moment an interactive
+  render arrives the process is stopped and the job retried at the next
+  idle period (animations Manim already finished stay cached)
+- with several API processes, one of them (a file lock) does the warming
+
+With RENDER_BACKEND=queue, renders belong on the workers, so only the LLM
+results are warmed.
+"""
+
+import os
+import json
+import time
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.batch import normalize_prompt, prompt_key
+from app.chat_service import get_first_prompts_since
+from app.gemini_client import gemini_client
+from app.incremental import CHATS_DIR
+from app.job_queue import RENDER_BACKEND
+from app.renderer import RenderCancelledError
+from app.scheduler import render_scheduler
+from app.script_gen import generate_script_with_params
+from app.template_engine import generate_from_params
+from app.warm_cache import WARM_DIR, warm_cache
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, every process warms
+    fcntl = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+WARMER = os.getenv("WARMER", "on").lower() in ("1", "true", "on")
+WARM_INTERVAL_SECONDS = float(os.getenv("WARM_INTERVAL_SECONDS", "600"))   # between popularity scans
+WARM_WINDOW_DAYS = float(os.getenv("WARM_WINDOW_DAYS", "7"))
+WARM_MIN_COUNT = int(os.getenv("WARM_MIN_COUNT", "3"))                     # chats asking for it
+WARM_TOP_N = int(os.getenv("WARM_TOP_N", "20"))                            # jobs per scan
+WARM_SCAN_LIMIT = int(os.getenv("WARM_SCAN_LIMIT", "5000"))                # rows read per scan
+WARM_CPU_BUDGET = float(os.getenv("WARM_CPU_BUDGET", "0.5"))               # average cores
+WARM_IDLE_SECONDS = float(os.getenv("WARM_IDLE_SECONDS", "30"))
+WARM_MAX_CPU_LOAD = float(os.getenv("WARM_MAX_CPU_LOAD", "0.5"))           # 1-min load average per core
+
+# A job that failed (not one that was preempted) isn't retried for this long
+WARM_RETRY_SECONDS = 3600
+
+POLL_SECONDS = 1.0
+
+
+def _cpu_seconds() -> float:
+    """CPU time of this thread plus finished child processes (Manim)."""
+    seconds = time.thread_time()
+    if resource is not None:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        seconds += children.ru_utime + children.ru_stime
+    return seconds
+
+
+def _cpu_load() -> float:
+    """1-minute load average per core (0 where the OS doesn't report it)."""
+    if not hasattr(os, "getloadavg"):
+        return 0.0
+    return os.getloadavg()[0] / (os.cpu_count() or 1)
+
+
+def _params_key(template: str, params: Dict[str, Any]) -> str:
+    return json.dumps([template, params], sort_keys=True)
+
+
+class PopularityWarmer:
+    """Background thread that warms popular prompts and params while the API is idle."""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock_file = None
+        self._last_busy = time.monotonic()
+        self._failed: Dict[str, float] = {}
+        self.state = "stopped"
+        self.counts = {"prompts": 0, "renders": 0, "preempted": 0, "failed": 0}
+        self.last_scan: Optional[Dict[str, Any]] = None
+
+    def start(self) -> None:
+        if not WARMER or (self._thread is not None and self._thread.is_alive()):
+            return
+        if not self._acquire_process_lock():
+            print("🔥 Pre-warming is done by another API process")
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="warmer", daemon=True)
+        self._thread.start()
+        print(f"🔥 Pre-warming popular prompts when idle (budget {WARM_CPU_BUDGET} cores)")
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _acquire_process_lock(self) -> bool:
+        if fcntl is None:
+            return True
+        Path(WARM_DIR).mkdir(parents=True, exist_ok=True)
+        self._lock_file = open(os.path.join(WARM_DIR, "warmer.lock"), "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            self._lock_file.close()
+            self._lock_file = None
+            return False
+
+    # --- What to warm ---
+
+    def popular_prompts(self, since: str) -> List[Dict[str, Any]]:
+        counts: Counter = Counter()
+        spelling: Dict[str, str] = {}
+        for prompt in get_first_prompts_since(since, WARM_SCAN_LIMIT):
+            key = normalize_prompt(prompt)
+            if key:
+                counts[key] += 1
+                spelling.setdefault(key, prompt.strip())
+        return [
+            {"kind": "prompt", "prompt": spelling[key], "count": count, "key": f"prompt:{key}"}
+            for key, count in counts.items() if count >= WARM_MIN_COUNT
+        ]
+
+    def popular_params(self, since: datetime) -> List[Dict[str, Any]]:
+        counts: Counter = Counter()
+        found: Dict[str, Dict[str, Any]] = {}
+        cutoff = since.timestamp()
+        for path in Path(CHATS_DIR).glob("*.json"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    continue
+                state = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            if not state.get("template") or not state.get("params"):
+                continue
+            key = _params_key(state["template"], state["params"])
+            counts[key] += 1
+            found[key] = {"template": state["template"], "params": state["params"]}
+        return [
+            {"kind": "params", **found[key], "count": count, "key": f"params:{key}"}
+            for key, count in counts.items() if count >= WARM_MIN_COUNT
+        ]
+
+    def plan(self) -> List[Dict[str, Any]]:
+        """The most popular prompts and params not warmed yet (and not recently failed)."""
+        since = datetime.now(timezone.utc) - timedelta(days=WARM_WINDOW_DAYS)
+        candidates = []
+        try:
+            candidates += self.popular_prompts(since.isoformat())
+        except Exception as e:
+            print(f"⚠️  Warmer could not read recent prompts: {e}")
+        if RENDER_BACKEND != "queue":
+            candidates += self.popular_params(since)
+
+        now = time.time()
+        jobs = []
+        for job in sorted(candidates, key=lambda j: j["count"], reverse=True):
+            if now - self._failed.get(job["key"], 0) < WARM_RETRY_SECONDS or self._is_warm(job):
+                continue
+            jobs.append(job)
+            if len(jobs) >= WARM_TOP_N:
+                break
+        self.last_scan = {"at": now, "candidates": len(candidates), "jobs": len(jobs)}
+        return jobs
+
+    def _script_for(self, job: Dict[str, Any]) -> Optional[str]:
+        """The job's script if it can be had without the LLM (template params, or an already warmed prompt)."""
+        if job["kind"] == "params":
+            script_code, _ = generate_from_params(job["template"], job["params"])
+            return script_code
+        warmed = warm_cache.get_prompt(job["prompt"], count_hit=False)
+        return warmed["script_code"] if warmed else None
+
+    def _is_warm(self, job: Dict[str, Any]) -> bool:
+        if job["kind"] == "prompt" and not warm_cache.has_prompt(job["prompt"]):
+            return False
+        if RENDER_BACKEND == "queue":
+            return True
+        script_code = self._script_for(job)
+        return not script_code or warm_cache.has_render(script_code)
+
+    # --- When to warm ---
+
+    def interactive_load(self) -> bool:
+        """
+        True while any render is running or waiting for a slot, or a /chat
+        request is in flight (the scheduler counts them from admission, so
+        their LLM phase counts too).
+        """
+        if render_scheduler.load() > 0:
+            self._last_busy = time.monotonic()
+            return True
+        return False
+
+    def _wait_for_idle(self) -> bool:
+        """Blocks until the API has been idle for WARM_IDLE_SECONDS. False when stopping."""
+        while not self._stop.is_set():
+            busy = self.interactive_load() or _cpu_load() >= WARM_MAX_CPU_LOAD
+            if busy:
+                self._last_busy = time.monotonic()
+            elif time.monotonic() - self._last_busy >= WARM_IDLE_SECONDS:
+                return True
+            self.state = "waiting for idle"
+            self._stop.wait(POLL_SECONDS)
+        return False
+
+    def _watch(self, cancel: threading.Event, done: threading.Event) -> None:
+        """Cancels the running render as soon as interactive work shows up."""
+        while not done.wait(0.2):
+            if self.interactive_load() or self._stop.is_set():
+                cancel.set()
+                return
+
+    # --- Warming ---
+
+    def _render(self, script_code: str) -> bool:
+        """Renders a script into the warm cache unless it's there. False if preempted."""
+        if RENDER_BACKEND == "queue" or warm_cache.has_render(script_code):
+            return True
+        cancel, done = threading.Event(), threading.Event()
+        threading.Thread(target=self._watch, args=(cancel, done), name="warmer-watch", daemon=True).start()
+        try:
+            warm_cache.render(script_code, cancel=cancel)
+        except RenderCancelledError:
+            self.counts["preempted"] += 1
+            print("🔥 Warm render stopped - interactive load arrived")
+            return False
+        finally:
+            done.set()
+        self.counts["renders"] += 1
+        return True
+
+    def warm(self, job: Dict[str, Any]) -> bool:
+        """Warms one job. False if it was preempted (it stays in the plan)."""
+        if job["kind"] == "prompt" and not warm_cache.has_prompt(job["prompt"]):
+            if gemini_client.degraded:
+                raise RuntimeError("Gemini is unavailable")
+            if self.interactive_load():
+                return False
+            output_path = os.path.join(WARM_DIR, "generated", f"scene_{prompt_key(job['prompt'])}.py")
+            # Below interactive requests in the Gemini rate limit
+            with gemini_client.background():
+                script_code, template, params = generate_script_with_params(job["prompt"], output_path=output_path)
+            if not script_code:
+                raise RuntimeError("script generation failed")
+            warm_cache.put_prompt(job["prompt"], script_code, template, params)
+            self.counts["prompts"] += 1
+            if self.interactive_load():
+                return False
+
+        script_code = self._script_for(job)
+        if not script_code:
+            raise RuntimeError("no script for these params")
+        return self._render(script_code)
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            if not self._wait_for_idle():
+                return
+            self.state = "scanning"
+            jobs = self.plan()
+            if jobs:
+                print(f"🔥 Warming {len(jobs)} popular prompts/params")
+
+            for job in jobs:
+                if not self._wait_for_idle():
+                    return
+                self.state = f"warming {job['kind']} (asked {job['count']}x)"
+                wall, cpu = time.monotonic(), _cpu_seconds()
+                try:
+                    done = self.warm(job)
+                except Exception as e:
+                    print(f"❌ Warming {job['kind']} failed: {e}")
+                    self._failed[job["key"]] = time.time()
+                    self.counts["failed"] += 1
+                    done = True
+                if not done:
+                    # Preempted - pick the plan up again at the next idle period
+                    break
+
+                # CPU budget: rest until the job's CPU time averages out to WARM_CPU_BUDGET cores
+                used, elapsed = _cpu_seconds() - cpu, time.monotonic() - wall
+                rest = used / max(WARM_CPU_BUDGET, 0.01) - elapsed
+                if rest > 0:
+                    self.state = "resting (CPU budget)"
+                    self._stop.wait(rest)
+
+            else:
+                self.state = "idle"
+                self._stop.wait(WARM_INTERVAL_SECONDS)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": WARMER,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "state": self.state,
+            "warmed": dict(self.counts),
+            "last_scan": self.last_scan,
+            "cache": warm_cache.stats(),
+        }
+
+
+popularity_warmer = PopularityWarmer()
@@ -0,0 +1,215 @@
+"""
+Standalone render worker.
+
+Pulls render jobs from the durable queue (app/job_queue.py) - videos,
+posters and storyboard frames - and renders them into OUTPUT_DIR. The
+queue database is SQLite, so the workers run on the API's host (see
+app/job_queue.py) and the API serves their results from the same disk.
+Run as many as the hardware allows:
+
+    python -m app.worker --concurrency 2
+
+With STORAGE_BACKEND set, results are also uploaded before the job is
+reported done; a job whose upload fails is failed (and retried).
+
+Ctrl-C / SIGTERM stops claiming new jobs and lets running renders finish.
+A worker that dies mid-render stops heartbeating, and its jobs go back to
+the queue once their lease expires.
+"""
+
+import os
+import time
+import signal
+import argparse
+import tempfile
+import threading
+import traceback
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from app.job_queue import HEARTBEAT_SECONDS, get_render_queue, new_worker_id
+from app.manim_timing import read_animation_timings
+from app.postprocess import wait_for_optimizations
+from app.renderer import render_frames, render_manim_script_sections
+from app.scheduler import RenderScheduler
+from app.storage import video_store
+
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "1"))
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "1"))
+
+
+def _write_script(payload: Dict[str, Any]) -> str:
+    """
+    Writes the script shipped inside a job to the path the API gave it, so
+    output URLs line up (the job carries the source, so a worker doesn't
+    depend on the API's copy still being there).
+    """
+    script_path = payload["script_path"]
+    Path(script_path).parent.mkdir(parents=True, exist_ok=True)
+    Path(script_path).write_text(payload["script_code"], encoding="utf-8")
+    return script_path
+
+
+def render_script_job(payload: Dict[str, Any], slots: Optional[RenderScheduler] = None) -> Dict[str, Any]:
+    """
+    Renders a script's video. With "animation_timings" set (a profiled
+    request), Manim's per-animation timings are returned with the result.
+    A sectioned script splits over the worker's idle slots (slots).
+    """
+    script_path = _write_script(payload)
+
+    timings_path = None
+    if payload.get("animation_timings"):
+        handle, timings_path = tempfile.mkstemp(suffix=".manim.json")
+        os.close(handle)
+
+    try:
+        video_url = render_manim_script_sections(
+            script_path,
+            payload.get("class_name", "GeneratedScene"),
+            quality=payload["quality"],
+            output_file=payload["output_file"],
+            timings_path=timings_path,
+            slots=slots,
+        )
+        if video_store.remote:
+            # The job is only done once the video is in storage
+            video_store.upload_now(video_url)
+
+        result = {"video_url": video_url}
+        if timings_path:
+            result["animation_timings"] = read_animation_timings(timings_path)
+        return result
+    finally:
+        if timings_path:
+            Path(timings_path).unlink(missing_ok=True)
+
+
+def render_frames_job(payload: Dict[str, Any], slots: Optional[RenderScheduler] = None) -> Dict[str, Any]:
+    """
+    Renders a script's poster and/or storyboard frames ("frames": None for
+    the poster, n for the frame after animation n). A frame that fails is
+    None in "image_urls" rather than failing the job.
+    """
+    script_path = _write_script(payload)
+    image_urls = render_frames(
+        script_path,
+        payload.get("class_name", "GeneratedScene"),
+        quality=payload["quality"],
+        name=payload["name"],
+        frames=payload["frames"],
+    )
+    if video_store.remote:
+        for image_url in image_urls:
+            if image_url:
+                video_store.upload_now(image_url)
+    return {"image_urls": image_urls}
+
+
+JOB_HANDLERS: Dict[str, Callable[..., Dict[str, Any]]] = {
+    "render_script": render_script_job,
+    "render_frames": render_frames_job,
+}
+
+
+class RenderWorker:
+    """Claims and runs jobs on `concurrency` threads until stopped."""
+
+    def __init__(self, concurrency: int = WORKER_CONCURRENCY, poll_seconds: float = WORKER_POLL_SECONDS):
+        self.queue = get_render_queue()
+        self.concurrency = max(1, concurrency)
+        self.poll_seconds = poll_seconds
+        self.worker_id = new_worker_id()
+        self.stopping = threading.Event()
+        # One per claiming thread, held while it runs a job; sectioned renders borrow idle ones
+        self.slots = RenderScheduler(workers=self.concurrency)
+
+    def run(self) -> None:
+        self.queue.register_worker(self.worker_id, self.concurrency)
+        print(f"👷 Render worker {self.worker_id} started ({self.concurrency} slots, queue {self.queue.path})")
+
+        heartbeat = threading.Thread(target=self._worker_heartbeat, daemon=True)
+        heartbeat.start()
+        threads = [threading.Thread(target=self._loop, name=f"slot-{i}") for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(t.is_alive() for t in threads):
+                time.sleep(0.5)
+        finally:
+            self.queue.unregister_worker(self.worker_id)
+            # Background re-encodes upload their result when done - let them finish
+            wait_for_optimizations()
+            video_store.wait()
+            print(f"👋 Render worker {self.worker_id} stopped")
+
+    def stop(self, *_) -> None:
+        if not self.stopping.is_set():
+            print("⏸️  Stopping - finishing running renders, not claiming new ones")
+        self.stopping.set()
+
+    def _worker_heartbeat(self) -> None:
+        while not self.stopping.wait(HEARTBEAT_SECONDS):
+            self.queue.worker_heartbeat(self.worker_id)
+
+    def _loop(self) -> None:
+        while not self.stopping.is_set():
+            # A job is only claimed with a free slot (a sectioned render may have borrowed it)
+            with self.slots.slot():
+                try:
+                    job = self.queue.claim(self.worker_id)
+                except Exception as e:
+                    # Database busy or briefly unreachable - try again
+                    print(f"⚠️  Claim failed: {e}")
+                    job = None
+                if job is not None:
+                    self._run_job(job)
+                    continue
+            self.stopping.wait(self.poll_seconds)
+
+    def _run_job(self, job: Dict[str, Any]) -> None:
+        job_id = job["id"]
+        print(f"🎬 Job {job_id} ({job['kind']}, attempt {job['attempts']}/{job['max_attempts']})")
+
+        # Keep the lease alive while rendering; stops with the render
+        done = threading.Event()
+
+        def heartbeat():
+            while not done.wait(HEARTBEAT_SECONDS):
+                if not self.queue.heartbeat(job_id, self.worker_id):
+                    print(f"⚠️  Lost the lease on job {job_id} - another worker may run it too")
+                    return
+
+        beat = threading.Thread(target=heartbeat, daemon=True)
+        beat.start()
+        started = time.monotonic()
+        try:
+            handler = JOB_HANDLERS[job["kind"]]
+            result = handler(job["payload"], self.slots)
+        except Exception as e:
+            done.set()
+            traceback.print_exc()
+            self.queue.fail(job_id, self.worker_id, f"{type(e).__name__}: {e}")
+            print(f"❌ Job {job_id} failed: {e}")
+            return
+        done.set()
+
+        result["render_seconds"] = round(time.monotonic() - started, 2)
+        if self.queue.complete(job_id, self.worker_id, result):
+            print(f"✅ Job {job_id} done in {result['render_seconds']}s")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Render worker for the durable render queue")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="Renders at a time")
+    parser.add_argument("--poll", type=float, default=WORKER_POLL_SECONDS, help="Seconds between polls when idle")
+    args = parser.parse_args(argv)
+
+    worker = RenderWorker(concurrency=args.concurrency, poll_seconds=args.poll)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import json
+import os
+
+# The in-memory chat store keeps app.main importable without Supabase
+os.environ.setdefault("CHAT_STORE", "memory")
+
+import jwt
+import pytest
+from fastapi.testclient import TestClient
+
+from app import auth, main
+from app.chat_service import add_message, create_chat
+from app.gemini_client import _background
+from app.main import app
+
+SECRET = "test-secret"
+
+
+def _token(sub="user-1", role=None):
+    payload = {"sub": sub, "app_metadata": {"role": role} if role else {}}
+    return {"Authorization": f"Bearer {jwt.encode(payload, SECRET, algorithm='HS256')}"}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(auth, "SUPABASE_JWT_SECRET", SECRET)
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("path", ["/llm/usage", "/warmer", "/videos/delivery", "/profiles"])
+def test_operational_endpoints_are_admin_only(client, path):
+    assert client.get(path, headers=_token()).status_code == 403
+    assert client.get(path, headers=_token(role="admin")).status_code == 200
+
+
+def test_unchanged_chat_list_answers_304(client):
+    headers = _token("etag-user")
+    first = client.get("/chats", headers=headers)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "private, no-cache"
+
+    repeat = client.get("/chats", headers={**headers, "If-None-Match": etag})
+    assert repeat.status_code == 304
+    assert repeat.content == b""
+    assert repeat.headers["ETag"] == etag
+
+    create_chat("etag-user", "Parabolas")
+    changed = client.get("/chats", headers={**headers, "If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert [chat["title"] for chat in changed.json()] == ["Parabolas"]
+
+
+def test_chat_history_etag(client):
+    headers = _token("etag-user")
+    chat_id = create_chat("etag-user", "Sines")
+    etag = client.get(f"/chatdata/{chat_id}", headers=headers).headers["ETag"]
+
+    assert client.get(f"/chatdata/{chat_id}", headers={**headers, "If-None-Match": f'"other", {etag}'}).status_code == 304
+    add_message(chat_id, "user", "graph sin(x)")
+    assert client.get(f"/chatdata/{chat_id}", headers={**headers, "If-None-Match": etag}).status_code == 200
+
+
+def test_batch_is_admin_only_and_capped(client, monkeypatch):
+    runs = []
+    monkeypatch.setattr(main, "run_batch", lambda prompts, **kwargs: runs.append((prompts, kwargs, _background.get())))
+    monkeypatch.setattr(main, "BATCH_MAX_PROMPTS", 2)
+
+    assert client.post("/batch", json={"prompts": ["graph x^2"]}, headers=_token()).status_code == 403
+    too_many = client.post("/batch", json={"prompts": ["a", "b", "c"]}, headers=_token(role="admin"))
+    assert too_many.status_code == 400
+    assert runs == []
+
+    response = client.post("/batch", json={"prompts": ["graph x^2", "graph x^2"]}, headers=_token("admin-1", "admin"))
+    assert response.status_code == 200
+    assert response.json()["unique_count"] == 1
+    # Run after the response, with Gemini calls at background priority
+    [(prompts, kwargs, background)] = runs
+    assert kwargs["owner"] == "admin-1" and background
+
+
+def test_batch_manifest_is_only_shown_to_its_owner(client, monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "BATCH_DIR", str(tmp_path))
+    (tmp_path / "b1").mkdir()
+    (tmp_path / "b1" / "manifest.json").write_text(json.dumps({"batch_id": "b1", "owner": "owner-1", "items": []}))
+
+    assert client.get("/batch/b1", headers=_token("owner-1")).status_code == 200
+    assert client.get("/batch/b1", headers=_token("someone-else")).status_code == 404
+    assert client.get("/batch/b1", headers=_token("admin-2", "admin")).status_code == 200
@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+
+# The in-memory chat store keeps app.chat_service importable without Supabase
+os.environ.setdefault("CHAT_STORE", "memory")
+
+from app import chat_service
+from app.chat_service import ReadCache
+
+
+def test_reads_are_cached_until_invalidated():
+    cache = ReadCache(ttl_seconds=60)
+    loads = []
+
+    def load():
+        loads.append(1)
+        return len(loads)
+
+    assert cache.get_or_load("k", load) == 1
+    assert cache.get_or_load("k", load) == 1
+    cache.invalidate("k")
+    assert cache.get_or_load("k", load) == 2
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 2}
+
+
+def test_entries_expire_after_the_ttl():
+    cache = ReadCache(ttl_seconds=0.05)
+    assert cache.get_or_load("k", lambda: "old") == "old"
+    time.sleep(0.06)
+    assert cache.get_or_load("k", lambda: "new") == "new"
+
+
+def test_read_overlapping_an_invalidation_is_not_stored():
+    cache = ReadCache(ttl_seconds=60)
+    reading, written = threading.Event(), threading.Event()
+
+    def slow_load():
+        reading.set()
+        written.wait(2)
+        return "before the write"
+
+    reader = threading.Thread(target=lambda: cache.get_or_load("k", slow_load))
+    reader.start()
+    reading.wait(2)
+    # A write lands while the read is still on its way back
+    cache.invalidate("k")
+    written.set()
+    reader.join(2)
+
+    assert cache.get_or_load("k", lambda: "after the write") == "after the write"
+
+
+def test_least_recently_used_entries_are_dropped():
+    cache = ReadCache(ttl_seconds=60, max_entries=2)
+    cache.get_or_load("a", lambda: 1)
+    cache.get_or_load("b", lambda: 2)
+    cache.get_or_load("a", lambda: 1)
+    cache.get_or_load("c", lambda: 3)
+
+    assert cache.get_or_load("a", lambda: "reloaded") == 1
+    assert cache.get_or_load("b", lambda: "reloaded") == "reloaded"
+
+
+def test_writes_invalidate_the_cached_reads():
+    chat_id = chat_service.create_chat("owner", "Parabolas")
+    assert [chat["id"] for chat in chat_service.get_user_chats("owner")] == [chat_id]
+    assert chat_service.get_chat_history(chat_id) == []
+
+    chat_service.add_message(chat_id, "user", "graph x^2")
+    assert [m["content"] for m in chat_service.get_chat_history(chat_id)] == ["graph x^2"]
+
+    chat_service.delete_chat(chat_id)
+    assert chat_service.get_user_chats("owner") == []
+    assert chat_service.get_chat_history(chat_id) == []
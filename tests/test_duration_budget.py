@@ -0,0 +1,134 @@
+import ast
+
+import pytest
+
+from app import duration_budget
+from app.duration_budget import BUDGET_HEADER, MIN_RUN_TIME, MIN_WAIT, apply_duration_budget, apply_duration_budget_to_code
+from app.render_cost import script_features
+
+SCENE = '''from manim import *
+
+class GeneratedScene(Scene):
+
+    def construct(self):
+        title = Text('Hi')
+        circle = Circle()
+        self.play(Write(title))
+        self.play(Create(circle), run_time=10)
+        self.wait(4)
+        self.wait()
+        self.wait(duration=4)
+'''
+
+# Write 1 + Create 10 + wait 4 + wait() 1 + wait 4
+SCENE_SECONDS = 20
+
+
+def _calls(code, method):
+    tree = ast.parse(code)
+    return [
+        node for node in ast.walk(tree)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == method
+    ]
+
+
+def _keyword(call, name):
+    for keyword in call.keywords:
+        if keyword.arg == name:
+            return ast.literal_eval(keyword.value)
+    return None
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    def set_budget(quality, seconds):
+        monkeypatch.setitem(duration_budget.DURATION_BUDGETS, quality, seconds)
+    return set_budget
+
+
+def test_within_budget_is_unchanged(budget):
+    budget("l", SCENE_SECONDS)
+    assert apply_duration_budget_to_code(SCENE, "l") == SCENE
+
+
+def test_scales_waits_and_run_times(budget):
+    budget("l", SCENE_SECONDS / 2)
+    scaled = apply_duration_budget_to_code(SCENE, "l")
+
+    plays = _calls(scaled, "play")
+    assert _keyword(plays[0], "run_time") == 0.5           # default one second, made explicit
+    assert _keyword(plays[1], "run_time") == 5.0
+
+    waits = _calls(scaled, "wait")
+    assert ast.literal_eval(waits[0].args[0]) == 2.0
+    assert _keyword(waits[1], "duration") == 0.5           # wait() defaults to one second
+    assert _keyword(waits[2], "duration") == 2.0
+
+    assert script_features(scaled)["animation_seconds"] == pytest.approx(SCENE_SECONDS / 2)
+
+
+def test_run_time_inside_the_animation_is_scaled(budget):
+    budget("l", 1)
+    code = "class S(Scene):\n    def construct(self):\n        self.play(FadeIn(Square(), run_time=4))\n        self.wait(9)\n"
+    play = _calls(apply_duration_budget_to_code(code, "l"), "play")[0]
+    assert _keyword(play, "run_time") is None
+    assert _keyword(play.args[0], "run_time") == 0.4
+
+
+def test_non_literal_durations_are_multiplied(budget):
+    budget("l", 1)
+    code = "class S(Scene):\n    def construct(self):\n        self.wait(t)\n        self.wait(9)\n"
+    scaled = apply_duration_budget_to_code(code, "l")
+    assert "self.wait(t * 0.1)" in scaled
+
+
+def test_minimums_are_kept(budget):
+    budget("l", 1)
+    scaled = apply_duration_budget_to_code(SCENE, "l")
+
+    run_times = [_keyword(call, "run_time") for call in _calls(scaled, "play")]
+    assert min(run_times) == MIN_RUN_TIME
+    waits = [ast.literal_eval(call.args[0]) if call.args else _keyword(call, "duration") for call in _calls(scaled, "wait")]
+    assert min(waits) == MIN_WAIT
+    # Floors win over the budget, so the scene ends slightly over it
+    assert script_features(scaled)["animation_seconds"] > 1
+
+
+def test_file_is_rewritten_once_with_header(tmp_path, budget):
+    budget("l", SCENE_SECONDS / 2)
+    path = tmp_path / "scene.py"
+    path.write_text(SCENE, encoding="utf-8")
+
+    assert apply_duration_budget(str(path), "l") == pytest.approx(0.5)
+    budgeted = path.read_text(encoding="utf-8")
+    assert budgeted.startswith(BUDGET_HEADER)
+    assert (tmp_path / "scene.py.original").read_text(encoding="utf-8") == SCENE
+
+    # Applying it again scales from the original, not from the shortened copy
+    assert apply_duration_budget(str(path), "l") == pytest.approx(0.5)
+    assert path.read_text(encoding="utf-8") == budgeted
+
+
+def test_larger_budget_restores_from_original(tmp_path, budget):
+    budget("l", SCENE_SECONDS / 2)
+    budget("h", SCENE_SECONDS)
+    path = tmp_path / "scene.py"
+    path.write_text(SCENE, encoding="utf-8")
+
+    apply_duration_budget(str(path), "l")
+    assert apply_duration_budget(str(path), "h") == 1.0
+    assert path.read_text(encoding="utf-8") == SCENE
+
+
+def test_edited_script_is_treated_as_new_original(tmp_path, budget):
+    budget("l", SCENE_SECONDS / 2)
+    path = tmp_path / "scene.py"
+    path.write_text(SCENE, encoding="utf-8")
+    apply_duration_budget(str(path), "l")
+
+    # A new turn overwrites the script: the stale .original must not come back
+    edited = SCENE.replace("Hi", "Hello")
+    path.write_text(edited, encoding="utf-8")
+    apply_duration_budget(str(path), "l")
+    assert "Hello" in path.read_text(encoding="utf-8")
+    assert (tmp_path / "scene.py.original").read_text(encoding="utf-8") == edited
@@ -0,0 +1,81 @@
+import time
+
+import numpy as np
+import pytest
+
+from app.templates.function_graph import (
+    MAX_MAGNITUDE,
+    evaluate_expression,
+    normalize_expression,
+    prevalidate_functions,
+)
+
+
+def _validate(expr, **params):
+    params = {"functions": [{"expr": expr}], **params}
+    return prevalidate_functions(params), params
+
+
+def test_normalizes_llm_notation():
+    assert normalize_expression("2x^2 + sin(x)") == "2.0 * x ** 2.0 + np.sin(x)"
+    assert normalize_expression("math.exp(-x) * pi") == "np.exp(-x) * np.pi"
+    assert normalize_expression("3(x+1)") == "3.0 * (x + 1.0)"
+
+
+@pytest.mark.parametrize("expr", ["__import__('os')", "x.real", "open(x)", "lambda: 1", "x if x else 1", "'a'"])
+def test_rejects_anything_outside_the_whitelist(expr):
+    with pytest.raises(ValueError):
+        normalize_expression(expr)
+
+
+@pytest.mark.parametrize("expr", ["9**9**8", "9^9^9^9", "x ** 9 ** 9 ** 9", "1" + "0" * 400 + " * x"])
+def test_huge_constants_are_rejected_quickly(expr):
+    started = time.monotonic()
+    (ok, error), _ = _validate(expr)
+    assert not ok and error
+    assert time.monotonic() - started < 1
+
+
+def test_evaluates_over_the_whole_range_at_once():
+    xs = np.linspace(-1, 1, 5)
+    assert np.allclose(evaluate_expression(normalize_expression("x^2"), xs), xs ** 2)
+    # A constant is broadcast over the samples
+    assert evaluate_expression(normalize_expression("3"), xs).shape == xs.shape
+
+
+def test_trims_undefined_ends():
+    (ok, _), params = _validate("sqrt(x)", x_range=[-5, 5])
+    assert ok
+    assert params["functions"][0]["x_range"] == [0, 5]
+
+
+def test_records_poles_as_discontinuities():
+    (ok, _), params = _validate("1/x", x_range=[-4, 4, 1])
+    assert ok
+    assert params["functions"][0]["discontinuities"] == [0.0]
+
+    (ok, _), params = _validate("tan(x)", x_range=[-3, 3, 1])
+    assert ok
+    assert params["functions"][0]["discontinuities"] == pytest.approx([-np.pi / 2, np.pi / 2], abs=1e-5)
+
+
+def test_fits_y_range_and_emits_builtin_numbers():
+    (ok, _), params = _validate("x^2", x_range=[-3, 3], y_range=[-100, 100])
+    assert ok
+    y_min, y_max, step = params["y_range"]
+    # The LLM's range would squash the parabola flat, so it's refitted around 0..9
+    assert y_min <= 0 and 9 <= y_max < 20
+    assert all(type(v) in (int, float) for v in params["x_range"] + params["y_range"])
+
+
+def test_rejects_ranges_and_curves_out_of_scale():
+    (ok, error), _ = _validate("x", x_range=[0, MAX_MAGNITUDE * 10])
+    assert not ok and "x_range" in error
+
+    (ok, error), _ = _validate("exp(x)", x_range=[0, 100])
+    assert not ok and "grows beyond" in error
+
+
+def test_rejects_functions_undefined_over_the_range():
+    (ok, error), _ = _validate("log(x)", x_range=[-5, -1])
+    assert not ok and "undefined" in error
@@ -0,0 +1,118 @@
+import time
+
+import pytest
+
+from app.gemini_client import CircuitBreaker, GeminiClient, GeminiUnavailableError, TokenBucket
+from app.gemini_stub import GeminiStub
+
+
+def test_token_bucket_allows_a_burst_then_refuses():
+    bucket = TokenBucket(rate_per_minute=60, burst=3)
+    assert all(bucket.acquire(timeout=0) for _ in range(3))
+    assert not bucket.acquire(timeout=0)
+    assert bucket.wait_seconds() == pytest.approx(1, abs=0.05)
+
+
+def test_token_bucket_refills_while_waiting():
+    bucket = TokenBucket(rate_per_minute=6000, burst=1)
+    assert bucket.acquire(timeout=0)
+    started = time.monotonic()
+    assert bucket.acquire(timeout=1)
+    assert time.monotonic() - started == pytest.approx(0.01, abs=0.05)
+
+
+def test_background_calls_leave_the_reserve():
+    bucket = TokenBucket(rate_per_minute=60, burst=4)
+    assert bucket.acquire(timeout=0, reserve=2)
+    assert bucket.acquire(timeout=0, reserve=2)
+    # Two tokens left: background work stops, interactive requests still get them
+    assert not bucket.acquire(timeout=0, reserve=2)
+    assert bucket.acquire(timeout=0)
+    assert bucket.acquire(timeout=0)
+
+
+def test_breaker_opens_on_failure_rate():
+    breaker = CircuitBreaker(window=4, min_calls=4, failure_rate=0.5, slow_seconds=10, cooldown=30)
+    breaker.record(True, 0.1)
+    breaker.record(True, 0.1)
+    breaker.record(False, 0.1)
+    assert breaker.state == "closed"
+    # A slow success counts as a failure
+    breaker.record(True, 11)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.retry_after() == 30
+
+
+def test_breaker_lets_one_probe_through_after_cooldown():
+    breaker = CircuitBreaker(window=2, min_calls=1, failure_rate=0.5, cooldown=0.05)
+    breaker.record(False, 0.1)
+    assert not breaker.allow()
+    time.sleep(0.06)
+
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record(False, 0.1)
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(True, 0.1)
+    assert breaker.state == "closed"
+    assert breaker.times_opened == 2
+
+
+def test_trip_honours_retry_after():
+    breaker = CircuitBreaker(cooldown=1)
+    breaker.trip(120)
+    assert breaker.state == "open"
+    assert breaker.retry_after() == 120
+
+
+@pytest.fixture
+def stub():
+    stub = GeminiStub(latency=0, jitter=0).start()
+    yield stub
+    stub.stop()
+
+
+def test_open_circuit_stops_requests_reaching_gemini(stub):
+    client = GeminiClient(stub.url)
+    client.limiter = TokenBucket(rate_per_minute=0)
+    client.breaker = CircuitBreaker(window=3, min_calls=3, failure_rate=0.5, cooldown=30)
+
+    stub.error_rate = 1.0
+    for _ in range(3):
+        assert client.post("models/m:generateContent", {}).status_code == 503
+    assert client.degraded
+
+    with pytest.raises(GeminiUnavailableError) as excinfo:
+        client.post("models/m:generateContent", {})
+    assert excinfo.value.retry_after == 30
+    assert stub.requests == 3
+    assert client.stats()["rejected"]["circuit_open"] == 1
+
+
+def test_rate_limited_request_is_refused_without_sending(stub):
+    client = GeminiClient(stub.url)
+    # The next token is a minute away, longer than a request waits for one
+    client.limiter = TokenBucket(rate_per_minute=1, burst=1)
+
+    assert client.post("models/m:generateContent", {}).status_code == 200
+    with pytest.raises(GeminiUnavailableError, match="rate limit"):
+        client.post("models/m:generateContent", {})
+    assert stub.requests == 1
+    assert client.stats()["rejected"]["rate_limited"] == 1
+
+
+def test_background_context_reaches_the_limiter(stub):
+    client = GeminiClient(stub.url)
+    client.limiter = TokenBucket(rate_per_minute=1, burst=3)
+    assert client.post("models/m:generateContent", {}).status_code == 200
+
+    with client.background():
+        # Background calls may not take the last GEMINI_BACKGROUND_RESERVE tokens
+        with pytest.raises(GeminiUnavailableError):
+            client.post("models/m:generateContent", {})
+    assert client.post("models/m:generateContent", {}).status_code == 200
@@ -0,0 +1,113 @@
+import time
+
+import pytest
+
+from app import job_queue, worker
+from app.job_queue import JobFailedError, RenderJobQueue
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "VISIBILITY_TIMEOUT_SECONDS", 0.2)
+    return RenderJobQueue(str(tmp_path / "queue.db"))
+
+
+def test_claim_complete(queue):
+    job_id = queue.enqueue("render_script", {"script_path": "a.py"}, user_id="u1")
+
+    job = queue.claim("w1")
+    assert job["id"] == job_id
+    assert job["payload"] == {"script_path": "a.py"}
+    assert job["attempts"] == 1
+    assert queue.claim("w2") is None
+
+    assert queue.complete(job_id, "w1", {"video_url": "/static/a.mp4"})
+    assert queue.wait(job_id, timeout=1) == {"video_url": "/static/a.mp4"}
+
+
+def test_expired_lease_is_handed_to_another_worker(queue):
+    job_id = queue.enqueue("render_script", {})
+    queue.claim("w1")
+    time.sleep(0.3)
+
+    job = queue.claim("w2")
+    assert job["id"] == job_id
+    assert job["attempts"] == 2
+
+    # The lost worker no longer owns the job
+    assert not queue.heartbeat(job_id, "w1")
+    assert not queue.complete(job_id, "w1", {"video_url": "late"})
+    assert queue.complete(job_id, "w2", {"video_url": "ok"})
+    assert queue.get(job_id)["result"] == {"video_url": "ok"}
+
+
+def test_heartbeat_keeps_the_lease(queue):
+    job_id = queue.enqueue("render_script", {})
+    queue.claim("w1")
+    for _ in range(3):
+        time.sleep(0.1)
+        assert queue.heartbeat(job_id, "w1")
+    assert queue.claim("w2") is None
+
+
+def test_expired_lease_on_final_attempt_fails_the_job(queue):
+    job_id = queue.enqueue("render_script", {}, max_attempts=1)
+    queue.claim("w1")
+    time.sleep(0.3)
+
+    assert queue.claim("w2") is None
+    job = queue.get(job_id)
+    assert job["status"] == "failed"
+    assert "lease expired" in job["error"]
+
+
+def test_failed_attempts_are_retried_until_max_attempts(queue):
+    job_id = queue.enqueue("render_script", {}, max_attempts=2)
+
+    queue.claim("w1")
+    assert queue.fail(job_id, "w1", "RuntimeError: boom")
+    assert queue.get(job_id)["status"] == "queued"
+
+    assert queue.claim("w2")["attempts"] == 2
+    assert queue.fail(job_id, "w2", "RuntimeError: boom again")
+    assert queue.get(job_id)["status"] == "failed"
+    with pytest.raises(JobFailedError, match="boom again"):
+        queue.wait(job_id, timeout=1)
+
+
+def test_claim_order(queue):
+    free = queue.enqueue("render_script", {}, tier="free")
+    paid = queue.enqueue("render_script", {}, tier="paid")
+    poster = queue.enqueue("render_frames", {}, tier="free", boost=1)
+    background = queue.enqueue("render_script", {}, tier="background")
+    later_free = queue.enqueue("render_script", {}, tier="free")
+
+    order = [queue.claim("w")["id"] for _ in range(5)]
+    # Priority first (a boost ties with the next tier up, then by age), oldest first within it
+    assert order == [paid, poster, free, later_free, background]
+
+
+def test_stats_capacity_counts_live_workers(queue):
+    queue.register_worker("w1", 2)
+    queue.register_worker("w2", 3)
+    assert queue.stats()["capacity"] == 5
+
+    queue.unregister_worker("w2")
+    assert queue.stats()["capacity"] == 2
+
+
+def test_worker_jobs_finish_without_remote_storage(tmp_path, monkeypatch):
+    def no_upload(url):
+        raise AssertionError("local storage has nothing to upload to")
+
+    monkeypatch.setattr(worker.video_store, "upload_now", no_upload)
+    monkeypatch.setattr(worker, "render_frames", lambda *args, **kwargs: ["/static/outputs/images/p.png", None])
+    result = worker.render_frames_job({
+        "script_path": str(tmp_path / "chat_1.py"),
+        "script_code": "pass",
+        "quality": "l",
+        "name": "chat_1_poster",
+        "frames": [None, 3],
+    })
+    assert not worker.video_store.remote
+    assert result == {"image_urls": ["/static/outputs/images/p.png", None]}
@@ -0,0 +1,93 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+
+import av
+import numpy as np
+import pytest
+
+from app import postprocess
+
+
+def _write_video(path, frames=30):
+    """A small, loosely encoded MP4 with the moov atom at the end, like Manim's."""
+    with av.open(str(path), mode="w", format="mp4") as output:
+        stream = output.add_stream("mpeg4", rate=Fraction(30))
+        stream.width, stream.height, stream.pix_fmt = 320, 240, "yuv420p"
+        stream.options = {"qscale": "2"}
+        for i in range(frames):
+            image = np.zeros((240, 320, 3), dtype=np.uint8)
+            image[:, (i * 10) % 320:] = (40, 120, 200)
+            output.mux(stream.encode(av.VideoFrame.from_ndarray(image, format="rgb24")))
+        output.mux(stream.encode())
+
+
+def _moov_first(path):
+    data = open(path, "rb").read()
+    return data.index(b"moov") < data.index(b"mdat")
+
+
+@pytest.fixture
+def video(tmp_path, monkeypatch):
+    monkeypatch.setattr(postprocess, "url_to_path", lambda url: str(tmp_path / url.lstrip("/")))
+    monkeypatch.setattr(postprocess, "_listeners", [])
+    monkeypatch.setattr(postprocess, "_defer", False)
+    monkeypatch.setattr(postprocess, "POSTPROCESS_RENDITIONS", [])
+    url = "/videos/scene.mp4"
+    path = tmp_path / "videos" / "scene.mp4"
+    path.parent.mkdir()
+    _write_video(path)
+    return url, str(path)
+
+
+def _render_in_pool(url):
+    # What a batch render does in its pool process after Manim wrote the file
+    return postprocess.postprocess_video_url(url)
+
+
+def test_faststart_inline_and_reencode_in_background(video):
+    url, path = video
+    optimized = []
+    postprocess.on_optimized(optimized.append)
+    original_bytes = os.path.getsize(path)
+    assert not _moov_first(path)
+
+    assert postprocess.postprocess_video_url(url) == url
+    assert _moov_first(path)
+
+    postprocess.wait_for_optimizations(timeout=30)
+    assert optimized == [url]
+    assert os.path.getsize(path) < original_bytes
+    assert _moov_first(path)
+    assert not postprocess._pending
+
+
+def test_rewritten_video_is_not_replaced(video):
+    url, path = video
+    optimized = []
+    postprocess.on_optimized(optimized.append)
+
+    with pytest.raises(postprocess.VideoChangedError):
+        postprocess.optimize_video(path, expected_mtime_ns=os.stat(path).st_mtime_ns - 1)
+    assert optimized == []
+    assert not os.path.exists(f"{path}.tmp.mp4")
+
+
+def test_pool_workers_leave_the_reencode_to_the_parent(video):
+    url, path = video
+    optimized = []
+    postprocess.on_optimized(optimized.append)
+
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context,
+                             initializer=postprocess.defer_optimizations) as pool:
+        assert pool.submit(_render_in_pool, url).result() == url
+    assert _moov_first(path)
+    reencoded_bytes = postprocess.delivery_stats.optimized_bytes
+
+    postprocess.optimize_in_background(url)
+    postprocess.wait_for_optimizations(timeout=30)
+    # The parent's listeners (storage uploads) see the re-encoded file
+    assert optimized == [url]
+    assert postprocess.delivery_stats.optimized_bytes > reencoded_bytes
@@ -0,0 +1,59 @@
+from app.render_cost import script_features
+
+SCENE = '''
+from manim import *
+
+class GeneratedScene(Scene):
+    def construct(self):
+        title = Text("Squares")
+        formula = MathTex("y = x^2")
+        axes = Axes()
+        graph = axes.plot(lambda x: x ** 2, x_range=[0, 10, 0.01])
+        self.play(Write(title))
+        self.play(Create(graph), run_time=3)
+        self.wait(2)
+        self.play(Write(formula))
+        self.wait()
+'''
+
+
+def test_counts_animation_time_and_objects():
+    features = script_features(SCENE)
+
+    # Write 1 + Create 3 + wait 2 + Write 1 + wait() 1
+    assert features["animation_seconds"] == 8
+    assert features["plays"] == 3
+    assert features["text_objects"] == 1
+    assert features["tex_objects"] == 1
+    assert features["plot_ksamples"] == 1.0
+
+
+def test_loops_multiply_their_body():
+    code = '''
+class S(Scene):
+    def construct(self):
+        for i in range(4):
+            self.play(FadeIn(Dot()), run_time=0.5)
+        for label in labels:
+            self.wait(1)
+'''
+    features = script_features(code)
+
+    # range(4) runs 4 times, an unknown iterable is guessed at 3
+    assert features["plays"] == 4
+    assert features["animation_seconds"] == 4 * 0.5 + 3 * 1
+
+
+def test_duration_keyword_and_defaults():
+    code = '''
+class S(Scene):
+    def construct(self):
+        self.wait(duration=1.5)
+        self.play(FadeIn(Square()), run_time=t)
+'''
+    # A non-literal run_time counts as the one-second default
+    assert script_features(code)["animation_seconds"] == 2.5
+
+
+def test_unparseable_script():
+    assert script_features("class S(Scene:\n    pass") is None
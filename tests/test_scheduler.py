@@ -0,0 +1,162 @@
+import threading
+import time
+
+import pytest
+
+from app import scheduler
+from app.scheduler import OverloadedError, RenderScheduler
+
+
+def _wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+class _Blocked:
+    """A scheduler with one slot held, so submitted renders queue up until release()."""
+
+    def __init__(self):
+        self.scheduler = RenderScheduler(workers=1)
+        self.order = []
+        self._threads = []
+        self._holding = threading.Event()
+        self._done = threading.Event()
+        self._submit(self._hold, "blocker", "free", None, queued=False)
+        self._holding.wait(1)
+
+    def _hold(self):
+        self._holding.set()
+        self._done.wait(2)
+
+    def _submit(self, body, user_id, tier, predicted_seconds, queued=True):
+        def run():
+            with self.scheduler.slot(user_id, tier, predicted_seconds):
+                body()
+
+        waiting = self.scheduler.waiting
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        # One at a time, so tickets are queued in submission order
+        if queued:
+            _wait_until(lambda: self.scheduler.waiting == waiting + 1)
+
+    def submit(self, name, user_id, tier="free", predicted_seconds=None):
+        self._submit(lambda: self.order.append(name), user_id, tier, predicted_seconds)
+
+    def release(self):
+        self._done.set()
+        for thread in self._threads:
+            thread.join(2)
+        return self.order
+
+
+def test_admission_picks_quality_and_sheds_load(monkeypatch):
+    monkeypatch.setattr(scheduler, "MAX_LOAD", 2.0)
+    s = RenderScheduler(workers=1)
+
+    assert s.admit("a") == "h"
+    assert s.admit("b") == "m"
+    assert s.load() == 2.0
+    with pytest.raises(OverloadedError) as excinfo:
+        s.admit("c")
+    assert excinfo.value.retry_after >= 1
+
+    s.release("a")
+    assert s.admit("c") == "m"
+
+
+def test_admitted_request_is_counted_once_when_it_renders():
+    s = RenderScheduler(workers=2)
+    s.admit("a")
+    assert s.load() == 0.5
+    with s.slot("a"):
+        assert s.load() == 0.5
+        assert s.user_queue("a")["admitted"] == 1
+    s.release("a")
+    assert s.load() == 0.0
+
+
+def test_per_user_limit(monkeypatch):
+    monkeypatch.setattr(scheduler, "MAX_USER_QUEUED", 2)
+    s = RenderScheduler(workers=10)
+    s.admit("a")
+    s.admit("a")
+    with pytest.raises(OverloadedError):
+        s.admit("a")
+    assert s.admit("b") == "h"
+
+
+def test_users_are_served_fairly():
+    blocked = _Blocked()
+    for name in ("a1", "a2", "a3"):
+        blocked.submit(name, "a")
+    blocked.submit("b1", "b")
+
+    # b's single render doesn't wait behind a's whole burst
+    assert blocked.release() == ["a1", "b1", "a2", "a3"]
+
+
+def test_paid_tier_gets_a_larger_share():
+    blocked = _Blocked()
+    for i in range(5):
+        blocked.submit(f"p{i}", "payer", tier="paid")
+    blocked.submit("f0", "free-user", tier="free")
+
+    order = blocked.release()
+    assert order.index("f0") == 4
+    assert order[:4] == ["p0", "p1", "p2", "p3"]
+
+
+def test_estimate_position():
+    blocked = _Blocked()
+    assert blocked.scheduler.estimate_position("a") == 1
+    blocked.submit("a1", "a")
+    blocked.submit("a2", "a")
+    # A new user lines up behind a's first render, not behind the whole burst
+    assert blocked.scheduler.estimate_position("b") == 2
+    assert blocked.scheduler.estimate_position("a") == 3
+    blocked.release()
+
+
+def test_shorter_renders_go_first(monkeypatch):
+    monkeypatch.setattr(scheduler, "SJF_SCHEDULING", True)
+    blocked = _Blocked()
+    blocked.submit("long", "a", predicted_seconds=120)
+    blocked.submit("short", "a", predicted_seconds=3)
+
+    assert blocked.release() == ["short", "long"]
+
+
+def test_queued_etas_follow_predicted_seconds(monkeypatch):
+    monkeypatch.setattr(scheduler, "SJF_SCHEDULING", True)
+    blocked = _Blocked()
+    blocked.submit("long", "a", predicted_seconds=120)
+    blocked.submit("short", "a", predicted_seconds=3)
+
+    queue = blocked.scheduler.user_queue("a")
+    # Behind the blocker (about one average render left), short first, then long
+    wait = blocked.scheduler.avg_render_seconds
+    assert queue["queue_positions"] == [1, 2]
+    assert queue["queued_eta_seconds"] == pytest.approx([wait + 3, wait + 123], abs=1)
+    blocked.release()
+
+
+def test_spare_slots_take_only_idle_capacity():
+    s = RenderScheduler(workers=4)
+    with s.slot("a"):
+        with s.spare_slots(5) as extra:
+            assert extra == 3
+            assert s.load() == 1.0
+        assert s.running == 1
+    assert s.load() == 0.0
+
+
+def test_spare_slots_yield_to_waiting_renders():
+    blocked = _Blocked()
+    blocked.submit("a1", "a")
+    with blocked.scheduler.spare_slots(2) as extra:
+        assert extra == 0
+    blocked.release()
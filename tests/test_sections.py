@@ -0,0 +1,114 @@
+import subprocess
+import sys
+import threading
+import time
+from fractions import Fraction
+
+import av
+import pytest
+
+from app import renderer
+from app.renderer import RenderCancelledError, render_manim_script_sections
+from app.scheduler import RenderScheduler
+
+SCRIPT = '''
+from manim import *
+
+class GeneratedScene(Scene):
+    def construct(self):
+        self.play(Write(Text("one")))
+        self.wait()
+        self.next_section()
+        self.play(Write(Text("two")))
+        self.wait()
+        self.next_section()
+        self.play(Write(Text("three")))
+        self.wait()
+'''
+
+# Stands in for manim: writes one frame per animation of its -n range, and logs its media dir
+FAKE_MANIM = '''
+import os, sys, time
+from fractions import Fraction
+from pathlib import Path
+import av, numpy as np
+
+args = sys.argv[1:]
+option = lambda name: args[args.index(name) + 1]
+first, last = map(int, option("-n").split(","))
+media_dir, output = option("--media_dir"), option("--output_file")
+with open("manim.log", "a") as log:
+    log.write(f"{media_dir} {first}-{last}\\n")
+if os.getenv("FAKE_MANIM_FAIL") == str(first):
+    sys.exit(1)
+time.sleep(float(os.getenv("FAKE_MANIM_SECONDS", "0")))
+
+path = Path(media_dir, "videos", Path(args[1]).stem, "480p15", output)
+path.parent.mkdir(parents=True, exist_ok=True)
+with av.open(str(path), mode="w", format="mp4") as out:
+    stream = out.add_stream("mpeg4", rate=Fraction(10))
+    stream.width, stream.height, stream.pix_fmt = 64, 48, "yuv420p"
+    for _ in range(last - first + 1):
+        frame = av.VideoFrame.from_ndarray(np.zeros((48, 64, 3), dtype=np.uint8), format="rgb24")
+        out.mux(stream.encode(frame))
+    out.mux(stream.encode())
+'''
+
+
+@pytest.fixture
+def script(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    fake = tmp_path / "fake_manim.py"
+    fake.write_text(FAKE_MANIM)
+    monkeypatch.setattr(renderer, "manim_command", lambda timings_path=None: [sys.executable, str(fake)])
+    monkeypatch.setattr(renderer, "postprocess_video_url", lambda url: url)
+    path = tmp_path / "app" / "static" / "outputs" / "chat_1.py"
+    path.parent.mkdir(parents=True)
+    path.write_text(SCRIPT)
+    return "app/static/outputs/chat_1.py"
+
+
+def _frames(path):
+    with av.open(path) as container:
+        return sum(1 for _ in container.decode(video=0))
+
+
+def test_ranges_render_in_their_own_media_dirs(script):
+    url = render_manim_script_sections(script, quality="l", workers=3)
+
+    assert url == "/static/outputs/videos/chat_1/480p15/scene.mp4"
+    assert _frames("app/static/outputs/videos/chat_1/480p15/scene.mp4") == 6
+    log = sorted(line.split() for line in open("manim.log"))
+    assert [r for _, r in log] == ["0-1", "2-3", "4-5"]
+    assert len({media_dir for media_dir, _ in log}) == 3
+
+
+def test_extra_processes_take_idle_slots(script):
+    slots = RenderScheduler(workers=2)
+    with slots.slot():
+        render_manim_script_sections(script, quality="l", workers=3, slots=slots)
+        # The borrowed slot was given back
+        assert slots.running == 1
+    # One slot to borrow: two ranges
+    assert sorted(line.split()[1] for line in open("manim.log")) == ["0-3", "4-5"]
+
+
+def test_cancel_stops_every_range(script, monkeypatch):
+    monkeypatch.setenv("FAKE_MANIM_SECONDS", "30")
+    cancel = threading.Event()
+    threading.Timer(0.5, cancel.set).start()
+
+    started = time.monotonic()
+    with pytest.raises(RenderCancelledError):
+        render_manim_script_sections(script, quality="l", workers=3, cancel=cancel)
+    assert time.monotonic() - started < 10
+
+
+def test_failed_range_stops_the_others(script, monkeypatch):
+    monkeypatch.setenv("FAKE_MANIM_SECONDS", "30")
+    monkeypatch.setenv("FAKE_MANIM_FAIL", "2")
+
+    started = time.monotonic()
+    with pytest.raises(subprocess.CalledProcessError):
+        render_manim_script_sections(script, quality="l", workers=3)
+    assert time.monotonic() - started < 10
@@ -0,0 +1,134 @@
+import threading
+import time
+
+import pytest
+
+from app import singleflight
+from app.singleflight import IdempotencyConflictError, IdempotencyStore, SingleFlight
+
+
+def _run_concurrently(count, target):
+    results = [None] * count
+
+    def run(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        release.wait(2)
+        return "video"
+
+    threads, results = _run_concurrently(4, lambda: flight.do("prompt", work))
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+
+    assert len(calls) == 1
+    assert sorted(results, key=lambda r: r[1]) == [("video", False)] + [("video", True)] * 3
+
+
+def test_errors_reach_every_waiter_and_the_key_runs_again():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fail():
+        release.wait(2)
+        raise RuntimeError("render failed")
+
+    threads, results = _run_concurrently(3, lambda: flight.do("prompt", fail))
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert flight.do("prompt", lambda: "retried") == ("retried", False)
+
+
+@pytest.fixture
+def store_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(singleflight, "CLAIM_POLL_SECONDS", 0.01)
+    return str(tmp_path / "idempotency.db")
+
+
+def test_retry_gets_the_stored_result(store_path):
+    store = IdempotencyStore(store_path)
+    calls = []
+
+    def work():
+        calls.append(1)
+        return {"chat_id": "c1"}
+
+    assert store.run(("u1", "key"), "fp", work) == {"chat_id": "c1"}
+    # A fresh store stands in for another API process or a restart
+    assert IdempotencyStore(store_path).run(("u1", "key"), "fp", work) == {"chat_id": "c1"}
+    assert len(calls) == 1
+
+
+def test_key_reused_for_another_request_is_rejected(store_path):
+    store = IdempotencyStore(store_path)
+    store.run("key", "fp-a", lambda: {"chat_id": "c1"})
+    with pytest.raises(IdempotencyConflictError):
+        store.run("key", "fp-b", lambda: {"chat_id": "c2"})
+
+
+def test_failures_are_not_stored(store_path):
+    store = IdempotencyStore(store_path)
+
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        store.run("key", "fp", fail)
+    assert store.run("key", "fp", lambda: {"chat_id": "c1"}) == {"chat_id": "c1"}
+
+
+def test_retry_in_another_process_waits_for_the_running_request(store_path):
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(2)
+        return {"chat_id": "c1"}
+
+    first = threading.Thread(target=lambda: IdempotencyStore(store_path).run("key", "fp", work))
+    first.start()
+    started.wait(2)
+
+    threads, results = _run_concurrently(1, lambda: IdempotencyStore(store_path).run("key", "fp", work))
+    time.sleep(0.1)
+    release.set()
+    first.join(2)
+    threads[0].join(2)
+
+    assert results == [{"chat_id": "c1"}]
+    assert len(calls) == 1
+
+
+def test_stale_claim_and_expired_result_run_again(store_path, monkeypatch):
+    monkeypatch.setattr(singleflight, "IDEMPOTENCY_CLAIM_SECONDS", -1)
+    store = IdempotencyStore(store_path, ttl_seconds=-1)
+    # A claim left behind by a process that died
+    store._claim(store._key("lost"), "fp")
+    assert store.run("lost", "fp", lambda: {"chat_id": "c1"}) == {"chat_id": "c1"}
+
+    # The stored result already expired
+    assert store.get("lost", "fp") is None
+    assert store.run("lost", "fp", lambda: {"chat_id": "c2"}) == {"chat_id": "c2"}
@@ -0,0 +1,17 @@
+from app.storage import STORAGE_CACHE_MAX_AGE_SECONDS, object_headers, storage_key
+
+
+def test_content_type_follows_the_file():
+    assert object_headers("app/static/outputs/videos/chat/480p15/turn_1.mp4")["ContentType"] == "video/mp4"
+    assert object_headers("app/static/outputs/images/chat/turn_1_poster.png")["ContentType"] == "image/png"
+    assert object_headers("app/static/outputs/unknown.xyz123")["ContentType"] == "application/octet-stream"
+
+
+def test_overwritten_objects_are_not_cached_as_immutable():
+    cache_control = object_headers("app/static/outputs/videos/chat/480p15/turn_1.mp4")["CacheControl"]
+    assert "immutable" not in cache_control
+    assert cache_control == f"public, max-age={STORAGE_CACHE_MAX_AGE_SECONDS}"
+
+
+def test_storage_key_of_a_static_url():
+    assert storage_key("/static/outputs/videos/chat/480p15/turn_1.mp4") == "outputs/videos/chat/480p15/turn_1.mp4"